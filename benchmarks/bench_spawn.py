@@ -0,0 +1,42 @@
+"""spawn latency of the spawn backends at different parent RSS.
+
+usage: python benchmarks/bench_spawn.py [rss_mb ...]
+"""
+import sys
+import time
+from typing import Dict
+from shshsh import Sh, Session
+
+BACKENDS = ["popen", "posix_spawn"]
+
+
+def bench(backend, cmd: str = "true", number: int = 200) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        Sh(cmd, stdout=None, spawn=backend).wait()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def run(quick: bool = False) -> Dict[str, float]:
+    number = 50 if quick else 200
+    results = {
+        f"spawn.{backend}.us": bench(backend, number=number) for backend in BACKENDS
+    }
+    with Session() as session:
+        results["spawn.session_builtin.us"] = bench(session, "test -e /", number)
+        results["spawn.session_external.us"] = bench(session, "/bin/true", number)
+    return results
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [0, 256, 1024]
+    ballast = []
+    for size in sizes:
+        # touch every page so it is really resident
+        ballast.append(bytearray(b"x") * (size * 1024 * 1024 - sum(map(len, ballast))))
+        costs = "  ".join(f"{b}: {bench(b):8.1f} us" for b in BACKENDS)
+        print(f"rss +{size:>5} MB  {costs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""per-byte cost of the line splitter at different line lengths.
+
+usage: python benchmarks/bench_splitter.py [total_mb]
+"""
+import io
+import sys
+import time
+from typing import Dict
+from shshsh.streamer import bytes_streamer
+
+LINE_LENGTHS = [10, 1_000, 100_000, 10_000_000, 100_000_000]
+
+
+def bench(line_length: int, total: int) -> float:
+    lines = max(total // (line_length + 1), 1)
+    data = (b"x" * line_length + b"\n") * lines
+    stream = io.BytesIO(data)
+    start = time.perf_counter()
+    for _ in bytes_streamer(stream, chunk_size=64 * 1024):
+        pass
+    return (time.perf_counter() - start) / len(data) * 1e9
+
+
+def run(quick: bool = False) -> Dict[str, float]:
+    total = (8 if quick else 100) * 1024 * 1024
+    return {
+        f"splitter.line{line_length}.ns_per_byte": bench(line_length, total)
+        for line_length in LINE_LENGTHS
+    }
+
+
+def main():
+    total = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 100 * 1024 * 1024
+    for line_length in LINE_LENGTHS:
+        print(
+            f"line length {line_length:>11}: {bench(line_length, total):8.3f} ns/byte"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""throughput of data through pipelines, and of python stages per record.
+
+usage: python benchmarks/bench_stream.py [--quick]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+from shshsh import IZ, Sh
+
+LINE_LENGTHS = [10, 100, 1_000, 10_000]
+
+
+def make_input(directory: str, line_length: int, total: int, sep: bytes) -> str:
+    path = os.path.join(directory, f"input-{line_length}-{sep.hex()}")
+    if not os.path.exists(path):
+        line = b"x" * line_length + sep
+        with open(path, "wb") as f:
+            f.write(line * max(total // len(line), 1))
+    return path
+
+
+def same(line: bytes) -> bytes:
+    return line
+
+
+def same_str(line: str) -> str:
+    return line
+
+
+def timed(run: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def sh_sh(path: str):
+    (Sh(f"cat {path}") | Sh("cat", stdout=subprocess.DEVNULL)).wait()
+
+
+def sh_p_sh(path: str):
+    (Sh(f"cat {path}") | same | Sh("cat", stdout=subprocess.DEVNULL)).wait()
+
+
+def p_file(path: str):
+    with open(os.devnull, "wb") as devnull:
+        p = Sh(f"cat {path}") | same
+        p | devnull
+        p.wait()
+
+
+def lines_through(stage: Callable[..., object], path: str, zero: bool = False) -> float:
+    """seconds to push `path` through python stage `stage` into /dev/null"""
+    source = (IZ >> f"cat {path}") if zero else Sh(f"cat {path}")
+
+    def run():
+        with open(os.devnull, "wb") as devnull:
+            p = source | stage
+            p | devnull
+            p.wait()
+
+    return timed(run)
+
+
+def run(quick: bool = False) -> Dict[str, float]:
+    total = (8 if quick else 64) * 1024 * 1024
+    mb = total / 1024 / 1024
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for line_length in LINE_LENGTHS:
+            path = make_input(directory, line_length, total, b"\n")
+            for name, pipeline in (
+                ("sh_sh", sh_sh),
+                ("sh_p_sh", sh_p_sh),
+                ("p_file", p_file),
+            ):
+                results[f"stream.{name}.line{line_length}.mb_per_s"] = mb / timed(
+                    lambda: pipeline(path)
+                )
+        lines = total // 81
+        path = make_input(directory, 80, total, b"\n")
+        for name, stage in (("bytes", same), ("str", same_str)):
+            results[f"stage.{name}.line80.lines_per_s"] = lines / lines_through(
+                stage, path
+            )
+        path = make_input(directory, 80, total, b"\0")
+        results["stage.zero_mode.line80.lines_per_s"] = lines / lines_through(
+            same_str, path, zero=True
+        )
+    return results
+
+
+def main():
+    for name, value in run(quick="--quick" in sys.argv).items():
+        print(f"{name:>40}: {value:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
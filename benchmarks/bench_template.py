@@ -0,0 +1,61 @@
+"""cost of filling a command template, compiled (cached) vs parsing every time.
+
+usage: python benchmarks/bench_template.py
+"""
+import re
+import timeit
+from typing import Dict
+from shshsh.shell import Sh
+
+CMD = "rsync -av --exclude #{exclude} #{} #{host}:#{}/backup"
+PLACEHOLDER = "#{*}"
+
+
+def parse_every_time():
+    # the parsing path without the template cache
+    cmd_list = Sh._split_with_placeholder(CMD, PLACEHOLDER)
+    matcher = Sh._get_placeholder_matcher(placeholder=PLACEHOLDER)
+    args, kwargs = ("src/", "/data"), {"exclude": "*.tmp", "host": "backup01"}
+    curr_args_idx = 0
+    for i, _ in enumerate(cmd_list):
+        for placeholder in re.findall(matcher, cmd_list[i]):
+            key = placeholder[2:-1]
+            if key in kwargs:
+                cmd_list[i] = cmd_list[i].replace(placeholder, str(kwargs[key]))
+            elif not key and curr_args_idx < len(args):
+                cmd_list[i] = cmd_list[i].replace(placeholder, args[curr_args_idx], 1)
+                curr_args_idx += 1
+    return cmd_list
+
+
+def compiled():
+    return Sh._parse_cmd(
+        CMD, PLACEHOLDER, "src/", "/data", exclude="*.tmp", host="backup01"
+    )[1]
+
+
+def construct():
+    return Sh(CMD)("src/", "/data", exclude="*.tmp", host="backup01").cmd
+
+
+def run(quick: bool = False) -> Dict[str, float]:
+    assert parse_every_time() == compiled() == construct()
+    number = 2000 if quick else 20000
+    return {
+        f"template.{func.__name__}.us": timeit.timeit(func, number=number)
+        / number
+        * 1e6
+        for func in (parse_every_time, compiled, construct)
+    }
+
+
+def main():
+    assert parse_every_time() == compiled() == construct()
+    number = 20000
+    for func in (parse_every_time, compiled, construct):
+        cost = timeit.timeit(func, number=number) / number * 1e6
+        print(f"{func.__name__:>16}: {cost:8.2f} us/fill")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""run the benchmark suite and store the results as JSON, or compare two runs.
+
+usage:
+    python benchmarks/run.py [--quick] [--only spawn,stream] [-o results.json]
+    python benchmarks/run.py --compare base.json new.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SUITES = ["spawn", "splitter", "stream", "template"]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(suites: Any, quick: bool) -> Dict[str, Any]:
+    results: Dict[str, float] = {}
+    for suite in suites:
+        module = importlib.import_module(f"bench_{suite}")
+        start = time.perf_counter()
+        results.update(module.run(quick=quick))
+        print(f"{suite}: {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def compare(base_path: str, new_path: str):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'':>44} {base['commit']:>12} {new['commit']:>12}   change")
+    for name, value in new["results"].items():
+        old = base["results"].get(name)
+        if old is None:
+            print(f"{name:>44} {'':>12} {value:12.2f}")
+            continue
+        # costs (us, ns) should go down, rates (per_s) up
+        change = value / old - 1 if old else 0.0
+        better = change > 0 if name.endswith("_per_s") else change < 0
+        mark = " " if abs(change) < 0.05 else "+" if better else "-"
+        print(f"{name:>44} {old:12.2f} {value:12.2f} {change:+8.1%} {mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true", help="less data, fewer runs")
+    parser.add_argument("--only", default=",".join(SUITES), help="suites to run")
+    parser.add_argument("-o", "--output", help="JSON file, default stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run([suite for suite in args.only.split(",") if suite], args.quick)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
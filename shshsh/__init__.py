@@ -1,6 +1,23 @@
-__all__ = ["Sh", "I", "stderr", "stdout", "Pipe", "utils", "keep"]
+__all__ = [
+    "Sh",
+    "I",
+    "L",
+    "stderr",
+    "stdout",
+    "Pipe",
+    "psub",
+    "utils",
+    "keep",
+    "pmap",
+    "mux",
+    "fork_stream",
+]
 
-from .shell import Sh, stderr, stdout, keep
-from .pipe import Pipe
-from .quick import I, IZ
+from .shell import Sh, stderr, stdout, keep, fork_stream
+from .pipe import Pipe, psub
+from .quick import I, IZ, L
+from .parallel import pmap
+from .mux import mux
+from .session import Session, SessionPool
+from .cache import CachePolicy
 from . import utils
@@ -0,0 +1,417 @@
+"""memoize deterministic commands on disk, see `CachePolicy`."""
+from typing import IO, Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+import hashlib
+import json
+import os
+import selectors
+import shutil
+import stat
+import subprocess
+import tempfile
+import time
+from threading import Event, Lock, Thread
+from .fdcopy import copy_fd
+from .streamer import write_all
+
+_CHUNK = 64 * 1024
+_META = "meta.json"
+
+
+def _default_root() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "shshsh")
+
+
+def _hash_fd(fd: int, spool: Optional[IO[bytes]] = None) -> str:
+    """sha256 of `fd` from its offset to EOF, copied to `spool` if given"""
+    digest = hashlib.sha256()
+    while True:
+        data = os.read(fd, _CHUNK)
+        if not data:
+            return digest.hexdigest()
+        digest.update(data)
+        if spool is not None:
+            spool.write(data)
+
+
+class _CachedProcess:
+    """the `subprocess.Popen` subset `Sh` uses, for a command with a `CachePolicy`.
+
+    replays a cache entry without running anything (`pid` is None then), or runs
+    the command with its stdout/stderr going through a thread which also writes
+    them to a new entry. it is done once all output is written where it goes.
+    """
+
+    def __init__(self, args: List[str], proc: Optional[subprocess.Popen] = None):
+        self.args = args
+        self.returncode: Optional[int] = None
+        self.stdin: Optional[IO[bytes]] = None
+        self.stdout: Optional[IO[bytes]] = None
+        self.stderr: Optional[IO[bytes]] = None
+        self.replayed = proc is None
+        self._proc = proc
+        self._exited = Event()
+        self._on_exit: List[Callable[[], Any]] = []
+        self._on_exit_lock = Lock()
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._proc.pid if self._proc is not None else None
+
+    def _exit(self, code: int):
+        with self._on_exit_lock:
+            self.returncode = code
+            self._exited.set()
+        for callback in self._on_exit:
+            callback()
+
+    def on_exit(self, callback: Callable[[], Any]):
+        """call `callback` once all is done, see `shshsh.reaper.Reaper.watch`"""
+        with self._on_exit_lock:
+            if not self._exited.is_set():
+                self._on_exit.append(callback)
+                return
+        callback()
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)  # type: ignore
+        assert self.returncode is not None
+        return self.returncode
+
+    def send_signal(self, sig: int):
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.send_signal(sig)
+
+    def terminate(self):
+        self.send_signal(15)
+
+    def kill(self):
+        self.send_signal(9)
+
+
+def _sink(target: Any, default: int) -> Tuple[Optional[int], bool, Optional[IO[bytes]]]:
+    """(fd output for `target` is written to, if that fd is ours to close, the
+    file the caller reads when it is `subprocess.PIPE`)"""
+    if target == subprocess.PIPE:
+        r, w = os.pipe()
+        return w, True, os.fdopen(r, "rb")
+    if target == subprocess.DEVNULL:
+        return None, False, None
+    if target is None:
+        return default, False, None
+    if isinstance(target, int):
+        return target, False, None
+    # e.g. sys.stderr, written by fd from now on
+    target.flush()
+    return target.fileno(), False, None
+
+
+class CachePolicy:
+    """replay the stdout, stderr and exit code of a command run before.
+
+    the key of a run is the filled argv, the cwd, the values of the `env` keys,
+    the content of stdin and the mtime and size (or sha256 with `hash_inputs`) of
+    the `inputs` files, relative to the cwd. stdin which is not a regular file is
+    read whole before the command starts, and a stdin written after it started
+    (`subprocess.PIPE`) cannot be cached. on a hit nothing is spawned and piped
+    stdout is read from the cache file.
+
+    entries live in `root`, the least recently used ones are removed past
+    `max_size` bytes, and entries older than `ttl` seconds are not replayed.
+    runs killed by a signal, or whose output was not read to the end, are not
+    stored.
+
+    >>> import tempfile
+    >>> from shshsh import Sh
+    >>> policy = CachePolicy(root=tempfile.mkdtemp())
+    >>> Sh("date +%N", cache=policy).stdout.read() == Sh("date +%N", cache=policy).stdout.read()
+    True
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        max_size: int = 1024 * 1024 * 1024,
+        ttl: Optional[float] = None,
+        env: Sequence[str] = (),
+        inputs: Sequence[str] = (),
+        hash_inputs: bool = False,
+    ) -> None:
+        self.root = root or _default_root()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.env = env
+        self.inputs = inputs
+        self.hash_inputs = hash_inputs
+        self.hits = self.misses = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._evict_lock = Lock()
+
+    def _input_state(self, path: str, cwd: str) -> Any:
+        path = os.path.join(cwd, path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if self.hash_inputs and stat.S_ISREG(st.st_mode):
+            with open(path, "rb") as f:
+                return _hash_fd(f.fileno())
+        return [st.st_mtime_ns, st.st_size]
+
+    def key(
+        self,
+        cmd: List[str],
+        cwd: str,
+        env: Mapping[str, str],
+        stdin: Optional[str] = None,
+        merged: bool = False,
+    ) -> str:
+        """the entry of a run, `stdin` is its digest and `merged` if stderr goes
+        to stdout"""
+        cwd = os.path.abspath(cwd)
+        parts = {
+            "cmd": cmd,
+            "cwd": cwd,
+            "env": {name: env.get(name) for name in self.env},
+            "stdin": stdin,
+            "merged": merged,
+            "inputs": {path: self._input_state(path, cwd) for path in self.inputs},
+        }
+        data = json.dumps(parts, sort_keys=True).encode("utf8")
+        return hashlib.sha256(data).hexdigest()
+
+    def _expired(self, meta: Dict[str, Any]) -> bool:
+        return self.ttl is not None and time.time() - meta["created"] > self.ttl
+
+    def _lookup(self, key: str) -> Optional[Tuple[int, Dict[str, IO[bytes]]]]:
+        """exit code and open output files of entry `key`, if it can be replayed"""
+        path = os.path.join(self.root, key)
+        files: Dict[str, IO[bytes]] = {}
+        try:
+            with open(os.path.join(path, _META)) as f:
+                meta = json.load(f)
+            if self._expired(meta):
+                shutil.rmtree(path, ignore_errors=True)
+                return None
+            for name in meta["streams"]:
+                files[name] = open(os.path.join(path, name), "rb")
+            # the modification time of the meta file is the last use
+            os.utime(os.path.join(path, _META))
+        except (FileNotFoundError, ValueError, KeyError):
+            # not stored, or removed meanwhile
+            for file in files.values():
+                file.close()
+            return None
+        return meta["code"], files
+
+    def _store(self, key: str, entry: str, code: int, streams: List[str]):
+        with open(os.path.join(entry, _META), "w") as f:
+            json.dump({"code": code, "created": time.time(), "streams": streams}, f)
+        try:
+            os.rename(entry, os.path.join(self.root, key))
+        except OSError:
+            # stored by another run meanwhile
+            shutil.rmtree(entry, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """remove expired entries, and the least recently used past `max_size`"""
+        with self._evict_lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if name.startswith("."):
+                    continue
+                path = os.path.join(self.root, name)
+                try:
+                    used = os.stat(os.path.join(path, _META)).st_mtime
+                    with open(os.path.join(path, _META)) as f:
+                        expired = self._expired(json.load(f))
+                    size = sum(
+                        os.stat(os.path.join(path, file)).st_size
+                        for file in os.listdir(path)
+                    )
+                except (FileNotFoundError, ValueError, KeyError):
+                    # removed meanwhile
+                    continue
+                if expired:
+                    shutil.rmtree(path, ignore_errors=True)
+                    continue
+                entries.append((used, size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def _stdin(stdin: Any) -> Tuple[Optional[str], Any]:
+        """digest of `stdin`, and the copy the command reads if it was a pipe"""
+        if stdin is None or stdin == subprocess.DEVNULL:
+            return None, None
+        assert (
+            stdin != subprocess.PIPE
+        ), "cannot cache a command whose stdin is written after it starts"
+        fd = stdin if isinstance(stdin, int) else stdin.fileno()
+        if stat.S_ISREG(os.fstat(fd).st_mode):
+            offset = os.lseek(fd, 0, os.SEEK_CUR)
+            digest = _hash_fd(fd)
+            os.lseek(fd, offset, os.SEEK_SET)
+            return digest, None
+        spool = tempfile.TemporaryFile()
+        digest = _hash_fd(fd, spool)
+        spool.seek(0)
+        return digest, spool
+
+    def spawn(
+        self,
+        spawn: Callable[..., subprocess.Popen],
+        cmd: List[str],
+        stdin: Any,
+        stdout: Any,
+        stderr: Any,
+        cwd: str,
+        env: Mapping[str, str],
+        encoded_env: Any,
+    ) -> _CachedProcess:
+        """replay `cmd` if it is cached, else run it with `spawn` and store it"""
+        digest, spool = self._stdin(stdin)
+        merged = stderr == subprocess.STDOUT
+        key = self.key(cmd, cwd, env, digest, merged)
+        targets = {"stdout": stdout} if merged else {"stdout": stdout, "stderr": stderr}
+        found = self._lookup(key)
+        if found is not None:
+            self.hits += 1
+            if spool is not None:
+                spool.close()
+            return self._replay(cmd, targets, *found)
+        self.misses += 1
+        try:
+            proc = spawn(
+                cmd,
+                stdin=stdin if spool is None else spool,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT if merged else subprocess.PIPE,
+                cwd=cwd,
+                env=encoded_env,
+            )
+        finally:
+            if spool is not None:
+                spool.close()
+        res = _CachedProcess(cmd, proc)
+        entry = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        streams = []
+        for name, target in targets.items():
+            sink, owned, reader = _sink(target, 1 if name == "stdout" else 2)
+            setattr(res, name, reader)
+            file = open(os.path.join(entry, name), "wb")
+            streams.append((name, getattr(proc, name), sink, owned, file))
+        Thread(
+            target=self._record,
+            args=(res, streams, key, entry),
+            name="shshsh-cache",
+            daemon=True,
+        ).start()
+        return res
+
+    def _replay(
+        self,
+        cmd: List[str],
+        targets: Dict[str, Any],
+        code: int,
+        files: Dict[str, IO[bytes]],
+    ) -> _CachedProcess:
+        res = _CachedProcess(cmd)
+        copies = []
+        for name, target in targets.items():
+            file = files[name]
+            if target == subprocess.PIPE:
+                # read straight from the cache
+                setattr(res, name, file)
+                continue
+            sink, _, _ = _sink(target, 1 if name == "stdout" else 2)
+            if sink is None:
+                file.close()
+            else:
+                copies.append((file, sink))
+        if not copies:
+            res._exit(code)
+            return res
+
+        def copy():
+            try:
+                for file, sink in copies:
+                    with file:
+                        try:
+                            copy_fd(file.fileno(), sink)
+                        except BrokenPipeError:
+                            pass
+            finally:
+                res._exit(code)
+
+        Thread(target=copy, name="shshsh-cache", daemon=True).start()
+        return res
+
+    def _record(
+        self,
+        res: _CachedProcess,
+        streams: List[Tuple[str, IO[bytes], Optional[int], bool, IO[bytes]]],
+        key: str,
+        entry: str,
+    ):
+        complete = False
+        try:
+            complete = self._tee(streams)
+        finally:
+            for _, source, _, _, file in streams:
+                source.close()
+                file.close()
+            assert res._proc is not None
+            code = res._proc.wait()
+            try:
+                # stored before the reader sees EOF, so a run after it replays
+                if complete and code >= 0:
+                    self._store(key, entry, code, [stream[0] for stream in streams])
+                else:
+                    shutil.rmtree(entry, ignore_errors=True)
+            finally:
+                for _, _, sink, owned, _ in streams:
+                    if owned:
+                        os.close(sink)  # type: ignore
+                res._exit(code)
+
+    @staticmethod
+    def _tee(streams: List[Tuple[str, IO[bytes], Optional[int], bool, IO[bytes]]]):
+        """copy each output of the command to its file and its sink until EOF.
+
+        :return: if all output was written to the sinks.
+        """
+        complete = True
+        with selectors.DefaultSelector() as selector:
+            for stream in streams:
+                selector.register(stream[1], selectors.EVENT_READ, stream)
+            while selector.get_map():
+                for selected, _ in selector.select():
+                    _, source, sink, _, file = selected.data
+                    data = os.read(selected.fd, _CHUNK)
+                    if data:
+                        file.write(data)
+                        try:
+                            if sink is not None:
+                                write_all(sink, data)
+                            continue
+                        except BrokenPipeError:
+                            # nothing reads it anymore, the command gets EPIPE
+                            # as it would without the cache
+                            complete = False
+                    selector.unregister(source)
+                    source.close()
+        return complete
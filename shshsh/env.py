@@ -0,0 +1,116 @@
+from typing import Dict, Iterator, Mapping, Optional, Any
+import os
+
+
+def _encode(env: Mapping[str, str]) -> Dict[bytes, bytes]:
+    return {os.fsencode(k): os.fsencode(v) for k, v in env.items()}
+
+
+class EnvSnapshot(Mapping[str, str]):
+    """immutable environment of commands.
+
+    the encoded form handed to the spawn is built once and reused by every
+    command sharing the snapshot.
+    """
+
+    def __init__(self, env: Mapping[str, str]) -> None:
+        self._data: Dict[str, str] = dict(env)
+        self._encoded: Optional[Dict[bytes, bytes]] = None
+
+    def __getitem__(self, key: str) -> str:
+        return self._data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"EnvSnapshot({self._data!r})"
+
+    @property
+    def encoded(self) -> Dict[bytes, bytes]:
+        if self._encoded is None:
+            self._encoded = _encode(self._data)
+        return self._encoded
+
+    def overlay(self, update: Optional[Mapping[str, str]]) -> "EnvSnapshot":
+        """a new snapshot with `update` on top, only `update` is encoded again"""
+        if not update:
+            return self
+        res = EnvSnapshot.__new__(EnvSnapshot)
+        res._data = {**self._data, **update}
+        res._encoded = (
+            None if self._encoded is None else {**self._encoded, **_encode(update)}
+        )
+        return res
+
+
+class EnvDict(Dict[str, str]):
+    """mutable environment (`global_vars.ENV`), its snapshot is cached until it changes"""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._snapshot: Optional[EnvSnapshot] = None
+
+    def snapshot(self) -> EnvSnapshot:
+        if self._snapshot is None:
+            self._snapshot = EnvSnapshot(self)
+        return self._snapshot
+
+    def _changed(self):
+        self._snapshot = None
+
+    def __setitem__(self, key: str, value: str) -> None:
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key: str) -> None:
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other: Any) -> "EnvDict":  # type: ignore
+        self.update(other)
+        return self
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def pop(self, *args: Any) -> Any:
+        try:
+            return super().pop(*args)
+        finally:
+            self._changed()
+
+    def popitem(self) -> Any:
+        try:
+            return super().popitem()
+        finally:
+            self._changed()
+
+    def setdefault(self, key: str, default: Optional[str] = None) -> str:  # type: ignore
+        if key in self:
+            return self[key]
+        if not isinstance(default, str):
+            # like `os.environ`, a value must be a str
+            raise TypeError(f"str expected, not {type(default).__name__}")
+        self[key] = default
+        return default
+
+    def clear(self) -> None:
+        super().clear()
+        self._changed()
+
+
+def snapshot(
+    env: Mapping[str, str], update: Optional[Mapping[str, str]] = None
+) -> EnvSnapshot:
+    if isinstance(env, EnvSnapshot):
+        base = env
+    elif isinstance(env, EnvDict):
+        base = env.snapshot()
+    else:
+        base = EnvSnapshot(env)
+    return base.overlay(update)
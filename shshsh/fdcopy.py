@@ -0,0 +1,70 @@
+import errno
+import fcntl
+import os
+import stat
+
+_CHUNK = 1024 * 1024
+# errors meaning "this kind of copy is not possible between these fds"
+_UNSUPPORTED = {
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTSOCK,
+}
+
+
+def _splice(src: int, dst: int) -> int:
+    return os.splice(src, dst, _CHUNK)  # type: ignore
+
+
+def _copy_file_range(src: int, dst: int) -> int:
+    return os.copy_file_range(src, dst, _CHUNK)  # type: ignore
+
+
+def _sendfile(src: int, dst: int) -> int:
+    return os.sendfile(dst, src, None, _CHUNK)  # type: ignore
+
+
+def _read_write(src: int, dst: int) -> int:
+    data = os.read(src, _CHUNK)
+    with memoryview(data) as view:
+        while view:
+            view = view[os.write(dst, view) :]
+    return len(data)
+
+
+def _methods(src: int, dst: int):
+    src_mode, dst_mode = os.fstat(src).st_mode, os.fstat(dst).st_mode
+    if hasattr(os, "splice") and (stat.S_ISFIFO(src_mode) or stat.S_ISFIFO(dst_mode)):
+        yield _splice
+    if stat.S_ISREG(src_mode):
+        # copy_file_range refuses an O_APPEND destination with EBADF
+        append = fcntl.fcntl(dst, fcntl.F_GETFL) & os.O_APPEND
+        if hasattr(os, "copy_file_range") and stat.S_ISREG(dst_mode) and not append:
+            yield _copy_file_range
+        if hasattr(os, "sendfile"):
+            yield _sendfile
+    yield _read_write
+
+
+def copy_fd(src: int, dst: int) -> int:
+    """move everything from `src` to `dst` until EOF, inside the kernel when possible.
+
+    uses splice (one side is a pipe), copy_file_range (file to file) or sendfile
+    (from a file), and falls back to read/write when none applies.
+
+    :return: bytes copied.
+    """
+    total = 0
+    for method in _methods(src, dst):
+        try:
+            while True:
+                n = method(src, dst)
+                if not n:
+                    return total
+                total += n
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED or method is _read_write:
+                raise
+    return total
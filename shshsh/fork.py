@@ -0,0 +1,295 @@
+from typing import Any, List, Literal, Optional, Tuple, Union, TYPE_CHECKING
+from threading import Condition, Thread
+import io
+import os
+import tempfile
+from .streamer import write_all
+
+if TYPE_CHECKING:
+    from .shell import Sh
+    from .streamer import P
+
+Mode = Literal["block", "drop", "spill"]
+
+# most bytes handed to a consumer which may fall behind at once
+_PIECE = 65536
+
+
+class _Branch:
+    def __init__(self, target: Any, mode: Mode, fd: int, close_fd: bool) -> None:
+        self.target = target
+        self.mode = mode
+        self.fd = fd
+        self.close_fd = close_fd
+        # absolute stream offset of the next byte to hand to this consumer
+        self.pos = 0
+        self.done = False
+        self.dropped = 0
+        # drop: skip to the next separator after a drop
+        self.resync = False
+        # drop: the last piece handed out ends inside a record (a long one), and
+        # if that record was dropped a separator is written before the next piece
+        self.partial = False
+        self.cut = False
+        # spill: consumer is behind, data goes through `spill` instead of the ring
+        self.spill: Optional[Any] = None
+        self.spilled = 0
+        self.spill_read = 0
+
+
+class fork_stream:
+    """tee one stage's output to several consumers, `sh | fork_stream(a, b, ...)`.
+
+    the producer is read once into a shared ring buffer of `capacity` bytes, and
+    each consumer is fed from its own position in it. a consumer is a command
+    (str or Sh), a python function (or P) or a file, optionally given as
+    `(consumer, mode)`:
+
+    - "block": the producer waits for it (default).
+    - "drop": when it falls more than the ring behind, pending data is dropped and
+      it resumes after the next `sep`, `dropped` counts the bytes lost. it is only
+      handed whole records, but records longer than 64 KiB (or half the ring) may
+      be cut.
+    - "spill": when it falls behind, its data goes to a temp file until it catches up.
+    """
+
+    def __init__(
+        self,
+        *consumers: Any,
+        capacity: int = 4 * 1024 * 1024,
+        sep: bytes = b"\n",
+    ) -> None:
+        self.consumers = consumers
+        self.capacity = capacity
+        self.sep = sep
+        self.outputs: List[Union["Sh", "P", io.IOBase]] = []
+        self._branches: List[_Branch] = []
+        self._threads: List[Thread] = []
+        self._ring = bytearray(capacity)
+        self._end = 0
+        self._eof = False
+        self._cond = Condition()
+        # the stage read, kept alive (with its stdout) until it is done
+        self._prev: Any = None
+
+    def __getitem__(self, i: int) -> Union["Sh", "P", io.IOBase]:
+        return self.outputs[i]
+
+    def __len__(self) -> int:
+        return len(self.outputs)
+
+    @property
+    def dropped(self) -> List[int]:
+        return [branch.dropped for branch in self._branches]
+
+    def _connect(self, consumer: Any, mode: Mode) -> _Branch:
+        from .shell import Sh
+        from .streamer import P
+        from . import global_vars
+
+        if isinstance(consumer, io.IOBase):
+            consumer.flush()
+            self.outputs.append(consumer)
+            return _Branch(consumer, mode, consumer.fileno(), close_fd=False)
+        out_fd, in_fd = os.pipe()
+        if isinstance(consumer, str):
+            consumer = Sh(consumer, cwd=global_vars.CWD, env=global_vars.ENV)
+        elif not isinstance(consumer, (Sh, P)):
+            consumer = P(consumer)
+        if isinstance(consumer, Sh):
+            consumer.set_stdin(out_fd)
+            consumer.run()
+            os.close(out_fd)
+        else:
+            consumer.set_source(os.fdopen(out_fd, "rb"))
+            consumer.run()
+        self.outputs.append(consumer)
+        return _Branch(consumer, mode, in_fd, close_fd=True)
+
+    def start(self, src_fd: int, close: bool = False):
+        """read `src_fd` until EOF and feed all consumers, in background threads"""
+        assert not self._threads, "fork_stream already started"
+        for consumer in self.consumers:
+            mode: Mode = "block"
+            if isinstance(consumer, tuple):
+                consumer, mode = consumer
+            assert mode in ("block", "drop", "spill"), f"unknown mode: {mode}"
+            self._branches.append(self._connect(consumer, mode))
+        self._threads = [Thread(target=self._read, args=(src_fd, close), daemon=True)]
+        self._threads += [
+            Thread(target=self._feed, args=(branch,), daemon=True)
+            for branch in self._branches
+        ]
+        for t in self._threads:
+            t.start()
+        return self
+
+    def wait(self, timeout: Optional[float] = None):
+        for t in self._threads:
+            t.join(timeout)
+        for output in self.outputs:
+            if not isinstance(output, io.IOBase):
+                output.wait()
+        return self
+
+    def _lowest(self) -> int:
+        """lowest offset still needed in the ring"""
+        lowest = self._end
+        for branch in self._branches:
+            if not branch.done and branch.spill is None:
+                lowest = min(lowest, branch.pos)
+        return lowest
+
+    def _make_room(self, size: int):
+        # consumers which may fall behind give up their place in the ring
+        for branch in self._branches:
+            if branch.done or branch.mode == "block" or branch.spill is not None:
+                continue
+            if self._end + size - branch.pos <= self.capacity:
+                continue
+            if branch.mode == "drop":
+                branch.dropped += self._end - branch.pos
+                branch.resync = True
+                # the consumer has the start of a record, which is now cut
+                branch.cut = branch.cut or branch.partial
+                branch.partial = False
+                branch.pos = self._end
+            else:
+                branch.spill = tempfile.TemporaryFile()
+                self._spill(branch, branch.pos, self._end)
+                branch.pos = self._end
+
+    def _spill(self, branch: _Branch, start: int, end: int):
+        assert branch.spill
+        for a, b in self._slices(start, end):
+            branch.spill.write(self._ring[a:b])
+        branch.spill.flush()
+        branch.spilled += end - start
+
+    def _slices(self, start: int, end: int) -> List[Tuple[int, int]]:
+        a, b = start % self.capacity, end % self.capacity
+        if end - start == 0:
+            return []
+        if a < b:
+            return [(a, b)]
+        return [(a, self.capacity), (0, b)]
+
+    def _read(self, src_fd: int, close: bool):
+        try:
+            self._read_all(src_fd)
+        finally:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+            if close:
+                os.close(src_fd)
+
+    def _read_all(self, src_fd: int):
+        with memoryview(self._ring) as ring:
+            while True:
+                with self._cond:
+                    self._make_room(1)
+                    while self._end - self._lowest() >= self.capacity:
+                        self._cond.wait()
+                        self._make_room(1)
+                    start = self._end % self.capacity
+                    free = self.capacity - (self._end - self._lowest())
+                    size = min(free, self.capacity - start)
+                n = os.readv(src_fd, [ring[start : start + size]])
+                with self._cond:
+                    if not n:
+                        return
+                    for branch in self._branches:
+                        if branch.spill is not None and not branch.done:
+                            self._spill(branch, self._end, self._end + n)
+                            branch.pos = self._end + n
+                    self._end += n
+                    self._cond.notify_all()
+
+    def _next_piece(self, branch: _Branch) -> Optional[bytes]:
+        """under the lock: wait for data, return a spilled piece or None to write from the ring"""
+        while True:
+            if branch.spill is not None:
+                if branch.spill_read < branch.spilled:
+                    return os.pread(
+                        branch.spill.fileno(),
+                        min(branch.spilled - branch.spill_read, 1024 * 1024),
+                        branch.spill_read,
+                    )
+                # caught up, back to the ring
+                branch.spill.close()
+                branch.spill = None
+                branch.spilled = branch.spill_read = 0
+                branch.pos = self._end
+            if branch.resync and branch.pos < self._end:
+                for a, b in self._slices(branch.pos, self._end):
+                    idx = self._ring.find(self.sep, a, b)
+                    if idx >= 0:
+                        skipped = idx + len(self.sep) - a
+                        branch.dropped += skipped
+                        branch.pos += skipped
+                        branch.resync = False
+                        break
+                    branch.dropped += b - a
+                    branch.pos += b - a
+                continue
+            if branch.pos < self._end or self._eof:
+                return None
+            self._cond.wait()
+
+    def _records(self, branch: _Branch) -> Optional[bytes]:
+        """under the lock: the whole records a "drop" consumer is given next, or
+        None to wait for the end of one"""
+        limit = min(_PIECE, self.capacity // 2)
+        end = min(self._end, branch.pos + limit)
+        data = b"".join(self._ring[a:b] for a, b in self._slices(branch.pos, end))
+        cut = data.rfind(self.sep)
+        if cut >= 0:
+            data = data[: cut + len(self.sep)]
+        elif len(data) < limit and not self._eof:
+            return None
+        branch.pos += len(data)
+        branch.partial = not data.endswith(self.sep)
+        if branch.cut:
+            branch.cut = False
+            data = self.sep + data
+        return data
+
+    def _feed(self, branch: _Branch):
+        try:
+            with memoryview(self._ring) as ring:
+                while True:
+                    with self._cond:
+                        piece = self._next_piece(branch)
+                        if piece is None:
+                            if branch.pos >= self._end:
+                                return
+                            a, b = self._slices(branch.pos, self._end)[0]
+                            if branch.mode == "drop":
+                                piece = self._records(branch)
+                                if piece is None:
+                                    self._cond.wait()
+                                    continue
+                            elif branch.mode != "block":
+                                # the ring may move on while this one is stuck in write
+                                piece = bytes(ring[a : min(b, a + _PIECE)])
+                                branch.pos += len(piece)
+                        elif branch.spill is not None:
+                            branch.spill_read += len(piece)
+                    if piece is not None:
+                        write_all(branch.fd, piece)
+                        continue
+                    written = os.write(branch.fd, ring[a:b])
+                    with self._cond:
+                        branch.pos += written
+                        self._cond.notify_all()
+        except BrokenPipeError:
+            pass
+        finally:
+            with self._cond:
+                branch.done = True
+                if branch.spill is not None:
+                    branch.spill.close()
+                self._cond.notify_all()
+            if branch.close_fd:
+                os.close(branch.fd)
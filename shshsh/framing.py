@@ -0,0 +1,304 @@
+"""how records are cut out of a byte stream, and written back to one.
+
+by default records end with a separator (`P(sep=...)`, `Sh.iter(sep=...)`), which
+is `Delimited`, except that a framing gives no empty record after the last
+separator at EOF.
+
+binary data reads faster with framings which need no scanning at all,
+`FixedWidth` records or `LengthPrefixed` frames. a separator which varies is a
+`RegexDelimited`.
+"""
+from typing import IO, Any, Iterable, List, Literal, Optional, Pattern, Union
+from abc import ABC, abstractmethod
+import re
+import struct
+from .streamer import LineTooLongError, Splitter
+
+try:
+    from re import _parser as _sre_parse  # type: ignore
+except ImportError:  # before python 3.11
+    import sre_parse as _sre_parse  # type: ignore
+
+# one byte each, repeating them gives a separator whose prefixes all match
+_BYTE_CLASSES = (
+    _sre_parse.LITERAL,
+    _sre_parse.NOT_LITERAL,
+    _sre_parse.IN,
+    _sre_parse.ANY,
+)
+
+
+class FramingError(Exception):
+    ...
+
+
+class Framing(ABC):
+    """base of framings: a `Splitter` to read records, `encode` to write one"""
+
+    @abstractmethod
+    def splitter(self, stream: IO[bytes], **kwargs: Any) -> Splitter:
+        ...
+
+    @abstractmethod
+    def encode(self, record: bytes) -> bytes:
+        ...
+
+
+class _FramedSplitter(Splitter):
+    """`Splitter` of a framing: records are decoded one by one, and the last
+    one is given at EOF only if it is not empty"""
+
+    def _tail(self) -> Iterable[Any]:
+        if self._start == self._end:
+            return ()
+        return self._last()
+
+    def _last(self) -> Iterable[Any]:
+        """the records of the data left at EOF, which is not empty"""
+        tail = bytes(self._buf[self._start : self._end])
+        self._start = self._end
+        return self._records(tail, [tail])
+
+    def _records(self, block: bytes, lines: List[bytes]) -> Iterable[Any]:
+        if self.stats is not None:
+            self.stats.records += len(lines)
+        if not self.encoding:
+            return lines
+        texts = [line.decode(self.encoding) for line in lines]
+        if self.with_raw:
+            return zip(texts, lines)
+        return texts
+
+
+class _DelimitedSplitter(_FramedSplitter):
+    # records are cut and decoded as by `Splitter`
+    _take = Splitter._take
+    _records = Splitter._records
+    _last = Splitter._tail
+
+
+class Delimited(Framing):
+    """records ended by `sep`, which may be several bytes"""
+
+    def __init__(self, sep: bytes = b"\n") -> None:
+        assert sep, "sep should not be empty"
+        self.sep = sep
+
+    def splitter(self, stream: IO[bytes], **kwargs: Any) -> Splitter:
+        return _DelimitedSplitter(stream, sep=self.sep, **kwargs)
+
+    def encode(self, record: bytes) -> bytes:
+        return record + self.sep
+
+
+class _FixedWidthSplitter(_FramedSplitter):
+    def __init__(self, stream: IO[bytes], width: int, **kwargs: Any) -> None:
+        super().__init__(stream, **kwargs)
+        self.width = width
+
+    def _take(self) -> Iterable[Any]:
+        width = self.width
+        size = (self._end - self._start) // width * width
+        if not size:
+            return ()
+        with memoryview(self._buf) as view:
+            block = view[self._start : self._start + size].tobytes()
+        self._start += size
+        return self._records(
+            block, [block[i : i + width] for i in range(0, size, width)]
+        )
+
+
+class FixedWidth(Framing):
+    """records of exactly `width` bytes, nothing is searched.
+
+    a shorter record written is padded with `pad`, or is an error without it.
+    """
+
+    def __init__(self, width: int, pad: Optional[bytes] = None) -> None:
+        assert width > 0, "width should be positive"
+        assert pad is None or len(pad) == 1, "pad should be one byte"
+        self.width = width
+        self.pad = pad
+
+    def splitter(self, stream: IO[bytes], **kwargs: Any) -> Splitter:
+        return _FixedWidthSplitter(stream, self.width, **kwargs)
+
+    def encode(self, record: bytes) -> bytes:
+        if len(record) == self.width:
+            return record
+        if len(record) > self.width or self.pad is None:
+            raise FramingError(
+                f"record of {len(record)} bytes, fixed width is {self.width}"
+            )
+        return record.ljust(self.width, self.pad)
+
+
+def _read_varint(buf: bytearray, pos: int, end: int):
+    """(value, position after it), or None if it is not complete before `end`"""
+    value = shift = 0
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise FramingError("varint longer than 64 bits")
+    return None
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+_PREFIXES = {"u32": struct.Struct(">I"), "u32le": struct.Struct("<I")}
+
+
+class _LengthPrefixedSplitter(_FramedSplitter):
+    def __init__(self, stream: IO[bytes], prefix: str, **kwargs: Any) -> None:
+        super().__init__(stream, **kwargs)
+        self._struct = _PREFIXES.get(prefix)
+
+    def _take(self) -> Iterable[Any]:
+        buf, pos, end = self._buf, self._start, self._end
+        frames = []
+        missing = 0
+        with memoryview(buf) as view:
+            while True:
+                if self._struct is not None:
+                    header = pos + self._struct.size
+                    if header > end:
+                        break
+                    (length,) = self._struct.unpack_from(buf, pos)
+                else:
+                    parsed = _read_varint(buf, pos, end)
+                    if parsed is None:
+                        break
+                    length, header = parsed
+                if self.max_line_length is not None and length > self.max_line_length:
+                    raise LineTooLongError(
+                        f"frame longer than max_line_length({self.max_line_length})"
+                    )
+                if header + length > end:
+                    missing = header + length - end
+                    break
+                frames.append(view[header : header + length].tobytes())
+                pos = header + length
+        self._start = pos
+        if missing:
+            # room for the rest of the frame, so it is not copied around
+            self._reserve(missing)
+        return self._records(b"", frames)
+
+    def _last(self) -> Iterable[Any]:
+        raise FramingError(
+            f"stream ended inside a frame, {self._end - self._start} bytes left"
+        )
+
+
+class LengthPrefixed(Framing):
+    """frames of a length followed by that many bytes, nothing is searched.
+
+    `prefix` is "u32" (big endian), "u32le" or "varint" (LEB128, as protobuf).
+    """
+
+    def __init__(self, prefix: Literal["u32", "u32le", "varint"] = "u32") -> None:
+        assert prefix in ("u32", "u32le", "varint"), f"unknown prefix {prefix}"
+        self.prefix = prefix
+
+    def splitter(self, stream: IO[bytes], **kwargs: Any) -> Splitter:
+        return _LengthPrefixedSplitter(stream, self.prefix, **kwargs)
+
+    def encode(self, record: bytes) -> bytes:
+        if self.prefix == "varint":
+            return _varint(len(record)) + record
+        return _PREFIXES[self.prefix].pack(len(record)) + record
+
+
+def _overlap(pattern: Pattern[bytes]) -> Optional[int]:
+    """how many bytes before the end of the data may start a match which needs more
+    data, None if there is no bound"""
+    if b"(?=" in pattern.pattern or b"(?!" in pattern.pattern:
+        # a lookahead may look past the match
+        return None
+    parsed = _sre_parse.parse(pattern.pattern, pattern.flags)
+    if len(parsed) == 1 and parsed[0][0] in (
+        _sre_parse.MAX_REPEAT,
+        _sre_parse.MIN_REPEAT,
+    ):
+        low, _, item = parsed[0][1]
+        if low == 1 and len(item) == 1 and item[0][0] in _BYTE_CLASSES:
+            # e.g. rb"\s+": every prefix of a match is a match, so a match which
+            # needs more data reaches the end and is found
+            return 0
+    high = parsed.getwidth()[1]
+    if high >= _sre_parse.MAXREPEAT - 1:
+        return None
+    return high - 1
+
+
+class _RegexSplitter(_FramedSplitter):
+    def __init__(self, stream: IO[bytes], pattern: Pattern[bytes], **kwargs: Any):
+        super().__init__(stream, **kwargs)
+        self.pattern = pattern
+        self.overlap = _overlap(pattern)
+
+    def _cut(self, eof: bool) -> Iterable[Any]:
+        pos, end = self._start, self._end
+        records = []
+        # buf[_start:_scan] was searched and cannot start a separator
+        resume = pos if self.overlap is None else max(end - self.overlap, pos)
+        for match in self.pattern.finditer(self._buf, max(self._scan, pos), end):
+            if match.end() == end and not eof:
+                # more data may still be part of this separator
+                resume = match.start()
+                break
+            records.append(bytes(self._buf[pos : match.start()]))
+            pos = match.end()
+        if self.max_line_length is not None:
+            self._check_length(
+                max([len(r) for r in records] + [0 if eof else end - pos])
+            )
+        self._start = pos
+        self._scan = max(resume, pos)
+        return self._records(b"", records)
+
+    def _take(self) -> Iterable[Any]:
+        return self._cut(eof=False)
+
+    def _last(self) -> Iterable[Any]:
+        records = list(self._cut(eof=True))
+        if self._start != self._end:
+            records.extend(super()._last())
+        return records
+
+
+class RegexDelimited(Framing):
+    """records separated by matches of `pattern`, e.g. rb"\\r?\\n" or rb"\\s+".
+
+    each read searches the new data and the few bytes before it which may start a
+    separator. a pattern with a lookahead, or which matches without a bound in
+    length (but a repeated byte class, like rb"\\s+"), searches all data not cut
+    into records yet, so records should be short compared with the read size.
+    records are written ended by `sep`.
+    """
+
+    def __init__(
+        self, pattern: Union[bytes, Pattern[bytes]], sep: bytes = b"\n"
+    ) -> None:
+        self.pattern = re.compile(pattern) if isinstance(pattern, bytes) else pattern
+        assert not self.pattern.fullmatch(b""), "pattern should not match empty"
+        self.sep = sep
+
+    def splitter(self, stream: IO[bytes], **kwargs: Any) -> Splitter:
+        return _RegexSplitter(stream, self.pattern, **kwargs)
+
+    def encode(self, record: bytes) -> bytes:
+        return record + self.sep
@@ -1,4 +1,11 @@
 import os
+from .env import EnvDict
 
 CWD = os.getcwd()
-ENV = dict(os.environ)
+ENV = EnvDict(os.environ)
+# default spawn backend of Sh, see `shshsh.spawn.BACKENDS`
+SPAWN = "popen"
+# collect `StageMetrics` of every Sh/P, see `shshsh.metrics`
+METRICS = False
+# called with the `StageMetrics` of a stage when it is done
+METRICS_HOOK = None
@@ -0,0 +1,207 @@
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Union,
+    overload,
+)
+import io
+import os
+import mmap
+from .streamer import P, ChunkSize, Splitter, to_bytes
+from .shell import Sh
+from .fork import fork_stream
+from .metrics import option_of
+
+if TYPE_CHECKING:
+    from .quick import _I
+
+Stage = Union[str, Sh, P, Callable[..., Any]]
+
+# sizes of the edges of a pipeline whose output is read all at once
+BULK_CHUNK_SIZE: ChunkSize = "auto"
+BULK_WRITE_BUFFER_SIZE = 1024 * 1024
+# seconds a started function is given to finish when the pipeline fails to start
+ABORT_TIMEOUT = 1
+
+
+class Pipeline:
+    """a pipeline built by `|` without starting anything, see `shshsh.L`.
+
+    the stages start together once the output is needed: by iterating it,
+    `capture`, `wait`, `run` or piping it to a file. if a stage fails to start,
+    the ones started before it are killed.
+
+    how stages are connected is planned when they start: commands are connected
+    by kernel pipes, consecutive functions are fused into one thread, and
+    functions read and write in large batches if the output is read all at
+    once (`capture`, a file) instead of iterated.
+    """
+
+    def __init__(
+        self, start: "_I", source: Any, stages: Optional[List[Stage]] = None
+    ) -> None:
+        # the source is started by `start`, a non lazy copy of `L`
+        self._start = start
+        self._source = source
+        self.stages: List[Stage] = stages or []
+        self._last: Union[Sh, P, None] = None
+
+    @property
+    def started(self) -> bool:
+        return self._last is not None
+
+    @overload
+    def __or__(self, other: TextIO) -> Union[Sh, P, None]:
+        ...
+
+    @overload
+    def __or__(self, other: Stage) -> "Pipeline":
+        ...
+
+    def __or__(self, other: Union[Stage, TextIO]) -> Any:
+        if isinstance(other, (io.IOBase, fork_stream)):
+            return self.run(bulk=True, sink=other)
+        assert not self.started, "already running, cannot add stages"
+        if isinstance(other, str):
+            if not other:
+                return self
+            param_complete, cmd = Sh._parse_cmd(other, "#{*}")
+            if not param_complete:
+                raise ValueError(f"some args may not fill, current cmd: {cmd}")
+        elif isinstance(other, Sh):
+            if not other.param_complete:
+                raise ValueError(f"some args may not fill, current cmd: {other.cmd}")
+            assert other._proc is None, f"cannot pipe after cmd run.({other.cmd})"
+        elif isinstance(other, P):
+            assert not other.started, "cannot pipe after stage run"
+        elif not callable(other):
+            raise ValueError(f"chain opt not support {other}")
+        return Pipeline(self._start, self._source, [*self.stages, other])
+
+    def _stage(self, prev: Union[Sh, P], stage: Stage, bulk: bool) -> Any:
+        """the object for `stage`, with the batching of its edge from `prev`"""
+        if isinstance(stage, (str, Sh, P)):
+            return stage
+        if isinstance(prev, Sh):
+            zero_output = prev._zero_mode
+        else:
+            zero_output = to_bytes(prev.sep) == b"\x00"
+        if not bulk:
+            return P(
+                stage,
+                zero_output=zero_output,
+                chunk_size=self._start.chunk_size,
+                metrics=option_of(prev.metrics),
+            )
+        return P(
+            stage,
+            zero_output=zero_output,
+            # reading a command, read as much as it has written
+            chunk_size=BULK_CHUNK_SIZE if isinstance(prev, Sh) else 1024,
+            write_buffer_size=BULK_WRITE_BUFFER_SIZE,
+            metrics=option_of(prev.metrics),
+        )
+
+    def run(
+        self, bulk: bool = False, sink: Union[TextIO, fork_stream, None] = None
+    ) -> Any:
+        """start all stages, return the last one.
+
+        :param bulk: the output is read all at once, use large batches.
+        :param sink: where the output goes, a file or `fork_stream`. the last
+            stage is then piped to it and the result of that is returned.
+        """
+        assert not self.started, "cannot run twice, create a new pipeline"
+        first = self._start >> self._source
+        created: List[Any] = [first]
+        last: Any = first
+        try:
+            if bulk and isinstance(first, P):
+                first._write_buffer_size = BULK_WRITE_BUFFER_SIZE
+            for stage in self.stages:
+                stage = self._stage(last, stage, bulk)
+                created.append(stage)
+                last = last | stage
+                created.append(last)
+            self._last = last
+            if sink is not None:
+                # a command not started yet writes to the file itself
+                return last | sink  # type: ignore
+            if isinstance(last, Sh):
+                if last._proc is None:
+                    last.run()
+            elif not last.started:
+                last.run()
+        except BaseException:
+            self._last = None
+            _abort(created)
+            raise
+        return last
+
+    def wait(self, timeout: Optional[float] = None) -> Union[Sh, P]:
+        last = self._last or self.run()
+        last.wait(timeout)  # type: ignore
+        return last
+
+    def capture(
+        self, memory_limit: int = 64 * 1024 * 1024
+    ) -> Union[memoryview, mmap.mmap]:
+        """read the whole output, see `shshsh.streamer.capture`"""
+        return (self._last or self.run(bulk=True)).capture(memory_limit)
+
+    def iter(self, result_type: type = str) -> Iterator[Any]:
+        last = self._last or self.run()
+        if isinstance(last, Sh):
+            return last.iter(result_type)  # type: ignore
+        return _iter_output(last, result_type)
+
+    def __iter__(self) -> Iterator[str]:
+        last = self._last or self.run()
+        if isinstance(last, Sh):
+            return iter(last)
+        return _iter_output(last, str)
+
+
+def _iter_output(stage: P, result_type: Any) -> Generator[Any, None, None]:
+    with os.fdopen(stage.out_fd, "rb") as stream:
+        yield from Splitter(
+            stream,
+            sep=to_bytes(stage.sep),
+            chunk_size=stage._chunk_size,
+            encoding="utf8" if result_type is str else None,
+        )
+
+
+def _abort(created: List[Any]):
+    """kill what was started of a pipeline which failed to start, close its pipes"""
+    commands = [stage for stage in created if isinstance(stage, Sh) and stage._proc]
+    for stage in commands:
+        if stage._proc.poll() is None:
+            stage._proc.kill()
+            stage._proc.wait()
+    for stage in created:
+        if not isinstance(stage, P):
+            continue
+        if stage.started:
+            # EOF now that the commands are gone, unless it is a source: it gets
+            # EPIPE once nothing reads its output
+            stage.wait(ABORT_TIMEOUT)
+            fds = [stage.out_fd]
+        else:
+            fds = [stage.out_fd, stage.in_fd]
+        for fd in fds:
+            if fd >= 0:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+    for stage in commands:
+        for stream in (stage._proc.stdin, stage._proc.stdout, stage._proc.stderr):
+            if stream:
+                stream.close()
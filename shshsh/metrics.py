@@ -0,0 +1,125 @@
+from typing import Any, Callable, Dict, List, Optional, Union
+import time
+from . import global_vars
+
+MetricsOption = Union[bool, Callable[["StageMetrics"], Any], None]
+
+
+class IOStats:
+    """data through one side of a stage, and the time spent blocked moving it"""
+
+    __slots__ = ("bytes", "records", "blocked")
+
+    def __init__(self) -> None:
+        self.bytes = 0
+        self.records = 0
+        self.blocked = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"bytes": self.bytes, "records": self.records, "blocked": self.blocked}
+
+
+class StageMetrics:
+    """what one `Sh` or `P` did, filled while it runs.
+
+    only what passes through python is counted: the output of a command piped
+    to another command never leaves the kernel. `cpu_time` is the CPU time of
+    the thread of a `P`, its function and the splitting/writing around it.
+    """
+
+    def __init__(
+        self, name: str, hook: Optional[Callable[["StageMetrics"], Any]] = None
+    ) -> None:
+        self.name = name
+        self.input = IOStats()
+        self.output = IOStats()
+        self.spawn_time = 0.0
+        self.cpu_time = 0.0
+        self.start = time.monotonic()
+        self.end: Optional[float] = None
+        self._hook = hook
+
+    @property
+    def wall_time(self) -> float:
+        return (self.end or time.monotonic()) - self.start
+
+    def finish(self):
+        """mark the stage done and hand it to the hook, once"""
+        if self.end is not None:
+            return
+        self.end = time.monotonic()
+        if self._hook:
+            self._hook(self)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "input": self.input.as_dict(),
+            "output": self.output.as_dict(),
+            "spawn_time": self.spawn_time,
+            "cpu_time": self.cpu_time,
+            "wall_time": self.wall_time,
+        }
+
+
+def new_metrics(name: str, option: MetricsOption) -> Optional[StageMetrics]:
+    """metrics of a stage, None if disabled.
+
+    `option` None follows `global_vars.METRICS`, a callable is the hook, True
+    uses `global_vars.METRICS_HOOK`.
+    """
+    if option is None:
+        option = global_vars.METRICS
+    if not option:
+        return None
+    if callable(option):
+        return StageMetrics(name, option)
+    return StageMetrics(name, global_vars.METRICS_HOOK)
+
+
+def option_of(metrics: Optional[StageMetrics]) -> MetricsOption:
+    """the option which gives a downstream stage metrics like these"""
+    if metrics is None:
+        return None
+    return metrics._hook or True
+
+
+def stages(last: Any) -> List[Any]:
+    """the stages of the pipeline ending with `last`, first one first"""
+    chain = []
+    while last is not None:
+        chain.append(last)
+        last = getattr(last, "_prev", None)
+    return chain[::-1]
+
+
+def report(last: Any) -> str:
+    """a table of the metrics of each stage in the pipeline ending with `last`.
+
+    a command piped from/to python has its bytes counted by the stage next to it.
+    """
+    chain = stages(last)
+    metrics: List[Optional[StageMetrics]] = [
+        getattr(stage, "metrics", None) for stage in chain
+    ]
+    header = (
+        f"{'stage':<30} {'in bytes':>10} {'in recs':>9} {'out bytes':>10} "
+        f"{'out recs':>9} {'spawn':>8} {'in wait':>9} {'out wait':>9} "
+        f"{'cpu':>8} {'wall':>8}"
+    )
+    lines = [header]
+    for i, m in enumerate(metrics):
+        if m is None:
+            lines.append(f"{'(no metrics)':<30}")
+            continue
+        prev = metrics[i - 1] if i else None
+        next_ = metrics[i + 1] if i + 1 < len(metrics) else None
+        stats_in = m.input if m.input.bytes or prev is None else prev.output
+        stats_out = m.output if m.output.bytes or next_ is None else next_.input
+        lines.append(
+            f"{m.name[:30]:<30} {stats_in.bytes:>10} {stats_in.records:>9} "
+            f"{stats_out.bytes:>10} {stats_out.records:>9} "
+            f"{m.spawn_time * 1000:>6.2f}ms {m.input.blocked:>8.3f}s "
+            f"{m.output.blocked:>8.3f}s {m.cpu_time:>7.3f}s {m.wall_time:>7.3f}s"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,189 @@
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+import os
+import subprocess
+import selectors
+from .shell import Sh
+from .pipe import Pipe
+from .streamer import Splitter
+
+Callback = Callable[[Any], Any]
+
+
+class MuxStream:
+    """one stream read by `Mux`, `name` is which stream of `source` it is"""
+
+    def __init__(
+        self,
+        source: Any,
+        name: str,
+        fd: int,
+        splitter: Splitter,
+        callback: Optional[Callback] = None,
+        file: Optional[IO[bytes]] = None,
+    ) -> None:
+        self.source = source
+        self.name = name
+        self.fd = fd
+        self.callback = callback
+        self._splitter = splitter
+        # closed at EOF, the pipe of a `Sh` which is only read here
+        self._file = file
+
+    def __repr__(self) -> str:
+        return f"MuxStream({self.source!r}, {self.name!r})"
+
+
+class Mux:
+    """read lines of many streams in one thread, with one selector.
+
+    add the stdout/stderr of `Sh`, `Pipe` and fds, then iterate `(stream, line)`
+    pairs in the order lines arrive, or give callbacks and `run`. a process which
+    writes a lot to both stdout and stderr cannot block on either of them.
+    unlike `Sh.iter`, the last line of a stream is given only if it is not empty.
+    """
+
+    def __init__(
+        self,
+        result_type: Union[Type[str], Type[bytes]] = str,
+        sep: Union[str, bytes] = ...,
+        chunk_size: int = 64 * 1024,
+        max_line_length: Optional[int] = None,
+    ) -> None:
+        if result_type not in (str, bytes):
+            raise ValueError(f"result type: {result_type} is not supported")
+        if sep is ...:
+            sep = b"\n"
+        self.result_type = result_type
+        self.sep = sep.encode("utf8") if isinstance(sep, str) else sep
+        self.chunk_size = chunk_size
+        self.max_line_length = max_line_length
+        self._selector = selectors.DefaultSelector()
+
+    def _add_fd(
+        self,
+        source: Any,
+        name: str,
+        fd: int,
+        callback: Optional[Callback],
+        file: Optional[IO[bytes]] = None,
+    ) -> MuxStream:
+        splitter = Splitter(
+            None,  # type: ignore
+            sep=self.sep,
+            max_line_length=self.max_line_length,
+            encoding="utf8" if self.result_type is str else None,
+        )
+        stream = MuxStream(source, name, fd, splitter, callback, file)
+        self._selector.register(fd, selectors.EVENT_READ, stream)
+        return stream
+
+    def add(
+        self,
+        source: Union[Sh, Pipe, IO[bytes], int],
+        callback: Union[Callback, Mapping[str, Callback], None] = None,
+        streams: Optional[Sequence[str]] = None,
+    ) -> List[MuxStream]:
+        """read `source`, the stdout and stderr of a `Sh`, a `Pipe` or a fd.
+
+        :param callback: called with each line instead of yielding it, or a
+            mapping of stream name ("stdout", "stderr", "pipe", "fd") to callback.
+        :param streams: streams of a `Sh` to read. a command not started yet is
+            started with them piped, by default both.
+        """
+
+        def callback_of(name: str) -> Optional[Callback]:
+            if isinstance(callback, Mapping):
+                return callback.get(name)
+            return callback
+
+        if isinstance(source, Sh):
+            if source._proc is None:
+                for name in streams or ("stdout", "stderr"):
+                    setattr(source, f"_{name}", subprocess.PIPE)
+                source.run()
+            assert source._proc
+            added = []
+            for name in streams or ("stdout", "stderr"):
+                file = getattr(source._proc, name)
+                if file is None:
+                    assert (
+                        streams is None
+                    ), f"cannot read {name}, it is redirect to {getattr(source, '_' + name)}"
+                    continue
+                added.append(
+                    self._add_fd(source, name, file.fileno(), callback_of(name), file)
+                )
+            return added
+        if isinstance(source, Pipe):
+            return [self._add_fd(source, "pipe", source.out_fd, callback_of("pipe"))]
+        fd = source if isinstance(source, int) else source.fileno()
+        return [self._add_fd(source, "fd", fd, callback_of("fd"))]
+
+    def _remove(self, stream: MuxStream):
+        self._selector.unregister(stream.fd)
+        if stream._file is not None:
+            stream._file.close()
+
+    def __len__(self) -> int:
+        """streams not at EOF yet"""
+        return len(self._selector.get_map())
+
+    def __iter__(self) -> Generator[Tuple[MuxStream, Any], None, None]:
+        """lines of streams without a callback, with the stream they come from"""
+        while self._selector.get_map():
+            for key, _ in self._selector.select():
+                stream: MuxStream = key.data
+                data = os.read(stream.fd, self.chunk_size)
+                if data:
+                    lines = stream._splitter.feed(data)
+                else:
+                    lines = [line for line in stream._splitter.close() if line]
+                    self._remove(stream)
+                if stream.callback is not None:
+                    for line in lines:
+                        stream.callback(line)
+                else:
+                    for line in lines:
+                        yield stream, line
+
+    def run(self):
+        """read until every stream is at EOF, lines without a callback are dropped"""
+        for _ in self:
+            pass
+
+    def close(self):
+        for key in list(self._selector.get_map().values()):
+            self._remove(key.data)
+        self._selector.close()
+
+
+def mux(
+    *sources: Union[Sh, Pipe, IO[bytes], int],
+    result_type: Union[Type[str], Type[bytes]] = str,
+    **kwargs: Any,
+) -> Generator[Tuple[MuxStream, Any], None, None]:
+    """`(stream, line)` of the stdout and stderr of all `sources` as they arrive.
+
+    >>> sorted((s.name, line) for s, line in mux(Sh("sh -c 'echo a; echo b >&2'")))
+    [('stderr', 'b'), ('stdout', 'a')]
+    """
+    m = Mux(result_type=result_type, **kwargs)
+    for source in sources:
+        m.add(source)
+    try:
+        yield from m
+    finally:
+        m.close()
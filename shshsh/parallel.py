@@ -0,0 +1,83 @@
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import os
+import subprocess
+from . import global_vars
+from .shell import Sh, stderr as _stderr
+
+
+_Args = Union[Tuple[Any, ...], Dict[str, Any], str]
+
+
+class Result(NamedTuple):
+    index: int
+    args: _Args
+    code: int
+    stdout: Optional[bytes]
+    stderr: Optional[bytes]
+
+
+def pmap(
+    cmd: str,
+    args: Iterable[_Args],
+    jobs: Optional[int] = None,
+    arg_placeholder: str = "#{*}",
+    stdout: Any = subprocess.PIPE,
+    stderr: Any = _stderr,
+    cwd: Optional[str] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> Iterator[Result]:
+    """run `cmd` once per item of `args` with at most `jobs` at the same time, like `xargs -P`.
+
+    the template is parsed once (see `Sh._compile`), results are yielded as
+    commands complete.
+
+    >>> sorted(r.stdout for r in pmap("echo #{}", ["a", "b"]))
+    [b'a\\n', b'b\\n']
+    """
+    jobs = jobs or os.cpu_count() or 1
+    cwd = cwd or global_vars.CWD
+    env = env or global_vars.ENV
+
+    def run_one(index: int, item: _Args) -> Result:
+        sh = Sh(
+            cmd,
+            arg_placeholder=arg_placeholder,
+            stdout=stdout,
+            stderr=stderr,
+            cwd=cwd,
+            env=env,
+        )
+        if isinstance(item, dict):
+            sh(**item)
+        elif isinstance(item, tuple):
+            sh(*item)
+        else:
+            sh(item)
+        sh.run()
+        assert sh._proc
+        out, err = sh._proc.communicate()
+        return Result(index, item, sh.code, out, err)
+
+    running: Set["Future[Result]"] = set()
+    with ThreadPoolExecutor(jobs) as pool:
+        for index, item in enumerate(args):
+            running.add(pool.submit(run_one, index, item))
+            if len(running) >= jobs:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
@@ -1,5 +1,10 @@
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Literal, Union
 import os
 
+if TYPE_CHECKING:
+    from .shell import Sh
+    from .streamer import P
+
 
 class PipeCloseError(Exception):
     ...
@@ -13,7 +18,106 @@ class Pipe:
         self.auto_close = first_process_auto_close
 
     def close_in(self):
-        os.close(self.in_fd)
+        if not self.in_closed:
+            self.in_closed = True
+            os.close(self.in_fd)
 
     def close_out(self):
-        os.close(self.out_fd)
+        if not self.out_closed:
+            self.out_closed = True
+            os.close(self.out_fd)
+
+
+class Substitution(Pipe):
+    """process substitution, `<(stage)` (mode "r") or `>(stage)` (mode "w") of bash.
+
+    given as an arg of a command, it is the path `/dev/fd/N` of a pipe which the
+    command reads the output of `stage` from, or writes the input of `stage` to.
+    `stage` is started right before the command, so they run concurrently, and
+    the ends of the pipe are closed here once both are started, so that each
+    side sees EOF when the other one is done. see `psub`.
+    """
+
+    def __init__(
+        self,
+        stage: Union[str, "Sh", "P", Callable[..., Any], Iterable[Any]],
+        mode: Literal["r", "w"] = "r",
+    ) -> None:
+        from .shell import Sh
+        from .streamer import P
+
+        assert mode in ("r", "w"), f"unknown mode: {mode}"
+        super().__init__(first_process_auto_close=False)
+        self.mode = mode
+        if isinstance(stage, str):
+            stage = Sh(stage)
+            if mode == "w":
+                # like bash, the output of `>(cmd)` goes to our stdout
+                stage._stdout = None
+        elif not isinstance(stage, (Sh, P)):
+            stage = P(stage)
+        if isinstance(stage, Sh):
+            assert stage._proc is None, f"cannot substitute after cmd run.({stage.cmd})"
+            if mode == "r":
+                stage._stdout = self.in_fd
+            else:
+                stage._stdin = self.out_fd
+        else:
+            assert not stage.started, "cannot substitute after stage run"
+            if mode == "r":
+                # written by the stage instead of the pipe it made
+                os.close(stage.out_fd)
+                os.close(stage.in_fd)
+                stage.out_fd, stage.in_fd = -1, self.in_fd
+            else:
+                stage.set_source(os.fdopen(self.out_fd, "rb"))
+        self.stage: Union[Sh, P] = stage
+        # a function stage closes its end itself when it is done
+        self._function = isinstance(stage, P)
+        # the end given to the command
+        self.fd = self.out_fd if mode == "r" else self.in_fd
+        self.path = f"/dev/fd/{self.fd}"
+        self.started = False
+
+    def __str__(self) -> str:
+        return self.path
+
+    def __fspath__(self) -> str:
+        return self.path
+
+    def _start(self):
+        """start the stage, before the command"""
+        assert not self.started, "a substitution can only be used once"
+        self.started = True
+        self.stage.run()
+        # the end of the stage is its own now: a command has a copy of it, a
+        # function closes it when it is done
+        if self._function:
+            if self.mode == "r":
+                self.in_closed = True
+            else:
+                self.out_closed = True
+        elif self.mode == "r":
+            self.close_in()
+        else:
+            self.close_out()
+
+    def _close(self):
+        """the command started, or failed to, it has a copy of its end if any"""
+        if self.mode == "r":
+            self.close_out()
+        else:
+            self.close_in()
+
+
+def psub(
+    stage: Union[str, "Sh", "P", Callable[..., Any], Iterable[Any]],
+    mode: Literal["r", "w"] = "r",
+) -> Substitution:
+    """`<(stage)`, or `>(stage)` with mode "w", as an arg of a command.
+
+    >>> from shshsh import Sh
+    >>> Sh("paste -d, #{} #{}")(psub("seq 2"), psub(iter(["a", "b"]))).stdout.read()
+    b'1,a\\n2,b\\n'
+    """
+    return Substitution(stage, mode)
@@ -1,10 +1,21 @@
-from typing import Optional, List, IO, Union, overload, Iterable, Generator, Any
+from typing import (
+    Optional,
+    List,
+    IO,
+    Union,
+    overload,
+    Iterable,
+    AsyncIterable,
+    Generator,
+    Any,
+)
 import io
 import subprocess
 from . import global_vars
 from .pipe import Pipe
-from .streamer import P
+from .streamer import P, ChunkSize
 from .shell import Sh
+from .shard import Shards
 
 
 class _I:
@@ -13,10 +24,25 @@ class _I:
         with_fds: Optional[List[int]] = None,
         with_stdin: Optional[Union[int, IO[bytes]]] = subprocess.PIPE,
         zero_output: bool = False,
+        chunk_size: ChunkSize = 1024,
+        lazy: bool = False,
     ) -> None:
         self.with_fds: Optional[List[int]] = with_fds
         self.with_stdin: Optional[Union[int, IO[bytes]]] = with_stdin
         self.zero_output = zero_output
+        self.chunk_size: ChunkSize = chunk_size
+        # `>>` gives a `shshsh.lazy.Pipeline` which starts nothing yet
+        self.lazy = lazy
+
+    def __call__(self, chunk_size: ChunkSize = ..., lazy: bool = ...) -> "_I":
+        """copy with different options, e.g. `I(chunk_size="auto") >> "cmd"`"""
+        return _I(
+            with_fds=self.with_fds,
+            with_stdin=self.with_stdin,
+            zero_output=self.zero_output,
+            chunk_size=self.chunk_size if chunk_size is ... else chunk_size,
+            lazy=self.lazy if lazy is ... else lazy,
+        )
 
     @overload
     def __rshift__(self, other: str) -> Sh:
@@ -53,8 +79,14 @@ class _I:
             Iterable[bytes],
             Generator[str, Any, None],
             Generator[bytes, Any, None],
+            AsyncIterable[str],
+            AsyncIterable[bytes],
         ],
     ):
+        if self.lazy and isinstance(other, (str, Iterable, AsyncIterable)):
+            from .lazy import Pipeline
+
+            return Pipeline(self(lazy=False), other)
         if isinstance(other, str):
             return Sh(
                 other,
@@ -63,6 +95,7 @@ class _I:
                 cwd=global_vars.CWD,
                 env=global_vars.ENV,
                 zero_mode=self.zero_output,
+                chunk_size=self.chunk_size,
             )
         elif isinstance(other, int):
             if self.with_fds:
@@ -70,32 +103,59 @@ class _I:
                     with_stdin=other,
                     with_fds=[*self.with_fds, other],
                     zero_output=self.zero_output,
+                    chunk_size=self.chunk_size,
+                    lazy=self.lazy,
                 )
             else:
-                return _I(with_stdin=other, zero_output=self.zero_output)
+                return _I(
+                    with_stdin=other,
+                    zero_output=self.zero_output,
+                    chunk_size=self.chunk_size,
+                    lazy=self.lazy,
+                )
         elif isinstance(other, io.IOBase):
             if self.with_fds:
-                return _I(with_stdin=other, with_fds=self.with_fds, zero_output=self.zero_output)  # type: ignore
+                return _I(with_stdin=other, with_fds=self.with_fds, zero_output=self.zero_output, chunk_size=self.chunk_size, lazy=self.lazy)  # type: ignore
             else:
-                return _I(with_stdin=other, zero_output=self.zero_output)  # type: ignore
-        elif isinstance(other, Iterable):
-            return P(other, zero_output=self.zero_output)
+                return _I(with_stdin=other, zero_output=self.zero_output, chunk_size=self.chunk_size, lazy=self.lazy)  # type: ignore
+        elif isinstance(other, (Iterable, AsyncIterable)):
+            return P(other, zero_output=self.zero_output, chunk_size=self.chunk_size)
         elif isinstance(other, Pipe):  # type: ignore
             if self.with_fds:
                 return _I(
                     with_stdin=other.out_fd,
-                    with_fds=[*self.with_fds, other.in_fd, other.out_fd],
+                    with_fds=[*self.with_fds, other.out_fd],
                     zero_output=self.zero_output,
+                    chunk_size=self.chunk_size,
+                    lazy=self.lazy,
                 )
             else:
                 return _I(
                     with_stdin=other.out_fd,
-                    with_fds=[other.in_fd, other.out_fd],
+                    with_fds=[other.out_fd],
                     zero_output=self.zero_output,
+                    chunk_size=self.chunk_size,
+                    lazy=self.lazy,
                 )
         else:
             raise ValueError("only accept str(command), int(fd), IO[bytes] or Pipe")
 
+    def shard(
+        self, path: str, parts: Optional[int] = None, ordered: bool = True
+    ) -> Shards:
+        """`path` cut into `parts` at records, to run a command or function on
+        each part in parallel, e.g. `I.shard("big.log") | "grep ERROR"`.
+
+        records end with "\\x00" for `IZ`, see `shshsh.shard.Shards`.
+        """
+        return Shards(
+            path,
+            parts,
+            sep=b"\x00" if self.zero_output else b"\n",
+            ordered=ordered,
+            chunk_size=self.chunk_size,
+        )
+
     def __or__(self, other: str) -> Sh:
         assert isinstance(other, str), "must be string command after I | str"
         return self >> other
@@ -103,3 +163,5 @@ class _I:
 
 I = _I()
 IZ = _I(zero_output=True)
+# like `I`, but `L >> "cmd" | ...` starts nothing until the output is needed
+L = _I(lazy=True)
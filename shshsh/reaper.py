@@ -0,0 +1,145 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+import os
+import resource
+import selectors
+import threading
+import traceback
+
+ExitCallback = Callable[[Any, Optional[resource.struct_rusage]], Any]
+
+
+class Reaper:
+    """waits for children in one thread, however many of them run.
+
+    each child is watched with a pidfd (linux 5.3+) in one selector. when it exits,
+    it is reaped with `wait4`, its `returncode` set as `Popen` would and the
+    callback called with it and its rusage. `wait`/`poll` of the `Popen` keep
+    working. without pidfd the thread wakes every `poll_interval` seconds and
+    polls the running children (`waitpid` with WNOHANG), rusage is None then.
+    signal handlers of the process are left alone either way.
+
+    callbacks run on the reaper thread, one after another: keep them short.
+    """
+
+    def __init__(self, poll_interval: float = 0.05) -> None:
+        self.poll_interval = poll_interval
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        # children without a pidfd, polled
+        self._polled: Dict[int, Tuple[Any, Optional[ExitCallback]]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, proc: Any, callback: Optional[ExitCallback] = None):
+        """reap `proc` once it exits and call `callback(proc, rusage)`"""
+        on_exit = getattr(proc, "on_exit", None)
+        if on_exit is not None:
+            # e.g. a `Session` job, which is not our child and reports its exit
+            on_exit(lambda: callback and callback(proc, None))
+            return
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except ProcessLookupError:
+            # reaped already
+            if callback:
+                callback(proc, None)
+            return
+        except (AttributeError, OSError):
+            # no pidfd_open, before linux 5.3 (ENOSYS) or denied by seccomp (EPERM)
+            pidfd = -1
+        with self._lock:
+            if pidfd >= 0:
+                self._selector.register(pidfd, selectors.EVENT_READ, (proc, callback))
+            else:
+                self._polled[proc.pid] = (proc, callback)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="shshsh-reaper", daemon=True
+                )
+                self._thread.start()
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _run(self):
+        while True:
+            timeout = self.poll_interval if self._polled else None
+            for key, _ in self._selector.select(timeout):
+                if key.fd == self._wake_r:
+                    while True:
+                        try:
+                            os.read(self._wake_r, 4096)
+                        except BlockingIOError:
+                            break
+                    continue
+                with self._lock:
+                    self._selector.unregister(key.fd)
+                os.close(key.fd)
+                self._reap(*key.data)
+            for pid, (proc, callback) in list(self._polled.items()):
+                if proc.poll() is not None:
+                    with self._lock:
+                        del self._polled[pid]
+                    self._exited(proc, callback, None)
+
+    def _reap(self, proc: Any, callback: Optional[ExitCallback]):
+        rusage = None
+        # taken by `Popen` around waitpid, so only one of us reaps the child
+        lock = getattr(proc, "_waitpid_lock", None)
+        if lock is None:
+            proc.wait()
+        else:
+            with lock:
+                if proc.returncode is None:
+                    try:
+                        _, status, rusage = os.wait4(proc.pid, 0)
+                        proc.returncode = os.waitstatus_to_exitcode(status)
+                    except ChildProcessError:
+                        # reaped outside of `Popen`, it finds out itself
+                        pass
+        self._exited(proc, callback, rusage)
+
+    @staticmethod
+    def _exited(
+        proc: Any,
+        callback: Optional[ExitCallback],
+        rusage: Optional[resource.struct_rusage],
+    ):
+        if callback is None:
+            return
+        try:
+            callback(proc, rusage)
+        except Exception:
+            # a broken callback must not stop reaping the others
+            traceback.print_exc()
+
+
+_reaper: Optional[Reaper] = None
+_reaper_lock = threading.Lock()
+
+
+def get_reaper() -> Reaper:
+    """the reaper of this process, started on first use"""
+    global _reaper
+    if _reaper is None:
+        with _reaper_lock:
+            if _reaper is None:
+                _reaper = Reaper()
+    return _reaper
+
+
+def _forget_reaper():
+    # the thread is gone in a forked child, and the children are not its own
+    global _reaper, _reaper_lock
+    _reaper = None
+    _reaper_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_reaper)
@@ -0,0 +1,397 @@
+from typing import Any, Callable, Dict, IO, List, Mapping, Optional, Tuple
+from threading import Event, Lock, Thread
+import fcntl
+import itertools
+import os
+import re
+import shlex
+import stat
+import subprocess
+from . import global_vars
+from .spawn import popen, _which
+
+# fds of the session shell: job events, and the stdio of python when it started
+_EVENT_FD = 200
+_STDIO_FDS = (201, 202, 203)
+_NAME = re.compile(rb"[A-Za-z_][A-Za-z0-9_]*")
+# builtins without side effects on the shell, and which do not write much, run
+# in the session shell itself without any fork
+_INLINE = {"test", "[", "true", "false", ":", "pwd"}
+
+# redirects of a function call are opened before it runs, `_shsh_ok` stays unset
+# when they fail
+_PRELUDE = f"""
+_shsh_job() {{
+  _shsh_ok=1
+  local id=$1 builtin=$2
+  [ -z "$3" ] || cd -- "$3" || {{ echo "$id fail cd" >&{_EVENT_FD}; return; }}
+  shift 3
+  if [ "$builtin" ]; then
+    echo "$id pid $BASHPID" >&{_EVENT_FD}; "$@" {_EVENT_FD}>&-
+  else
+    # an explicit stdin keeps bash from giving a background command /dev/null
+    "$@" 0<&0 {_EVENT_FD}>&- & echo "$id pid $!" >&{_EVENT_FD}; wait $! 2>/dev/null
+  fi
+  echo "$id exit $?" >&{_EVENT_FD}
+}}
+_shsh_inline() {{
+  _shsh_ok=1
+  local id=$1
+  shift
+  echo "$id pid $$" >&{_EVENT_FD}; "$@" {_EVENT_FD}>&-; echo "$id exit $?" >&{_EVENT_FD}
+}}
+compgen -b >&{_EVENT_FD}; echo >&{_EVENT_FD}
+"""
+
+
+class _Job:
+    """the `subprocess.Popen` subset `Sh` uses, for a command run by a `Session`"""
+
+    def __init__(self, args: List[str], inline: bool) -> None:
+        self.args = args
+        self.returncode: Optional[int] = None
+        self.stdin: Optional[IO[bytes]] = None
+        self.stdout: Optional[IO[bytes]] = None
+        self.stderr: Optional[IO[bytes]] = None
+        self.failed: Optional[str] = None
+        # ends of pipes the shell opens, closed once it did
+        self._theirs: List[int] = []
+        self._inline = inline
+        self._pid = -1
+        self._started = Event()
+        self._exited = Event()
+        self._on_exit: List[Callable[[], Any]] = []
+        self._on_exit_lock = Lock()
+
+    @property
+    def pid(self) -> int:
+        self._started.wait()
+        return self._pid
+
+    def _start(self, pid: int):
+        self._pid = pid
+        for fd in self._theirs:
+            os.close(fd)
+        self._started.set()
+
+    def _exit(self, code: int):
+        if not self._started.is_set():
+            self._start(-1)
+        with self._on_exit_lock:
+            self.returncode = code
+            self._exited.set()
+        for callback in self._on_exit:
+            callback()
+
+    def on_exit(self, callback: Callable[[], Any]):
+        """call `callback` once the job exited, see `shshsh.reaper.Reaper.watch`"""
+        with self._on_exit_lock:
+            if not self._exited.is_set():
+                self._on_exit.append(callback)
+                return
+        callback()
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)  # type: ignore
+        assert self.returncode is not None
+        return self.returncode
+
+    def send_signal(self, sig: int):
+        # an inline job is the session shell itself
+        if not self._inline and self.pid > 0 and self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(15)
+
+    def kill(self):
+        self.send_signal(9)
+
+
+def _reopen_path(stdio: Any, pid: int, output: bool = False) -> Optional[str]:
+    """a path the session shell can open to get the same file as `stdio`.
+
+    None if it cannot be reopened by path: a socket, or a regular file, which
+    is opened again at another offset, but for an `output` opened with O_APPEND
+    (written at the end either way).
+    """
+    if stdio == subprocess.DEVNULL:
+        return os.devnull
+    fd = stdio if isinstance(stdio, int) else stdio.fileno()
+    mode = os.fstat(fd).st_mode
+    if stat.S_ISSOCK(mode):
+        return None
+    if stat.S_ISREG(mode) and not (
+        output and fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_APPEND
+    ):
+        return None
+    return f"/proc/{pid}/fd/{fd}"
+
+
+class Session:
+    """a long-lived `bash` which runs commands, instead of a fork/exec from python each.
+
+    a session is a spawn backend, use it with `Sh(cmd, spawn=session)`, `session.sh(cmd)`
+    or for every command with `global_vars.SPAWN = session`. commands are quoted
+    argv as for any `Sh` and run in the background of the shell, so a session runs
+    any number of them at once; stdio is reopened by the shell from
+    `/proc/<pid>/fd`, so pipes, `|`, `&`, `or_` and iteration work as usual.
+    a regular file would be reopened at another offset, so a command with stdio or
+    `pass_fds` on one runs with `popen`, unless it is an output opened to append.
+    `session.sh` leaves stderr to the one python had when the session started.
+
+    the win is for bash builtins (`test`, `[`, `pwd`, ... run without a fork at all)
+    and for a python process which is slow to fork. besides the env of the command,
+    bash exports `PWD`, `SHLVL` and `_` to it, and a command killed by a signal exits
+    with `128 + signal` instead of `-signal`. commands the shell cannot run as is
+    (stdio on a socket or a file, env names bash cannot export, ...) fall back to
+    `popen`.
+    """
+
+    def __init__(
+        self,
+        shell: str = "bash",
+        cwd: Optional[str] = None,
+        env: Optional[Mapping[str, str]] = None,
+    ) -> None:
+        from .env import snapshot
+
+        self._cwd = cwd or global_vars.CWD
+        self._env = snapshot(env or global_vars.ENV, None).encoded
+        # commands inheriting stdio get the one python has now
+        inherit: List[int] = []
+        for fd in range(3):
+            try:
+                inherit.append(os.dup(fd))
+            except OSError:
+                inherit.append(-1)
+        self._proc = subprocess.Popen(
+            [shell, "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            pass_fds=[fd for fd in inherit if fd != -1],
+            cwd=self._cwd,
+            env=self._env,
+        )
+        assert self._proc.stdin and self._proc.stdout
+        setup = [f"exec {_EVENT_FD}>&1 1>/dev/null"]
+        for fd, target, mode in zip(inherit, _STDIO_FDS, "<>>"):
+            if fd == -1:
+                setup.append(f"exec {target}{mode}/dev/null")
+            else:
+                setup.append(f"exec {target}{mode}&{fd} {fd}>&-")
+                os.close(fd)
+        self._proc.stdin.write("\n".join([*setup, _PRELUDE]).encode())
+        self._proc.stdin.flush()
+        self._builtins = {
+            os.fsdecode(name.rstrip(b"\n"))
+            for name in iter(self._proc.stdout.readline, b"\n")
+        }
+        self._ids = itertools.count()
+        self._jobs: Dict[int, _Job] = {}
+        self._lock = Lock()
+        self._closed = False
+        # exports of the last env seen, most commands share one env snapshot
+        self._last_env: Tuple[Optional[Mapping[bytes, bytes]], Optional[bytes]] = (
+            self._env,
+            b"",
+        )
+        self._reader = Thread(target=self._read_events, daemon=True)
+        self._reader.start()
+
+    def __enter__(self) -> "Session":
+        return self
+
+    def __exit__(self, *_: Any):
+        self.close()
+
+    @property
+    def running(self) -> int:
+        return len(self._jobs)
+
+    def sh(self, cmd: str, **kwargs: Any):
+        from .shell import Sh
+
+        kwargs.setdefault("stderr", None)
+        return Sh(cmd, spawn=self, **kwargs)
+
+    def close(self):
+        """stop taking commands, the running ones are left to finish"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            assert self._proc.stdin
+            self._proc.stdin.close()
+
+    def _read_events(self):
+        assert self._proc.stdout
+        for line in self._proc.stdout:
+            job_id, event, value = line.split(b" ", 2)
+            if event == b"pid":
+                self._jobs[int(job_id)]._start(int(value))
+                continue
+            job = self._jobs.pop(int(job_id))
+            if event == b"exit":
+                job._exit(int(value))
+            else:
+                job.failed = value.decode().strip()
+                job._exit(-1)
+        # the shell is gone
+        with self._lock:
+            self._closed = True
+            jobs, self._jobs = self._jobs, {}
+        for job in jobs.values():
+            job.failed = "session shell exited"
+            job._exit(-1)
+
+    def _exports(self, env: Mapping[bytes, bytes]) -> Optional[bytes]:
+        """shell code turning the session env into `env`, None if bash cannot"""
+        last_env, last = self._last_env
+        if env is last_env:
+            return last
+        code = []
+        for name in self._env.keys() - env.keys():
+            code.append((name, b"unset " + name + b";"))
+        for name, value in env.items():
+            if self._env.get(name) != value:
+                value = os.fsencode(shlex.quote(os.fsdecode(value)))
+                code.append((name, b"export " + name + b"=" + value + b";"))
+        exports: Optional[bytes] = b" ".join(line for _, line in code)
+        # every name goes into shell code as is
+        if not all(_NAME.fullmatch(name) for name, _ in code):
+            exports = None
+        self._last_env = (env, exports)
+        return exports
+
+    def __call__(
+        self,
+        cmd: List[str],
+        stdin: Any = None,
+        stdout: Any = None,
+        stderr: Any = None,
+        pass_fds: Tuple[int, ...] = (),
+        cwd: Optional[str] = None,
+        env: Optional[Mapping[bytes, bytes]] = None,
+        **kwargs: Any,
+    ) -> Any:
+        fallback = dict(
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            pass_fds=pass_fds,
+            cwd=cwd,
+            env=env,
+            **kwargs,
+        )
+        env = self._env if env is None else env
+        exports = self._exports(env)
+        if kwargs or exports is None:
+            return popen(cmd, **fallback)
+        # fail here as `Popen` does, not once the shell got to it
+        cwd = cwd if cwd and os.fspath(cwd) != self._cwd else ""
+        if cwd and not os.path.isdir(cwd):
+            raise FileNotFoundError(f"No such file or directory: {cwd!r}")
+        builtin = cmd[0] in self._builtins
+        if not builtin:
+            path = env.get(b"PATH")
+            if _which(cmd[0], os.fsdecode(path) if path is not None else None) is None:
+                raise FileNotFoundError(f"No such file or directory: {cmd[0]!r}")
+
+        job = _Job(cmd, inline=cmd[0] in _INLINE and not (exports or cwd))
+        pid = os.getpid()
+        redirects: List[str] = []
+        # our ends of the pipes
+        mine: List[Tuple[str, int, str]] = []
+        try:
+            for attr, target, stdio, mode in (
+                ("stdin", 0, stdin, "<"),
+                # `>>` does not truncate, and appends as the file given does
+                ("stdout", 1, stdout, ">>"),
+                ("stderr", 2, stderr, ">>"),
+            ):
+                if stdio is None:
+                    redirects.append(f"{target}{mode[0]}&{_STDIO_FDS[target]}")
+                    continue
+                if stdio == subprocess.STDOUT:
+                    redirects.append("2>&1")
+                    continue
+                if stdio == subprocess.PIPE:
+                    r, w = os.pipe()
+                    child, parent = (r, w) if target == 0 else (w, r)
+                    job._theirs.append(child)
+                    mine.append((attr, parent, "wb" if target == 0 else "rb"))
+                    stdio = child
+                path = _reopen_path(stdio, pid, output=target != 0)
+                if path is None:
+                    raise ValueError(f"cannot reopen {attr}")
+                redirects.append(f"{target}{mode}{shlex.quote(path)}")
+            for fd in pass_fds:
+                path = _reopen_path(fd, pid)
+                if path is None or fd in (_EVENT_FD, *_STDIO_FDS):
+                    raise ValueError(f"cannot pass fd {fd}")
+                redirects.append(f"{fd}<>{shlex.quote(path)}")
+        except (ValueError, OSError):
+            for fd in [*job._theirs, *(fd for _, fd, _ in mine)]:
+                os.close(fd)
+            return popen(cmd, **fallback)
+        for attr, fd, mode in mine:
+            setattr(job, attr, os.fdopen(fd, mode))
+
+        job_id = next(self._ids)
+        argv = " ".join(shlex.quote(arg) for arg in cmd)
+        failed = f'[ "$_shsh_ok" ] || echo "{job_id} fail redirect" >&{_EVENT_FD}'
+        # bytes, env values and args need not be utf8
+        if job._inline:
+            line = os.fsencode(
+                f"_shsh_ok=; _shsh_inline {job_id} {argv} {' '.join(redirects)}; "
+                f"{failed}\n"
+            )
+        else:
+            line = (
+                b"{ "
+                + exports
+                + os.fsencode(
+                    f" _shsh_ok=; "
+                    f"_shsh_job {job_id} {'1' if builtin else ''!r} {shlex.quote(cwd)} "
+                    f"{argv} {' '.join(redirects)}; {failed}; }} &\n"
+                )
+            )
+        with self._lock:
+            assert not self._closed, "session is closed"
+            assert self._proc.stdin
+            self._jobs[job_id] = job
+            self._proc.stdin.write(line)
+            self._proc.stdin.flush()
+        return job
+
+
+class SessionPool:
+    """a few `Session`s, each command goes to the one running the least"""
+
+    def __init__(self, size: int = 4, **kwargs: Any) -> None:
+        assert size > 0, "pool size should be positive"
+        self.sessions = [Session(**kwargs) for _ in range(size)]
+
+    def __enter__(self) -> "SessionPool":
+        return self
+
+    def __exit__(self, *_: Any):
+        self.close()
+
+    def sh(self, cmd: str, **kwargs: Any):
+        from .shell import Sh
+
+        kwargs.setdefault("stderr", None)
+        return Sh(cmd, spawn=self, **kwargs)
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+    def __call__(self, cmd: List[str], **kwargs: Any) -> Any:
+        return min(self.sessions, key=lambda s: s.running)(cmd, **kwargs)
@@ -0,0 +1,331 @@
+"""run a command or a function on parts of a large file in parallel, see `_I.shard`"""
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Deque,
+    Generator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from threading import Thread
+import errno
+import mmap
+import os
+import selectors
+import subprocess
+import tempfile
+from . import global_vars
+from .shell import Sh
+from .framing import Framing
+from .streamer import P, _run_task, process_pool, write_all
+
+# bytes of the file a function is called on per task
+TASK_SIZE = 16 * 1024 * 1024
+_CHUNK = 1024 * 1024
+
+Range = Tuple[int, int]
+
+
+def split_ranges(data: Any, parts: int, sep: bytes) -> List[Range]:
+    """cut `data` into up to `parts` ranges of about the same size, each ending
+    right after a `sep` (or at the end of `data`).
+
+    >>> split_ranges(b"a\\nbb\\nccc\\ndddd\\n", 3, b"\\n")
+    [(0, 5), (5, 9), (9, 14)]
+    """
+    size = len(data)
+    ranges: List[Range] = []
+    start = 0
+    for i in range(1, parts):
+        found = data.find(sep, max(size * i // parts - len(sep), start))
+        if found < 0:
+            break
+        end = found + len(sep)
+        if end > start:
+            ranges.append((start, end))
+            start = end
+    if start < size:
+        ranges.append((start, size))
+    return ranges
+
+
+def _feed(fd: int, pipe: int, start: int, end: int):
+    """write bytes `start` to `end` of file `fd` to `pipe` and close it"""
+    try:
+        while start < end:
+            try:
+                sent = os.sendfile(pipe, fd, start, end - start)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                    raise
+                data = os.pread(fd, min(_CHUNK, end - start), start)
+                write_all(pipe, data)
+                sent = len(data)
+            if not sent:
+                break
+            start += sent
+    except BrokenPipeError:
+        # the command stopped reading
+        pass
+    finally:
+        os.close(pipe)
+
+
+def _run_range(
+    process_func: Callable[..., Any],
+    path: str,
+    part: Range,
+    sep: bytes,
+    encoding: Optional[str],
+    batch_size: Optional[int],
+    output_framing: Optional[Framing],
+) -> bytes:
+    """run one task of a function over a part of the file, in a worker"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        records = m[part[0] : part[1]].split(sep)
+    if not records[-1]:
+        # the part ends with sep
+        records.pop()
+    if encoding:
+        records = [record.decode(encoding) for record in records]
+    if not batch_size:
+        return _run_task(process_func, records, False, sep, output_framing)
+    # a batch function gets batches of the same size as when it reads a pipe
+    return b"".join(
+        _run_task(process_func, records[i : i + batch_size], True, sep, output_framing)
+        for i in range(0, len(records), batch_size)
+    )
+
+
+def _blocks(pending: bytes, data: bytes, sep: bytes) -> Tuple[Optional[bytes], bytes]:
+    """(complete records of `pending` + `data` without the last sep, the rest)"""
+    data = pending + data
+    cut = data.rfind(sep)
+    if cut < 0:
+        return None, data
+    return data[:cut], data[cut + len(sep) :]
+
+
+class Shards:
+    """a file cut into parts which end with a record separator.
+
+    `shards | "cmd"` runs one `cmd` per part, each reading its part from a pipe
+    fed by `sendfile`, `shards | func` calls `func` on the records of tasks of
+    `TASK_SIZE` bytes (instead of `task_size` records) on a pool of `parts`
+    workers (processes of a forkserver, unless it is a `P` with another
+    `executor`). either gives a source stage with the output in the order of the
+    file, or in the order it is done if not `ordered` (or not `P.ordered`).
+    a batch function gets lists of `P.batch_size` records, and `P.output_framing`
+    is used to write its output.
+
+    `#{shard}` in `cmd` is filled with the index of its part.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        parts: Optional[int] = None,
+        sep: bytes = b"\n",
+        ordered: bool = True,
+        chunk_size: Any = 1024,
+    ) -> None:
+        self.path = os.path.join(global_vars.CWD, path)
+        self.parts = parts or os.cpu_count() or 1
+        self.sep = sep
+        self.ordered = ordered
+        self.chunk_size = chunk_size
+        # commands of the parts once they run, for their exit codes
+        self.commands: List[Sh] = []
+
+    def ranges(self, parts: Optional[int] = None) -> List[Range]:
+        """the byte ranges of `parts` parts of the file"""
+        with open(self.path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return split_ranges(m, parts or self.parts, self.sep)
+
+    def __or__(self, other: Union[str, P, Callable[..., Any]]) -> P:
+        sep = self.sep.decode("utf8")
+        if isinstance(other, str):
+            blocks = self._run_commands(other)
+        elif isinstance(other, P) or callable(other):
+            if not isinstance(other, P):
+                other = P(other)
+            blocks = self._run_function(other)
+            if other.output_framing is not None:
+                # blocks of encoded records, nothing goes in between
+                sep = ""
+        else:
+            raise ValueError(f"chain opt not support {other}")
+        return P(blocks, sep=sep, chunk_size=self.chunk_size)
+
+    def _start(
+        self, cmd: str, index: int, part: Range, fd: int
+    ) -> Tuple[Sh, Any, Thread]:
+        # the first part is read as it runs, the others are kept until their turn
+        first = index == 0 or not self.ordered
+        out = subprocess.PIPE if first else tempfile.TemporaryFile()
+        r, w = os.pipe()
+        try:
+            sh = Sh(
+                cmd,
+                stdin=r,
+                stdout=out,
+                chunk_size=self.chunk_size,
+                cwd=global_vars.CWD,
+            )(shard=index)
+            sh.run()
+        except BaseException:
+            os.close(w)
+            raise
+        finally:
+            os.close(r)
+        feeder = Thread(target=_feed, args=(fd, w, *part), daemon=True)
+        feeder.start()
+        return sh, out, feeder
+
+    def _run_commands(self, cmd: str) -> Generator[bytes, None, None]:
+        fd = os.open(self.path, os.O_RDONLY)
+        running: List[Tuple[Sh, Any, Thread]] = []
+        try:
+            for index, part in enumerate(self.ranges()):
+                running.append(self._start(cmd, index, part, fd))
+            self.commands = [sh for sh, _, _ in running]
+            if self.ordered:
+                for sh, out, _ in running:
+                    if out == subprocess.PIPE:
+                        yield from self._read(sh.stdout)
+                    else:
+                        sh.wait()
+                        out.seek(0)
+                        yield from self._read(out)
+            else:
+                yield from self._merge([sh.stdout for sh, _, _ in running])
+            for sh, _, _ in running:
+                sh.wait()
+        finally:
+            for sh, out, feeder in running:
+                if sh._proc.poll() is None:
+                    sh._proc.kill()
+                    sh._proc.wait()
+                if out != subprocess.PIPE:
+                    out.close()
+                if sh._proc.stdout:
+                    sh._proc.stdout.close()
+                # gets EPIPE if it is not done, now that the command is
+                feeder.join()
+            os.close(fd)
+
+    def _read(self, stream: IO[bytes]) -> Generator[bytes, None, None]:
+        pending = b""
+        while True:
+            data = os.read(stream.fileno(), _CHUNK)
+            if not data:
+                break
+            block, pending = _blocks(pending, data, self.sep)
+            if block is not None:
+                yield block
+        if pending:
+            yield pending
+
+    def _merge(self, streams: List[IO[bytes]]) -> Generator[bytes, None, None]:
+        """complete records of `streams`, as they come"""
+        with selectors.DefaultSelector() as selector:
+            for stream in streams:
+                selector.register(stream, selectors.EVENT_READ, [b""])
+            while selector.get_map():
+                for key, _ in selector.select():
+                    data = os.read(key.fd, _CHUNK)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        if key.data[0]:
+                            yield key.data[0]
+                        continue
+                    block, key.data[0] = _blocks(key.data[0], data, self.sep)
+                    if block is not None:
+                        yield block
+
+    def _run_function(self, stage: P) -> Generator[bytes, None, None]:
+        assert stage.arg_type is not None, "the function should take records"
+        assert not stage.is_async, "async functions cannot run on parts"
+        assert (
+            stage.framing is None
+        ), "the parts are cut at the separator of the file, not by a framing"
+        # only its function and options are used
+        os.close(stage.out_fd)
+        os.close(stage.in_fd)
+        stage.out_fd = stage.in_fd = -1
+        return self._function_blocks(stage)
+
+    def _function_blocks(self, stage: P) -> Generator[bytes, None, None]:
+        ordered = self.ordered and stage.ordered
+        framed = stage.output_framing is not None
+        workers = stage.workers or self.parts
+        if isinstance(stage.executor, Executor):
+            pool, own_pool = stage.executor, False
+        elif stage.executor == "process":
+            pool, own_pool = process_pool(workers), True
+        elif stage.executor == "thread":
+            pool, own_pool = ThreadPoolExecutor(workers), True
+        else:
+            raise ValueError(f"unknown executor: {stage.executor}")
+        size = os.path.getsize(self.path)
+        parts = self.ranges(max(workers, -(-size // TASK_SIZE)))
+        pending: Deque["Future[bytes]"] = deque()
+        running: Set["Future[bytes]"] = set()
+        try:
+            for part in parts:
+                future = pool.submit(
+                    _run_range,
+                    stage.process_func,
+                    self.path,
+                    part,
+                    self.sep,
+                    stage.encoding,
+                    stage.batch_size,
+                    stage.output_framing,
+                )
+                if ordered:
+                    pending.append(future)
+                    while pending and (len(pending) > workers * 2 or pending[0].done()):
+                        yield from self._output(pending.popleft(), framed)
+                else:
+                    running.add(future)
+                    if len(running) > workers * 2:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield from self._output(future, framed)
+            while pending:
+                yield from self._output(pending.popleft(), framed)
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from self._output(future, framed)
+        finally:
+            for future in (*pending, *running):
+                future.cancel()
+            if own_pool:
+                pool.shutdown(wait=False)
+
+    def _output(
+        self, future: "Future[bytes]", framed: bool
+    ) -> Generator[bytes, None, None]:
+        output = future.result()
+        if output and not framed:
+            # ended by sep, which is written after each record
+            yield output[: -len(self.sep)]
+        elif output:
+            yield output
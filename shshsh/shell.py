@@ -1,9 +1,20 @@
 import shlex
-from threading import Thread
-from .streamer import str_streamer, bytes_streamer, P
+import functools
+import asyncio
+from .streamer import (
+    str_streamer,
+    bytes_streamer,
+    copy_to_file,
+    P,
+    ChunkSize,
+    Splitter,
+    capture,
+)
 import io
+import mmap
+import resource
 import sys
-import copy
+import time
 import re
 from . import global_vars
 from typing import (
@@ -22,10 +33,20 @@ from typing import (
     TextIO,
     Collection,
     Callable,
+    AsyncGenerator,
+    Sequence,
+    Mapping,
 )
 import subprocess
 
-from shshsh.pipe import Pipe
+from shshsh.pipe import Pipe, Substitution
+from .env import snapshot as env_snapshot
+from .metrics import MetricsOption, new_metrics, option_of
+from .spawn import Spawner, get_spawner
+from .reaper import get_reaper
+from .fork import fork_stream
+from .framing import Framing
+from .cache import CachePolicy
 
 
 class Symbol:
@@ -39,11 +60,60 @@ class Symbol:
 stdout = sys.stdout
 stderr = sys.stderr
 keep = subprocess.PIPE
-fork_stream = Symbol("fork_stream")
 
 _STD = Optional[Union[IO[bytes], int]]
 
 
+class _Template:
+    """a command split into tokens once, with the placeholder slots of each token.
+
+    a token with slots is kept as literal pieces around them, so filling args is
+    a join per token instead of parsing the command again.
+    """
+
+    def __init__(self, tokens: List[str], placeholder: str) -> None:
+        matcher = Sh._get_placeholder_matcher(placeholder=placeholder)
+        left, right = placeholder.split("*")
+        self.tokens = tokens
+        # (token index, literal pieces, [(placeholder, key)]), len(pieces) == len(slots) + 1
+        self.slotted: List[Tuple[int, List[str], List[Tuple[str, str]]]] = []
+        for i, token in enumerate(tokens):
+            slots = [
+                (placeholder, placeholder[len(left) : -len(right)])
+                for placeholder in matcher.findall(token)
+            ]
+            if slots:
+                self.slotted.append((i, matcher.split(token), slots))
+
+    def fill(
+        self, args: Sequence[Any], kwargs: Dict[str, Any]
+    ) -> Tuple[bool, List[str]]:
+        cmd_list = list(self.tokens)
+        param_complete = True
+        curr_args_idx = 0
+        for i, pieces, slots in self.slotted:
+            filled = [pieces[0]]
+            for (placeholder, key), piece in zip(slots, pieces[1:]):
+                if key in kwargs:
+                    filled.append(str(kwargs[key]))
+                elif not key and curr_args_idx < len(args):
+                    filled.append(str(args[curr_args_idx]))
+                    curr_args_idx += 1
+                else:
+                    filled.append(placeholder)
+                    param_complete = False
+                filled.append(piece)
+            cmd_list[i] = "".join(filled)
+        return param_complete, cmd_list
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_template(cmd: Union[str, Tuple[str, ...]], placeholder: str) -> _Template:
+    if isinstance(cmd, str):
+        return _Template(Sh._split_with_placeholder(cmd, placeholder), placeholder)
+    return _Template(list(cmd), placeholder)
+
+
 class Sh:
     @staticmethod
     def _if_placeholder_valid(placeholder: str) -> bool:
@@ -124,31 +194,13 @@ class Sh:
         >>> Sh._parse_cmd("echo #{abc}, #{}, #{}#{efg}", '#{*}', '123', '456', abc='test', efg='xxx')
         (True, ['echo', 'test,', '123,', '456xxx'])
         """
-        cmd = copy.copy(cmd)
-        if isinstance(cmd, str):
-            cmd_list = Sh._split_with_placeholder(cmd, arg_placeholder)
-        else:
-            cmd_list = cmd
+        return Sh._compile(cmd, arg_placeholder).fill(args, kwargs)
 
-        placeholder_matcher = Sh._get_placeholder_matcher(placeholder=arg_placeholder)
-        left_placeholder, right_placeholder = arg_placeholder.split("*")
-
-        curr_args_idx = 0
-        param_complete = True
-        for i, _ in enumerate(cmd_list):
-            for placeholder in re.findall(placeholder_matcher, cmd_list[i]):
-                key = placeholder[len(left_placeholder) : -len(right_placeholder)]
-                if key in kwargs:
-                    cmd_list[i] = cmd_list[i].replace(placeholder, str(kwargs[key]))
-                    continue
-                if not key and curr_args_idx < len(args):
-                    cmd_list[i] = cmd_list[i].replace(
-                        placeholder, str(args[curr_args_idx]), 1
-                    )
-                    curr_args_idx += 1
-                    continue
-                param_complete = False
-        return param_complete, cmd_list
+    @staticmethod
+    def _compile(cmd: Union[str, List[str]], arg_placeholder: str) -> _Template:
+        return _compile_template(
+            cmd if isinstance(cmd, str) else tuple(cmd), arg_placeholder
+        )
 
     def __init__(
         self,
@@ -159,33 +211,62 @@ class Sh:
         stderr: Union[_STD, TextIO] = stderr,
         pass_fds: Collection[int] = (),
         callback: Optional[Callable[..., Any]] = None,
-        env: Optional[Dict[str, str]] = None,
+        env: Optional[Mapping[str, str]] = None,
         cwd: Optional[str] = None,
         zero_mode: bool = False,
+        chunk_size: ChunkSize = 1024,
+        env_update: Optional[Mapping[str, str]] = None,
+        spawn: Union[str, Spawner, None] = None,
+        metrics: MetricsOption = None,
+        cache: Optional[CachePolicy] = None,
         *args: Any,
         **kwargs: Any,
     ) -> None:
-        self._env = copy.copy(env) or global_vars.ENV
+        # an immutable snapshot, shared with every command of the same env
+        self._env = env_snapshot(env or global_vars.ENV, env_update)
         self._cwd = cwd or global_vars.CWD
+        self._spawn = get_spawner(spawn or global_vars.SPAWN)
         self._proc = None
+        self._aproc: Optional[asyncio.subprocess.Process] = None
+        # async stages feeding stdin, started together with this command
+        self._upstream: List[P] = []
         self._stdin = stdin
         self._stdout = stdout
         self._stderr = stderr
         self._zero_mode = zero_mode
+        self._chunk_size = chunk_size
         self.pass_fds = pass_fds
+        # replay the output of the same run from disk, see `CachePolicy`
+        self._cache = cache
         assert self._if_placeholder_valid(
             arg_placeholder
         ), "placeholder should must has one `*` to represent arg name, and should not as first and last char. valid e.g. `#{*}`"
 
         self.arg_placeholder = arg_placeholder
-        self.cmd = cmd
+        self._template = self._compile(cmd, arg_placeholder)
+        # args given so far, the template is filled from scratch on every change
+        self._args: List[Any] = []
+        self._kwargs: Dict[str, Any] = {}
         self.callback = callback
+        # resource usage of the process once it exited, None if unknown
+        self.rusage: Optional[resource.struct_rusage] = None
+        self.metrics = new_metrics(
+            cmd if isinstance(cmd, str) else " ".join(cmd), metrics
+        )
+        # the stage piped into this one, see `shshsh.metrics.report`
+        self._prev: Any = None
+        # `<(...)`/`>(...)` args, started together with this command
+        self._substitutions: List[Substitution] = []
         self._try_parse(*args, **kwargs)
 
-    def _try_parse(self, *args: str, **kwargs: str):
-        self.param_complete, self.cmd = self._parse_cmd(
-            self.cmd, self.arg_placeholder, *args, **kwargs
-        )
+    def _try_parse(self, *args: Any, **kwargs: Any):
+        self._args = [*self._args, *args]
+        # the first value given for a name wins
+        self._kwargs = {**kwargs, **self._kwargs}
+        self.param_complete, self.cmd = self._template.fill(self._args, self._kwargs)
+        for arg in (*args, *kwargs.values()):
+            if isinstance(arg, Substitution):
+                self._substitutions.append(arg)
 
     def set_stdin(self, stdin: Union[int, IO[bytes]]):
         assert not self._proc, "is running, cannot set stdin"
@@ -225,45 +306,146 @@ class Sh:
 
     def run(self):
         assert (
-            not self._proc
+            not self._proc and not self._aproc
         ), f"cannot run twice, command {self.cmd} already run, place create a new Sh"
         if self.param_complete:
-            self._proc = subprocess.Popen(
-                self.cmd,
+            for stage in self._upstream:
+                if not stage.started:
+                    stage.run()
+            if self.metrics is not None:
+                self.metrics.name = shlex.join(self.cmd)
+                started = time.perf_counter()
+            self._start_substitutions()
+            try:
+                if self._cache is not None:
+                    assert (
+                        not self.pass_fds
+                    ), "cannot cache a command with pass_fds, only stdout and stderr are kept"
+                    self._proc = self._cache.spawn(
+                        self._spawn,
+                        self.cmd,
+                        stdin=self._stdin,
+                        stdout=self._stdout,
+                        stderr=self._stderr,
+                        cwd=self._cwd,
+                        env=self._env,
+                        encoded_env=self._env.encoded,
+                    )
+                else:
+                    self._proc = self._spawn(
+                        self.cmd,
+                        stdin=self._stdin,
+                        stderr=self._stderr,
+                        stdout=self._stdout,  # type: ignore
+                        pass_fds=self.pass_fds,
+                        cwd=self._cwd,
+                        env=self._env.encoded,
+                    )
+            finally:
+                for substitution in self._substitutions:
+                    substitution._close()
+            if self.metrics is not None:
+                self.metrics.spawn_time = time.perf_counter() - started
+                self.metrics.start = time.monotonic()
+            if self.callback or self.metrics is not None:
+                # reaped as soon as it exits, without a thread of its own
+                get_reaper().watch(self._proc, self._exited)
+        else:
+            raise ValueError(f"some args may not fill, current cmd: {self.cmd}")
+
+    def _start_substitutions(self):
+        """start the stages of `<(...)`/`>(...)` args, the command gets their ends"""
+        for substitution in self._substitutions:
+            substitution._start()
+            self.pass_fds = (*self.pass_fds, substitution.fd)
+
+    def _exited(self, proc: Any, rusage: Optional[resource.struct_rusage]):
+        self.rusage = rusage
+        if self.metrics is not None:
+            if rusage is not None:
+                self.metrics.cpu_time = rusage.ru_utime + rusage.ru_stime
+            self.metrics.finish()
+        if self.callback:
+            self.callback()
+
+    async def arun(self) -> "Sh":
+        """start on the running event loop, without threads.
+
+        stdout/stderr of the process are then `asyncio.StreamReader`, read them
+        with `async for` / `aiter`.
+        """
+        assert (
+            not self._proc and not self._aproc
+        ), f"cannot run twice, command {self.cmd} already run, place create a new Sh"
+        if not self.param_complete:
+            raise ValueError(f"some args may not fill, current cmd: {self.cmd}")
+        assert self._cache is None, "a cached command cannot run on the event loop"
+        for stage in self._upstream:
+            if not stage.started:
+                await stage.arun()
+        if self.metrics is not None:
+            self.metrics.name = shlex.join(self.cmd)
+            started = time.perf_counter()
+        self._start_substitutions()
+        try:
+            self._aproc = await asyncio.create_subprocess_exec(
+                *self.cmd,
                 stdin=self._stdin,
                 stderr=self._stderr,
-                stdout=self._stdout,  # type: ignore
+                stdout=self._stdout,
                 pass_fds=self.pass_fds,
                 cwd=self._cwd,
-                env=self._env,
+                env=self._env.encoded,
             )
+        finally:
+            for substitution in self._substitutions:
+                substitution._close()
+        if self.metrics is not None:
+            self.metrics.spawn_time = time.perf_counter() - started
+            self.metrics.start = time.monotonic()
+        if self.callback:
+            callback = self.callback
+            proc = self._aproc
+
+            async def wait_done():
+                await proc.wait()
+                callback()
+
+            self._callback_task = asyncio.ensure_future(wait_done())
+        return self
 
-            # wait done and call callback
-            def wait_done():
-                assert self._proc
-                self._proc.wait()
-                assert self.callback
-                self.callback()
-
-            if self.callback:
-                Thread(target=wait_done, daemon=True).run()
-        else:
-            raise ValueError(f"some args may not fill, current cmd: {self.cmd}")
+    async def await_code(self) -> int:
+        if self._proc is None and self._aproc is None:
+            await self.arun()
+        if self._aproc is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.wait)
+            return self.code
+        code = await self._aproc.wait()
+        if self._aproc.stdin:
+            # nothing reads it anymore
+            self._aproc.stdin.close()
+        if self.metrics is not None:
+            self.metrics.finish()
+        return code
 
     def pid(self) -> int:
-        assert self._proc, "process not start yet"
-        return self._proc.pid
+        proc = self._proc or self._aproc
+        assert proc, "process not start yet"
+        return proc.pid
 
     @property
     def code(self) -> int:
-        assert self._proc, "process not start yet"
-        return self._proc.returncode
+        proc = self._proc or self._aproc
+        assert proc, "process not start yet"
+        return proc.returncode  # type: ignore
 
     def wait(self, timeout: Optional[float] = None):
         if self._proc is None:
             self.run()
         assert self._proc
         self._proc.wait(timeout=timeout)
+        if self.metrics is not None:
+            self.metrics.finish()
         return self
 
     def __mod__(self, other: Union[Tuple[str, ...], Dict[str, str], str, Pipe]):
@@ -313,6 +495,8 @@ class Sh:
             P,
             Callable[[bytes], Union[str, bytes]],
             Callable[[str], Union[str, bytes]],
+            Callable[[List[bytes]], Iterable[Union[str, bytes]]],
+            Callable[[List[str]], Iterable[Union[str, bytes]]],
             Iterable[Union[str, bytes]],
         ],
     ) -> P:
@@ -330,10 +514,25 @@ class Sh:
         ],
     ) -> Union["Sh", P]:
         if isinstance(other, io.IOBase):
-            self._stdout = other
             if not self._proc:
+                self._stdout = other
                 self.run()
+            else:
+                # already running with stdout piped to us, move the rest in the kernel
+                assert self._proc.stdout, f"stdout is redirect to {self._stdout}"
+                copy_to_file(
+                    self._proc.stdout.fileno(), other, chunk_size=self._chunk_size
+                )
             return self
+        elif isinstance(other, fork_stream):
+            if not self._proc:
+                self._stdout = subprocess.PIPE
+                self.run()
+            assert (
+                self.stdout
+            ), f"cannot fork stdout, process already running and its stdout is not pipe, is {self._stdout}"
+            other._prev = self
+            return other.start(self.stdout.fileno())
         elif isinstance(other, Sh):
             assert other._proc is None, f"cannot pipe after cmd run.({other.cmd})"
             if not self._proc:
@@ -341,10 +540,12 @@ class Sh:
             assert self._proc
             self._stdout = subprocess.PIPE
             other._stdin = self._proc.stdout
+            other._prev = self
             return other
         elif isinstance(other, P):
             self._stdout = subprocess.PIPE
             other.set_source(self.stdout)
+            other._prev = self
             return other
         elif isinstance(other, str):
             if not other:
@@ -355,11 +556,24 @@ class Sh:
             assert self._proc
             assert self._proc.stdout
             new_sh = Sh(
-                other, stdin=self.stdout, cwd=global_vars.CWD, env=global_vars.ENV
+                other,
+                stdin=self.stdout,
+                cwd=global_vars.CWD,
+                env=global_vars.ENV,
+                chunk_size=self._chunk_size,
+                spawn=self._spawn,
+                metrics=option_of(self.metrics),
             )
+            new_sh._prev = self
             return new_sh
         elif isinstance(other, Callable) or isinstance(other, Iterable):  # type: ignore
-            p = P(other, zero_output=self._zero_mode)
+            p = P(
+                other,
+                zero_output=self._zero_mode,
+                chunk_size=self._chunk_size,
+                metrics=option_of(self.metrics),
+            )
+            p._prev = self
             if not self._proc:
                 self._stdout = subprocess.PIPE
                 self.run()
@@ -373,13 +587,23 @@ class Sh:
 
     @overload
     def iter(
-        self, result_type: Type[str], sep: str = "\n", chunk_size: int = 1024
+        self,
+        result_type: Type[str],
+        sep: str = "\n",
+        chunk_size: ChunkSize = ...,
+        max_line_length: Optional[int] = None,
+        framing: Optional["Framing"] = None,
     ) -> Generator[str, Any, None]:
         ...
 
     @overload
     def iter(
-        self, result_type: Type[bytes], sep: bytes = b"\n", chunk_size: int = 1024
+        self,
+        result_type: Type[bytes],
+        sep: bytes = b"\n",
+        chunk_size: ChunkSize = ...,
+        max_line_length: Optional[int] = None,
+        framing: Optional["Framing"] = None,
     ) -> Generator[bytes, Any, None]:
         ...
 
@@ -387,20 +611,39 @@ class Sh:
         self,
         result_type: Union[Type[str], Type[bytes]] = str,
         sep: Union[str, bytes] = ...,
-        chunk_size: int = 1024,
+        chunk_size: ChunkSize = ...,
+        max_line_length: Optional[int] = None,
+        framing: Optional["Framing"] = None,
     ):
+        """records of stdout, ended by `sep` or cut by `framing`"""
+        if chunk_size is ...:
+            chunk_size = self._chunk_size
         if result_type is str:
             if sep is ...:
                 sep = "\n"
             else:
                 assert isinstance(sep, str)
-            return str_streamer(self.stdout, sep=sep, chunk_size=chunk_size)
+            return str_streamer(
+                self.stdout,
+                sep=sep,
+                chunk_size=chunk_size,
+                max_line_length=max_line_length,
+                stats=self.metrics.output if self.metrics else None,
+                framing=framing,
+            )
         elif result_type is bytes:
             if sep is ...:
                 sep = b"\n"
             else:
                 assert isinstance(sep, bytes)
-            return bytes_streamer(self.stdout, sep=sep, chunk_size=chunk_size)
+            return bytes_streamer(
+                self.stdout,
+                sep=sep,
+                chunk_size=chunk_size,
+                max_line_length=max_line_length,
+                stats=self.metrics.output if self.metrics else None,
+                framing=framing,
+            )
         else:
             raise ValueError(f"result type: {result_type} is not supported")
 
@@ -410,6 +653,62 @@ class Sh:
         else:
             return self.iter()  # type: ignore
 
+    async def aiter(
+        self,
+        result_type: Union[Type[str], Type[bytes]] = str,
+        sep: Union[str, bytes] = ...,
+        chunk_size: ChunkSize = ...,
+        max_line_length: Optional[int] = None,
+        framing: Optional["Framing"] = None,
+    ) -> AsyncGenerator[Any, None]:
+        """async version of `iter`, starts the command with `arun` if needed"""
+        if result_type not in (str, bytes):
+            raise ValueError(f"result type: {result_type} is not supported")
+        if sep is ...:
+            sep = "\x00" if self._zero_mode else "\n"
+        if chunk_size is ...:
+            chunk_size = self._chunk_size
+        if self._proc is None and self._aproc is None:
+            self._stdout = subprocess.PIPE
+            await self.arun()
+        assert (
+            self._aproc and self._aproc.stdout
+        ), f"cannot get stdout asynchronously, command is not started by `arun` or stdout is redirect to {self._stdout}"
+        kwargs: Dict[str, Any] = dict(
+            chunk_size=chunk_size,
+            max_line_length=max_line_length,
+            encoding="utf8" if result_type is str else None,
+            stats=self.metrics.output if self.metrics else None,
+        )
+        if framing is not None:
+            splitter = framing.splitter(self._aproc.stdout, **kwargs)  # type: ignore
+        else:
+            splitter = Splitter(
+                self._aproc.stdout,  # type: ignore
+                sep=sep.encode("utf8") if isinstance(sep, str) else sep,
+                **kwargs,
+            )
+        async for record in splitter:
+            yield record
+
+    def __aiter__(self) -> AsyncGenerator[str, None]:
+        return self.aiter()
+
+    def capture(
+        self, memory_limit: int = 64 * 1024 * 1024
+    ) -> Union[memoryview, mmap.mmap]:
+        """read the whole stdout in large blocks.
+
+        up to `memory_limit` bytes it is kept in memory and a memoryview is returned,
+        past that it is spilled to a temp file and a read-only mmap of it is returned.
+        either can be searched with `re` or sliced without copying it all.
+        """
+        return capture(
+            self.stdout,
+            memory_limit=memory_limit,
+            stats=self.metrics.output if self.metrics else None,
+        )
+
     def __and__(self, other: Union["Sh", str]) -> "Sh":
         if self._proc is None:
             self.run()
@@ -422,6 +721,8 @@ class Sh:
                     other,
                     cwd=global_vars.CWD,
                     env=global_vars.ENV,
+                    chunk_size=self._chunk_size,
+                    spawn=self._spawn,
                 )
             elif isinstance(other, Sh):  # type: ignore
                 return other
@@ -450,6 +751,8 @@ class Sh:
                     other,
                     cwd=global_vars.CWD,
                     env=global_vars.ENV,
+                    chunk_size=self._chunk_size,
+                    spawn=self._spawn,
                 )
                 res.run()
                 return res
@@ -0,0 +1,154 @@
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+import functools
+import os
+import shutil
+import signal
+import subprocess
+
+Spawner = Callable[..., subprocess.Popen]
+
+
+def popen(cmd: List[str], **kwargs: Any) -> subprocess.Popen:
+    """the classic fork/exec path of `subprocess.Popen`"""
+    return subprocess.Popen(cmd, **kwargs)
+
+
+@functools.lru_cache(maxsize=256)
+def _which(name: str, path: Optional[str]) -> Optional[str]:
+    if os.sep in name:
+        return name
+    return shutil.which(name, path=path)
+
+
+def _same_fd_dup2_clears_cloexec() -> bool:
+    # dup2(fd, fd) as a spawn file action only makes fd inheritable on glibc >= 2.29
+    try:
+        version = os.confstr("CS_GNU_LIBC_VERSION") or ""
+    except (ValueError, OSError):
+        return False
+    name, _, number = version.partition(" ")
+    if name != "glibc":
+        return False
+    major, _, minor = number.partition(".")
+    return (int(major), int(minor.split(".")[0] or 0)) >= (2, 29)
+
+
+_PASS_FDS_SUPPORTED = hasattr(os, "posix_spawn") and _same_fd_dup2_clears_cloexec()
+
+
+class _PosixSpawnPopen(subprocess.Popen):
+    """`subprocess.Popen` which starts the child with `os.posix_spawn` (vfork/clone
+    on linux), so no page tables of a large parent are copied.
+
+    non-inheritable fds are closed by exec as usual, but unlike `close_fds=True`
+    inheritable fds other than stdio and `pass_fds` are not closed.
+    """
+
+    def _execute_child(  # type: ignore
+        self,
+        args: List[str],
+        executable: Optional[str],
+        preexec_fn: Any,
+        close_fds: bool,
+        pass_fds: Collection[int],
+        cwd: Any,
+        env: Optional[Mapping[Any, Any]],
+        startupinfo: Any,
+        creationflags: int,
+        shell: bool,
+        p2cread: int,
+        p2cwrite: int,
+        c2pread: int,
+        c2pwrite: int,
+        errread: int,
+        errwrite: int,
+        restore_signals: bool,
+        *_: Any,
+    ) -> None:
+        file_actions: List[Tuple[int, ...]] = [
+            (os.POSIX_SPAWN_CLOSE, fd)
+            for fd in (p2cwrite, c2pread, errread)
+            if fd != -1
+        ]
+        for fd, target in ((p2cread, 0), (c2pwrite, 1), (errwrite, 2)):
+            if fd != -1:
+                file_actions.append((os.POSIX_SPAWN_DUP2, fd, target))
+        for fd in pass_fds:
+            file_actions.append((os.POSIX_SPAWN_DUP2, fd, fd))
+        kwargs: Dict[str, Any] = {"file_actions": file_actions}
+        if restore_signals:
+            kwargs["setsigdef"] = [
+                getattr(signal, name)
+                for name in ("SIGPIPE", "SIGXFZ", "SIGXFSZ")
+                if hasattr(signal, name)
+            ]
+        self.pid = os.posix_spawn(executable, args, env, **kwargs)  # type: ignore
+        self._child_created = True
+        self._close_pipe_fds(p2cread, p2cwrite, c2pread, c2pwrite, errread, errwrite)  # type: ignore
+
+
+def _stdio_fd(stdio: Any) -> int:
+    if stdio is None or stdio in (subprocess.PIPE, subprocess.DEVNULL):
+        return -1
+    if isinstance(stdio, int):
+        return stdio
+    return stdio.fileno()
+
+
+def posix_spawn(cmd: List[str], **kwargs: Any) -> subprocess.Popen:
+    """spawn with `os.posix_spawn`, fall back to `popen` for what it cannot do:
+    a cwd other than the current one, pass_fds without glibc >= 2.29, or stdio
+    wired to another standard fd.
+    """
+    cwd = kwargs.pop("cwd", None)
+    env: Optional[Mapping[Any, Any]] = kwargs.get("env")
+    pass_fds = kwargs.get("pass_fds", ())
+    try:
+        stdio_ok = all(
+            fd == -1 or fd == target or fd > 2
+            for fd, target in (
+                (_stdio_fd(kwargs.get("stdin")), 0),
+                (_stdio_fd(kwargs.get("stdout")), 1),
+                (_stdio_fd(kwargs.get("stderr")), 2),
+            )
+        )
+    except (AttributeError, OSError, ValueError):
+        stdio_ok = False
+    if (
+        not hasattr(os, "posix_spawn")
+        or (cwd is not None and os.fspath(cwd) != os.getcwd())
+        or (pass_fds and not _PASS_FDS_SUPPORTED)
+        or not stdio_ok
+    ):
+        return popen(cmd, cwd=cwd, **kwargs)
+    if env is None:
+        path = os.environ.get("PATH")
+    else:
+        path = env.get(b"PATH", env.get("PATH"))  # type: ignore
+    executable = _which(cmd[0], os.fsdecode(path) if path is not None else None)
+    if executable is None:
+        raise FileNotFoundError(f"No such file or directory: {cmd[0]!r}")
+    return _PosixSpawnPopen(cmd, executable=executable, **kwargs)
+
+
+BACKENDS: Dict[str, Spawner] = {"popen": popen, "posix_spawn": posix_spawn}
+
+
+def get_spawner(backend: Union[str, Spawner]) -> Spawner:
+    if callable(backend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"unknown spawn backend: {backend}, should be in {list(BACKENDS)}"
+        )
+    return BACKENDS[backend]
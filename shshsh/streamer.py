@@ -7,37 +7,430 @@ from typing import (
     TypeVar,
     List,
     Optional,
+    Generator,
+    Iterator,
+    AsyncGenerator,
+    AsyncIterable,
+    Any,
+    Dict,
     TYPE_CHECKING,
+    Literal,
+    Awaitable,
+    Deque,
+    Set,
     overload,
+    get_origin,
+    get_args,
 )
 from . import global_vars
+from .fdcopy import copy_fd
+from .metrics import IOStats, MetricsOption, new_metrics, option_of
 import io
 import os
+import stat
+import fcntl
+import mmap
+import multiprocessing
+import tempfile
 import copy
-from threading import Thread
+from threading import Event, Lock, Thread
 import inspect
+import time
+import asyncio
+import functools
+import select
+from collections import deque
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+)
 
 if TYPE_CHECKING:
     from .shell import Sh
+    from .framing import Framing
+
+
+ChunkSize = Union[int, Literal["auto"]]
+
+_F_GETPIPE_SZ: Optional[int] = getattr(fcntl, "F_GETPIPE_SZ", None)
+_F_SETPIPE_SZ: Optional[int] = getattr(fcntl, "F_SETPIPE_SZ", None)
+
+
+class LineTooLongError(Exception):
+    ...
+
+
+def _pipe_max_size() -> int:
+    try:
+        with open("/proc/sys/fs/pipe-max-size") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 1024 * 1024
+
+
+class ReadSizer:
+    """read size policy of `chunk_size="auto"`.
+
+    the size doubles while reads come back full, up to the capacity of the pipe
+    (which is raised with F_SETPIPE_SZ once it is reached), and halves when
+    reads come back mostly empty, which means the producer is interactive.
+    """
+
+    MIN_SIZE = 1024
+    MAX_SIZE = 1024 * 1024
+
+    def __init__(self, stream: Optional[IO[bytes]] = None, grow_pipe: bool = True):
+        self.size = self.MIN_SIZE
+        self.max_size = self.MAX_SIZE
+        self._pipe_fd: Optional[int] = None
+        self._grow_pipe = grow_pipe
+        try:
+            fd = stream.fileno() if stream is not None else None
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if fd is not None and _F_GETPIPE_SZ is not None:
+            try:
+                if stat.S_ISFIFO(os.fstat(fd).st_mode):
+                    self.max_size = fcntl.fcntl(fd, _F_GETPIPE_SZ)
+                    self._pipe_fd = fd
+            except OSError:
+                pass
+
+    def _raise_pipe_size(self):
+        self._grow_pipe = False
+        if self._pipe_fd is None or _F_SETPIPE_SZ is None:
+            return
+        try:
+            self.max_size = fcntl.fcntl(
+                self._pipe_fd, _F_SETPIPE_SZ, max(_pipe_max_size(), self.max_size)
+            )
+        except OSError:
+            pass
+
+    def update(self, n: int):
+        """feed back how many bytes the last read of `size` returned"""
+        if n >= self.size:
+            if self.size >= self.max_size and self._grow_pipe:
+                self._raise_pipe_size()
+            self.size = min(self.size * 2, self.max_size)
+        elif n < self.size // 4:
+            self.size = max(self.size // 2, self.MIN_SIZE)
+
+
+def copy_to_file(src: int, file: IO[Any], chunk_size: ChunkSize = 1024) -> int:
+    """copy fd `src` to `file` until EOF, inside the kernel if `file` has a fd.
+
+    :return: bytes copied.
+    """
+    file.flush()
+    try:
+        dst = file.fileno()
+    except (AttributeError, OSError, ValueError):
+        dst = -1
+    if dst >= 0:
+        return copy_fd(src, dst)
+    sink = getattr(file, "buffer", file)
+    total = 0
+    with os.fdopen(src, "rb", closefd=False) as stream:
+        for chunk in block_streamer(stream, chunk_size=chunk_size):
+            sink.write(chunk)
+            total += len(chunk)
+    file.flush()
+    return total
 
 
-def bytes_streamer(stream: IO[bytes], sep: bytes = b"\n", chunk_size: int = 1024):
-    chunk_data = b""
+def block_streamer(stream: IO[bytes], chunk_size: ChunkSize = 1024):
+    """yield raw blocks of `stream` as soon as they arrive"""
+    sizer = ReadSizer(stream) if chunk_size == "auto" else None
+    read = getattr(stream, "read1", None) or stream.read
     while True:
-        new_chunk_data = stream.read(chunk_size)
-        if not new_chunk_data:
-            yield chunk_data
+        data = read(sizer.size if sizer else chunk_size)
+        if not data:
             return
-        chunk_data += new_chunk_data
-        chunks = chunk_data.split(sep)
-        for chunk in chunks[:-1]:
-            yield chunk
-        chunk_data = chunks[-1] if len(chunks) != 0 else b""
+        if sizer:
+            sizer.update(len(data))
+        yield data
+
+
+def capture(
+    stream: IO[bytes],
+    memory_limit: int = 64 * 1024 * 1024,
+    block_size: int = 1024 * 1024,
+    stats: Optional[IOStats] = None,
+) -> Union[memoryview, mmap.mmap]:
+    """read `stream` until EOF into one buffer.
+
+    the buffer grows by doubling up to `memory_limit` bytes, past that the output
+    goes to a temp file instead, written `block_size` bytes at a time.
+
+    :return: a memoryview of the buffer, or a read-only mmap of the temp file.
+    """
+    started = time.perf_counter()
+    buf = bytearray(min(64 * 1024, memory_limit) or 1)
+    size = 0
+    while True:
+        if size == len(buf):
+            if size >= memory_limit:
+                break
+            buf.extend(bytes(min(size * 2, memory_limit) - size))
+        with memoryview(buf) as view:
+            n = stream.readinto(view[size:])  # type: ignore
+        if not n:
+            del buf[size:]
+            if stats is not None:
+                stats.bytes += size
+                stats.blocked += time.perf_counter() - started
+            return memoryview(buf)
+        size += n
+
+    with tempfile.TemporaryFile() as spill:
+        spill.write(buf)
+        del buf
+        block = bytearray(block_size)
+        with memoryview(block) as view:
+            while True:
+                n = stream.readinto(view)  # type: ignore
+                if not n:
+                    break
+                spill.write(view[:n])
+                size += n
+        spill.flush()
+        if stats is not None:
+            stats.bytes += size
+            stats.blocked += time.perf_counter() - started
+        return mmap.mmap(spill.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Splitter:
+    """split a byte stream into records.
+
+    data is read with `readinto` into one reusable buffer and only bytes not
+    scanned yet are searched for `sep`, complete records are cut out with one
+    `split` per read. the cost per byte stays flat no matter how long a record is.
+    with `encoding`, records are decoded once per read block instead of per record.
+    """
+
+    def __init__(
+        self,
+        stream: IO[bytes],
+        sep: bytes = b"\n",
+        chunk_size: ChunkSize = 1024,
+        max_line_length: Optional[int] = None,
+        before_read: Optional[Callable[[], Any]] = None,
+        encoding: Optional[str] = None,
+        with_raw: bool = False,
+        stats: Optional[IOStats] = None,
+    ) -> None:
+        assert sep, "sep should not be empty"
+        self.stream = stream
+        self.sep = sep
+        self.before_read = before_read
+        # yield decoded records, or (record, raw bytes) pairs if `with_raw`
+        self.encoding = encoding
+        self.with_raw = with_raw
+        # bytes/records read and time blocked reading are added up here if given
+        self.stats = stats
+        self._text_sep = sep.decode(encoding) if encoding else ""
+        self._sizer = ReadSizer(stream) if chunk_size == "auto" else None
+        self.chunk_size = self._sizer.size if self._sizer else int(chunk_size)
+        self.max_line_length = max_line_length
+        self._buf = bytearray(max(self.chunk_size, 1024))
+        # buf[_start:_end] is unconsumed data, buf[_start:_scan] has no sep in it
+        self._start = 0
+        self._end = 0
+        self._scan = 0
+        self._readinto = getattr(stream, "readinto1", None) or getattr(
+            stream, "readinto", None
+        )
+
+    def _reserve(self, size: int):
+        free = len(self._buf) - self._end
+        if free >= size:
+            return
+        if self._start:
+            pending = self._end - self._start
+            self._buf[:pending] = self._buf[self._start : self._end]
+            self._scan -= self._start
+            self._start, self._end = 0, pending
+            free = len(self._buf) - self._end
+        if free < size:
+            self._buf.extend(bytes(max(len(self._buf), size - free)))
+
+    def _fill(self) -> int:
+        if self.before_read:
+            self.before_read()
+        size = self._sizer.size if self._sizer else self.chunk_size
+        self._reserve(size)
+        if self.stats is not None:
+            started = time.perf_counter()
+        if self._readinto is None:
+            data = self.stream.read(size)
+            n = len(data)
+            self._buf[self._end : self._end + n] = data
+        else:
+            with memoryview(self._buf) as view:
+                n = self._readinto(view[self._end : self._end + size]) or 0
+        if self.stats is not None:
+            self.stats.blocked += time.perf_counter() - started
+            self.stats.bytes += n
+        self._end += n
+        if self._sizer:
+            self._sizer.update(n)
+        return n
+
+    def _check_length(self, length: int):
+        if self.max_line_length is not None and length > self.max_line_length:
+            raise LineTooLongError(
+                f"line longer than max_line_length({self.max_line_length})"
+            )
+
+    def _records(self, block: bytes, lines: List[bytes]) -> Iterable[Any]:
+        if not self.encoding:
+            return lines
+        # one decode per block, utf8 and friends never have sep inside a char
+        texts = block.decode(self.encoding).split(self._text_sep)
+        del texts[len(lines) :]
+        if self.with_raw:
+            return zip(texts, lines)
+        return texts
+
+    def _take(self) -> Iterable[Any]:
+        """cut out the records which are complete in the buffer"""
+        sep, sep_len = self.sep, len(self.sep)
+        buf = self._buf
+        # split everything up to the last complete record in one pass
+        idx = buf.rfind(sep, self._scan, self._end)
+        records: Iterable[Any] = ()
+        if idx >= 0:
+            with memoryview(buf) as view:
+                block = view[self._start : idx + sep_len].tobytes()
+            lines = block.split(sep)
+            # a multi-byte sep may overlap itself, keep what `split` left
+            rest = lines.pop()
+            if self.max_line_length is not None:
+                self._check_length(max(map(len, lines)))
+            self._start = idx + sep_len - len(rest)
+            records = self._records(block, lines)
+            if self.stats is not None:
+                self.stats.records += len(lines)
+        self._scan = max(self._start, self._end - sep_len + 1)
+        self._check_length(self._end - self._start)
+        return records
+
+    def _tail(self) -> Iterable[Any]:
+        tail = bytes(self._buf[self._start : self._end])
+        self._start = self._scan = self._end
+        if self.stats is not None:
+            self.stats.records += 1
+        return self._records(tail, [tail])
+
+    def feed(self, data: bytes) -> Iterable[Any]:
+        """push `data` read by the caller, return the records it completes"""
+        self._reserve(len(data))
+        self._buf[self._end : self._end + len(data)] = data
+        self._end += len(data)
+        return self._take()
+
+    def close(self) -> Iterable[Any]:
+        """end of data, return the last (unterminated) record"""
+        return self._tail()
+
+    def __iter__(self) -> Generator[Any, Any, None]:
+        while True:
+            yield from self._take()
+            if not self._fill():
+                yield from self._tail()
+                return
+
+    async def __aiter__(self) -> AsyncGenerator[Any, None]:
+        """iterate records of an `asyncio.StreamReader`"""
+        while True:
+            if self.before_read:
+                self.before_read()
+            size = self._sizer.size if self._sizer else self.chunk_size
+            if self.stats is not None:
+                started = time.perf_counter()
+            data = await self.stream.read(size)  # type: ignore
+            if self.stats is not None:
+                self.stats.blocked += time.perf_counter() - started
+                self.stats.bytes += len(data)
+            if self._sizer:
+                self._sizer.update(len(data))
+            if not data:
+                for record in self._tail():
+                    yield record
+                return
+            for record in self.feed(data):
+                yield record
+
+
+def bytes_streamer(
+    stream: IO[bytes],
+    sep: bytes = b"\n",
+    chunk_size: ChunkSize = 1024,
+    max_line_length: Optional[int] = None,
+    before_read: Optional[Callable[[], Any]] = None,
+    stats: Optional[IOStats] = None,
+    framing: Optional["Framing"] = None,
+) -> Iterator[bytes]:
+    if framing is not None:
+        return iter(
+            framing.splitter(
+                stream,
+                chunk_size=chunk_size,
+                max_line_length=max_line_length,
+                before_read=before_read,
+                stats=stats,
+            )
+        )
+    return iter(
+        Splitter(
+            stream,
+            sep=sep,
+            chunk_size=chunk_size,
+            max_line_length=max_line_length,
+            before_read=before_read,
+            stats=stats,
+        )
+    )
 
 
-def str_streamer(stream: IO[bytes], sep: str = "\n", chunk_size: int = 1024):
-    for chunk in bytes_streamer(stream, sep=sep.encode("utf8"), chunk_size=chunk_size):
-        yield chunk.decode("utf8")
+def str_streamer(
+    stream: IO[bytes],
+    sep: str = "\n",
+    chunk_size: ChunkSize = 1024,
+    max_line_length: Optional[int] = None,
+    before_read: Optional[Callable[[], Any]] = None,
+    stats: Optional[IOStats] = None,
+    framing: Optional["Framing"] = None,
+) -> Iterator[str]:
+    if framing is not None:
+        return iter(
+            framing.splitter(
+                stream,
+                chunk_size=chunk_size,
+                max_line_length=max_line_length,
+                before_read=before_read,
+                encoding="utf8",
+                stats=stats,
+            )
+        )
+    return iter(
+        Splitter(
+            stream,
+            sep=sep.encode("utf8"),
+            chunk_size=chunk_size,
+            max_line_length=max_line_length,
+            before_read=before_read,
+            encoding="utf8",
+            stats=stats,
+        )
+    )
 
 
 _T = TypeVar("_T", str, bytes)
@@ -52,26 +445,342 @@ def to_bytes(i: Union[str, bytes, None]) -> bytes:
         return i
 
 
+def write_all(fd: int, data: bytes):
+    with memoryview(data) as view:
+        while view:
+            view = view[os.write(fd, view) :]
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """a pool of `workers` processes started by a forkserver.
+
+    forked workers would keep every pipe open at the time, e.g. the write end of
+    a source stage running on another thread, so the reader never sees EOF.
+    """
+    context = multiprocessing.get_context("forkserver")
+    return ProcessPoolExecutor(workers, mp_context=context)
+
+
+class BatchWriter:
+    """coalesce records written to `fd` into one write per batch.
+
+    a batch is written when it reaches `buffer_size` bytes, when its first
+    record is older than `flush_interval` seconds, when records arrive slower
+    than `flush_interval` (the producer is slow, so write through), on `flush`
+    and on `close`. `buffer_size=0` writes every record immediately.
+    with a `framing`, records are encoded by it instead of ended by `sep`.
+    """
+
+    def __init__(
+        self,
+        fd: int,
+        sep: bytes,
+        buffer_size: int = 64 * 1024,
+        flush_interval: float = 0.05,
+        write: Optional[Callable[[bytes], Any]] = None,
+        stats: Optional[IOStats] = None,
+        framing: Optional["Framing"] = None,
+    ) -> None:
+        self.fd = fd
+        self.stats = stats
+        self.framing = framing
+        # encoded records carry their own framing, nothing goes in between
+        self.sep = sep if framing is None else b""
+        # e.g. a transport's write, instead of blocking writes to fd
+        self._write = write or functools.partial(write_all, fd)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._records: List[bytes] = []
+        self._size = 0
+        self._first = self._last = time.monotonic() - flush_interval
+
+    def write(self, record: bytes):
+        now = time.monotonic()
+        slow = now - self._last >= self.flush_interval
+        self._last = now
+        if not self._records:
+            self._first = now
+        if self.framing is not None:
+            record = self.framing.encode(record)
+        self._records.append(record)
+        self._size += len(record) + len(self.sep)
+        if (
+            slow
+            or self._size >= self.buffer_size
+            or now - self._first >= self.flush_interval
+        ):
+            self.flush()
+
+    @property
+    def pending(self) -> bool:
+        """if records are held back until the next flush"""
+        return bool(self._records)
+
+    @property
+    def idle(self) -> float:
+        """seconds since the last record was written"""
+        return time.monotonic() - self._last
+
+    def flush(self):
+        if not self._records:
+            return
+        records, self._records, self._size = self._records, [], 0
+        if self.stats is not None:
+            self.stats.records += len(records)
+        records.append(b"")
+        self._timed_write(self.sep.join(records))
+
+    def write_block(self, block: bytes):
+        """write records which are already joined and ended by sep, or encoded"""
+        self.flush()
+        if self.stats is not None and self.framing is None:
+            self.stats.records += block.count(self.sep)
+        self._timed_write(block)
+
+    def _timed_write(self, data: bytes):
+        if self.stats is None:
+            self._write(data)
+            return
+        started = time.perf_counter()
+        self._write(data)
+        self.stats.blocked += time.perf_counter() - started
+        self.stats.bytes += len(data)
+
+    def close(self):
+        self.flush()
+        os.close(self.fd)
+
+
+def _run_task(
+    process_func: Callable[..., Any],
+    records: List[Any],
+    batch_stage: bool,
+    sep: bytes,
+    framing: Optional["Framing"] = None,
+) -> bytes:
+    """run one task of a stage with workers, return output records joined by sep"""
+    if batch_stage:
+        results = process_func(records)
+    else:
+        results = map(process_func, records)
+    output = [to_bytes(res) for res in results if res is not None]
+    if not output:
+        return b""
+    if framing is not None:
+        return b"".join(map(framing.encode, output))
+    output.append(b"")
+    return sep.join(output)
+
+
+class _FusedStages:
+    """per-record stages run by the thread of the stage before them.
+
+    takes the place of the `BatchWriter` of that stage. records are batched the
+    same way, and each batch goes through the functions as one block: split on
+    `sep` once per stage, mapped, and joined again, so a result with `sep` inside
+    is several records, exactly like when every stage read its own pipe. only the
+    output of the last stage is written.
+    """
+
+    def __init__(
+        self,
+        stages: List["P"],
+        writer: BatchWriter,
+        buffer_size: int = 64 * 1024,
+        flush_interval: float = 0.05,
+    ) -> None:
+        self.writer = writer
+        self._stages = []
+        for stage in stages:
+            sep = to_bytes(stage.sep)
+            self._stages.append(
+                (
+                    stage.process_func,
+                    sep.decode("utf8") if stage.arg_type is str else sep,
+                    sep,
+                    stage.metrics.input if stage.metrics else None,
+                )
+            )
+        self._batch = BatchWriter(
+            -1,
+            self._stages[0][2],
+            buffer_size=buffer_size,
+            flush_interval=flush_interval,
+            write=self._run,
+        )
+
+    def _run(self, block: Union[str, bytes], first: int = 0):
+        """push `block`, records ended by sep, through the stages from `first` on"""
+        for process_func, sep, bytes_sep, stats in self._stages[first:]:
+            if isinstance(block, str) != isinstance(sep, str):
+                block = block.decode() if isinstance(sep, str) else block.encode()
+            records = block.split(sep)
+            records.pop()
+            if stats is not None:
+                stats.records += len(records)
+                stats.bytes += len(to_bytes(block))
+            results = [res for res in map(process_func, records) if res is not None]
+            if not results:
+                return
+            try:
+                block = sep.join(results) + sep
+            except TypeError:
+                # results of another type than the input
+                block = bytes_sep.join(map(to_bytes, results)) + bytes_sep
+        self.writer.write_block(to_bytes(block))
+
+    def write(self, record: bytes):
+        self._batch.write(record)
+
+    def write_block(self, block: bytes):
+        self._batch.write_block(block)
+
+    @property
+    def idle(self) -> float:
+        return self._batch.idle
+
+    def flush(self):
+        self._batch.flush()
+
+    def close(self):
+        self._batch.flush()
+        # the empty record after the last sep, which each stage reads at EOF
+        for i, (_, sep, _, _) in enumerate(self._stages):
+            self._run(sep, first=i)
+        self.writer.close()
+
+
+class _FlushTimer:
+    """writes records to `writer` and flushes them about `interval` seconds
+    after the last one, for a source which may block before its next record.
+
+    the thread of the source and the timer never take a lock on each record:
+    each raises its flag before it checks the other's, so at most one of them
+    uses `writer` at a time, and the source only waits for a flush in progress.
+    """
+
+    def __init__(self, writer: Any, interval: float) -> None:
+        self.writer = writer
+        self.interval = interval
+        self._lock = Lock()
+        self._writing = self._flushing = False
+        # set once records are written after the last flush
+        self._armed = False
+        self._wake = Event()
+        self._stopped = False
+        Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            if self._stopped:
+                return
+            idle = self.writer.idle
+            if idle < self.interval:
+                # still writing, it flushes by itself until it blocks
+                time.sleep(self.interval - idle)
+                continue
+            with self._lock:
+                if self._stopped:
+                    return
+                self._flushing = True
+                flushed = not self._writing
+                if flushed:
+                    self.writer.flush()
+                    self._armed = False
+                    self._wake.clear()
+                self._flushing = False
+            if not flushed:
+                # e.g. blocked on a full pipe
+                time.sleep(self.interval)
+
+    def write(self, record: bytes):
+        self._writing = True
+        if self._flushing:
+            # wait for the flush to be done
+            with self._lock:
+                pass
+        self.writer.write(record)
+        if not self._armed:
+            self._armed = True
+            self._wake.set()
+        self._writing = False
+
+    def stop(self):
+        """the timer is done with `writer` once it returns"""
+        self._stopped = True
+        self._wake.set()
+        with self._lock:
+            pass
+
+
 class P:
     def __init__(
         self,
         process_func: Union[
             Callable[[_T], Union[str, bytes]],
+            Callable[[List[_T]], Iterable[Union[str, bytes]]],
             Callable[[], List[_T]],
+            Callable[[_T], Awaitable[Union[str, bytes, None]]],
+            Callable[[], AsyncIterable[Union[str, bytes]]],
             Iterable[Union[bytes, str]],
+            AsyncIterable[Union[bytes, str]],
         ],
         zero_output: bool = False,
         sep: _T = ...,
-        chunk_size: int = 1024,
+        chunk_size: ChunkSize = 1024,
+        max_line_length: Optional[int] = None,
+        write_buffer_size: int = 64 * 1024,
+        flush_interval: float = 0.05,
+        batch_size: Optional[int] = None,
+        workers: int = 0,
+        executor: Union[Literal["process", "thread"], Executor] = "process",
+        ordered: bool = True,
+        task_size: int = 1024,
+        metrics: MetricsOption = None,
+        fuse: bool = True,
+        framing: Optional["Framing"] = None,
+        output_framing: Optional["Framing"] = ...,  # type: ignore
     ) -> None:
+        self.batch_size = batch_size
+        # how input records are cut, and output records written, instead of `sep`
+        self.framing = framing
+        self.output_framing = framing if output_framing is ... else output_framing
+        # workers > 0: records are sent in tasks of `task_size` to a pool
+        self.workers = workers
+        self.executor = executor
+        self.ordered = ordered
+        self.task_size = task_size
         self._chunk_size = chunk_size
+        self._max_line_length = max_line_length
+        self._write_buffer_size = write_buffer_size
+        self._flush_interval = flush_interval
         # io -> [process_func] -> in_fd -> [thread: out_fd ->]
         self.out_fd, self.in_fd = os.pipe()
         # self.in_stream = os.fdopen(self.in_fd, "wb")
         self.io: Optional[IO[bytes]] = None
         self.t: Optional[Thread] = None
+        self._task: Optional["asyncio.Task[None]"] = None
         self.process_func = process_func
-        if isinstance(process_func, Iterable):
+        self.metrics = new_metrics(
+            getattr(process_func, "__name__", type(process_func).__name__),
+            metrics,
+        )
+        # the stage piped into this one, see `shshsh.metrics.report`
+        self._prev: Any = None
+        # False keeps this stage on a thread of its own when piped from another
+        # `P`, e.g. if it blocks on I/O. see `_fusable`
+        self.fuse = fuse
+        # stages fused into the thread of this one, and the stage running a fused one
+        self._fused: List[P] = []
+        self._head: Optional[P] = None
+        # coroutine / async generator stages run on the event loop, see `arun`
+        self.is_async = (
+            isinstance(process_func, AsyncIterable)
+            or inspect.iscoroutinefunction(process_func)
+            or inspect.isasyncgenfunction(process_func)
+        )
+        if isinstance(process_func, (Iterable, AsyncIterable)):
             self.arg_type = None
             if sep is ...:
                 if zero_output:
@@ -89,12 +798,21 @@ class P:
         if signature.parameters:
             assert (
                 len(signature.parameters) == 1
-            ), "the process function must have only 1 arg, which type should be in (str, bytes)"
-            self.arg_type = next(iter(signature.parameters.values())).annotation
+            ), "the process function must have only 1 arg, which type should be in (str, bytes, List[str], List[bytes])"
+            annotation = next(iter(signature.parameters.values())).annotation
+            if get_origin(annotation) is list:
+                # batch stage, called with a list of records
+                (annotation,) = get_args(annotation) or (None,)
+                self.batch_size = self.batch_size or 1024
+            else:
+                assert (
+                    not self.batch_size
+                ), "batch stage function arg type should be List[str] or List[bytes]"
+            self.arg_type = annotation
             assert self.arg_type in (
                 str,
                 bytes,
-            ), f"the process function arg type should be in (str, bytes), but got {type(self.arg_type)}"
+            ), f"the process function arg type should be in (str, bytes, List[str], List[bytes]), but got {self.arg_type}"
             if sep is ...:
                 if self.arg_type is str:
                     if zero_output:
@@ -106,6 +824,8 @@ class P:
                         self.sep = b"\x00"
                     else:
                         self.sep = b"\n"
+            else:
+                self.sep = sep
             assert isinstance(
                 self.sep, self.arg_type
             ), f"sep type should same as arg_type, but sep: {type(self.sep)} arg: {self.arg_type}"
@@ -119,86 +839,450 @@ class P:
             else:
                 self.sep = sep
 
+    @classmethod
+    def batch(
+        cls,
+        process_func: Callable[[List[_T]], Iterable[Union[str, bytes]]],
+        size: int = 1024,
+        **kwargs: Any,
+    ) -> "P":
+        """stage which takes a list of up to `size` records and returns an iterable of records.
+
+        a batch is handed over early whenever reading more input would block.
+        """
+        return cls(process_func, batch_size=size, **kwargs)
+
     def set_source(self, io: IO[bytes]):
         assert self.arg_type is not None, "datasource function cannot have extra source"
         self.io = io
 
+    def _splitter(
+        self,
+        before_read: Callable[[], Any],
+        with_raw: bool = False,
+        stream: Any = None,
+    ) -> Splitter:
+        kwargs: Dict[str, Any] = dict(
+            chunk_size=self._chunk_size,
+            max_line_length=self._max_line_length,
+            before_read=before_read,
+            encoding=self.encoding,
+            with_raw=with_raw,
+            stats=self.metrics.input if self.metrics else None,
+        )
+        if self.framing is not None:
+            return self.framing.splitter(stream or self.io, **kwargs)
+        return Splitter(stream or self.io, sep=to_bytes(self.sep), **kwargs)  # type: ignore
+
+    @property
+    def encoding(self) -> Optional[str]:
+        """of the records a str function is called with"""
+        return "utf8" if self.arg_type is str else None
+
+    def _input_ready(self) -> bool:
+        try:
+            return bool(select.select([self.io], [], [], 0)[0])
+        except (OSError, ValueError, TypeError):
+            return True
+
+    def _pool_helper(self, writer: BatchWriter):
+        if isinstance(self.executor, Executor):
+            pool, own_pool = self.executor, False
+        elif self.executor == "process":
+            pool, own_pool = process_pool(self.workers), True
+        elif self.executor == "thread":
+            pool, own_pool = ThreadPoolExecutor(self.workers), True
+        else:
+            raise ValueError(f"unknown executor: {self.executor}")
+        sep = to_bytes(self.sep)
+        task_size = self.batch_size or self.task_size
+        batch_stage = bool(self.batch_size)
+        # ordered: a queue of futures written in submit order (the reorder buffer)
+        pending: Deque["Future[bytes]"] = deque()
+        running: Set["Future[bytes]"] = set()
+        records: List[Any] = []
+
+        def submit():
+            nonlocal records
+            if records:
+                future = pool.submit(
+                    _run_task,
+                    self.process_func,
+                    records,
+                    batch_stage,
+                    sep,
+                    self.output_framing,
+                )
+                records = []
+                if self.ordered:
+                    pending.append(future)
+                else:
+                    running.add(future)
+
+        def drain(block: bool, limit: Optional[int] = None):
+            """write finished results, wait for all if `block` or for some if over `limit`"""
+            if self.ordered:
+                while pending and (
+                    block
+                    or pending[0].done()
+                    or (limit is not None and len(pending) > limit)
+                ):
+                    writer.write_block(pending.popleft().result())
+            elif running:
+                over = limit is not None and len(running) > limit
+                done, _ = wait(
+                    running,
+                    timeout=None if block or over else 0,
+                    return_when=ALL_COMPLETED if block else FIRST_COMPLETED,
+                )
+                for future in done:
+                    running.remove(future)
+                    writer.write_block(future.result())
+
+        def before_read():
+            # hand out partial work, and wait for it if the input is idle
+            submit()
+            drain(block=not self._input_ready())
+            writer.flush()
+
+        try:
+            for chunk in self._splitter(before_read):
+                records.append(chunk)
+                if len(records) >= task_size:
+                    submit()
+                    drain(block=False, limit=self.workers * 2)
+            submit()
+            drain(block=True)
+        finally:
+            if own_pool:
+                pool.shutdown(wait=False)
+
     def _stream_helper(self):
-        if self.arg_type:
-            if self.arg_type is str:
-                streamer = str_streamer
-            else:
-                streamer = bytes_streamer
+        if self.metrics is None:
+            return self._stream()
+        self.metrics.start = time.monotonic()
+        cpu = time.thread_time()
+        try:
+            self._stream()
+        finally:
+            # fused stages share the thread, its CPU time is counted here
+            self.metrics.cpu_time = time.thread_time() - cpu
+            self.metrics.finish()
+            for stage in self._fused:
+                if stage.metrics is not None:
+                    stage.metrics.finish()
 
-            for chunk in streamer(self.io, sep=self.sep, chunk_size=self._chunk_size):  # type: ignore
+    def _stream(self):
+        last = self._fused[-1] if self._fused else self
+        writer: Any = BatchWriter(
+            last.in_fd,
+            to_bytes(last.sep),
+            buffer_size=self._write_buffer_size,
+            flush_interval=self._flush_interval,
+            stats=last.metrics.output if last.metrics else None,
+            framing=last.output_framing,
+        )
+        if self._fused:
+            writer = _FusedStages(
+                self._fused,
+                writer,
+                buffer_size=self._write_buffer_size,
+                flush_interval=self._flush_interval,
+            )
+        if self.arg_type and self.workers:
+            self._pool_helper(writer)
+        elif self.arg_type and self.batch_size:
+            batch: List[Union[str, bytes]] = []
+
+            def process_batch():
+                nonlocal batch
+                if batch:
+                    records, batch = batch, []
+                    for res in self.process_func(records):  # type: ignore
+                        if res is not None:
+                            writer.write(to_bytes(res))
+
+            def before_read():
+                process_batch()
+                writer.flush()
+
+            for chunk in self._splitter(before_read):
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    process_batch()
+            process_batch()
+        elif self.arg_type is str:
+            # reading may block, hand out what is done so far
+            for chunk, raw in self._splitter(writer.flush, with_raw=True):
                 res = self.process_func(chunk)  # type: ignore
+                if res is None:
+                    continue
+                if res is chunk:
+                    # passed through unchanged, forward the bytes as read
+                    writer.write(raw)
+                    continue
                 if isinstance(res, str):
                     res = res.encode("utf8")
                 assert isinstance(res, bytes)
-                os.write(self.in_fd, res + to_bytes(self.sep))
-        elif isinstance(self.process_func, Iterable):
-            for res in self.process_func:  # type: ignore
+                writer.write(res)
+        elif self.arg_type is bytes:
+            for chunk in self._splitter(writer.flush):
+                res = self.process_func(chunk)  # type: ignore
+                if res is None:
+                    continue
                 if isinstance(res, str):
                     res = res.encode("utf8")
-                os.write(self.in_fd, res + to_bytes(self.sep))  # type: ignore
+                assert isinstance(res, bytes)
+                writer.write(res)
         else:
-            res_list = self.process_func()  # type: ignore
-            for res in res_list:
-                if isinstance(res, str):
-                    res = res.encode("utf8")
-                os.write(self.in_fd, res + to_bytes(self.sep))
-        os.close(self.in_fd)
+            # a data source, which may be slow between records
+            timer = _FlushTimer(writer, self._flush_interval)
+            try:
+                if isinstance(self.process_func, Iterable):
+                    res_list = self.process_func
+                else:
+                    res_list = self.process_func()  # type: ignore
+                for res in res_list:
+                    if res is not None:
+                        timer.write(to_bytes(res))
+            finally:
+                timer.stop()
+        writer.close()
 
-    def run(self):
-        assert not self.t, "already running"
+    async def _astream_helper(self):
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, os.fdopen(self.in_fd, "wb", 0)
+        )
+        stream_writer = asyncio.StreamWriter(transport, protocol, None, loop)  # type: ignore
+        writer = BatchWriter(
+            self.in_fd,
+            to_bytes(self.sep),
+            buffer_size=self._write_buffer_size,
+            flush_interval=self._flush_interval,
+            write=transport.write,  # type: ignore
+            stats=self.metrics.output if self.metrics else None,
+            framing=self.output_framing,
+        )
+
+        flusher: Optional[asyncio.TimerHandle] = None
+
+        def flush():
+            nonlocal flusher
+            flusher = None
+            writer.flush()
+
+        async def emit(res: Union[str, bytes, None]):
+            nonlocal flusher
+            if res is not None:
+                writer.write(to_bytes(res))
+                # records held back are written even if the next one is slow
+                if writer.pending and flusher is None:
+                    flusher = loop.call_later(self._flush_interval, flush)
+                if transport.get_write_buffer_size() >= self._write_buffer_size:
+                    await stream_writer.drain()
+
+        try:
+            if self.arg_type:
+                reader = asyncio.StreamReader()
+                await loop.connect_read_pipe(
+                    lambda: asyncio.StreamReaderProtocol(reader), self.io
+                )
+                async for chunk in self._splitter(writer.flush, stream=reader):
+                    res = self.process_func(chunk)  # type: ignore
+                    if inspect.isawaitable(res):
+                        res = await res
+                    await emit(res)
+            else:
+                source = self.process_func
+                if callable(source):
+                    source = source()
+                if inspect.isawaitable(source):
+                    source = await source
+                if isinstance(source, AsyncIterable):
+                    async for res in source:
+                        await emit(res)
+                else:
+                    for res in source:  # type: ignore
+                        await emit(res)
+            writer.flush()
+            await stream_writer.drain()
+        finally:
+            if flusher is not None:
+                flusher.cancel()
+            stream_writer.close()
+            if self.metrics is not None:
+                self.metrics.finish()
+
+    def _check_runnable(self):
+        assert not self.started, "already running"
+        assert (
+            not self.workers or self.arg_type
+        ), "workers only apply to process function with parameter"
+        assert not self.is_async or not (
+            self.workers or self.batch_size
+        ), "async stage cannot use workers or batch"
         if self.arg_type and not self.io:
             raise ValueError(
                 "process function with parameter should set source before run."
             )
-        t = Thread(target=self._stream_helper, daemon=True)
+
+    @property
+    def started(self) -> bool:
+        return self.t is not None or self._task is not None
+
+    def run(self):
+        if self._head is not None:
+            # fused, runs in the thread of the first stage
+            assert not self.started, "already running"
+            self._head.run()
+            self.t = self._head.t
+            return
+        self._check_runnable()
+        if self.is_async:
+            # not on an event loop, run the async stage on its own loop
+            target = functools.partial(asyncio.run, self._astream_helper())
+        else:
+            target = self._stream_helper
+        t = Thread(target=target, daemon=True)
         t.start()
         self.t = t
 
+    async def arun(self):
+        """start as a task of the running event loop, without a thread"""
+        if self._head is not None:
+            return self.run()
+        self._check_runnable()
+        if self.is_async:
+            self._task = asyncio.ensure_future(self._astream_helper())
+        else:
+            self.run()
+
     def wait(self, timeout: Optional[int] = None):
         assert self.t, "not running"
         self.t.join(timeout)
 
+    async def await_done(self):
+        assert self.started, "not running"
+        if self._task:
+            await self._task
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.wait)
+
+    def capture(
+        self, memory_limit: int = 64 * 1024 * 1024
+    ) -> Union[memoryview, mmap.mmap]:
+        """read the whole output, see `capture`"""
+        if not self.started:
+            self.run()
+        with os.fdopen(self.out_fd, "rb") as stream:
+            return capture(stream, memory_limit=memory_limit)
+
+    def _fusable(self, other: "P") -> bool:
+        """if `other` can run in the thread of this stage instead of its own"""
+        return (
+            other.fuse
+            and not self.started
+            and not self.is_async
+            and not other.started
+            and not other.is_async
+            and other.io is None
+            and other.arg_type is not None
+            and not other.batch_size
+            and not other.workers
+            and other._max_line_length is None
+            and to_bytes(other.sep) == to_bytes(self.sep)
+            and self.output_framing is None
+            and other.framing is None
+            and other.output_framing is None
+        )
+
+    def _pipe_to_stage(self, other: Union["P", Callable[..., Any]]) -> "P":
+        if not isinstance(other, P):
+            other = P(
+                other,
+                zero_output=to_bytes(self.sep) == b"\x00",
+                chunk_size=self._chunk_size,
+                metrics=option_of(self.metrics),
+            )
+        other._prev = self
+        if not self._fusable(other):
+            if not self.started:
+                self.run()
+            other.set_source(os.fdopen(self.out_fd, "rb"))
+            return other
+        # no pipe in between, the output of `self` goes straight to `other`
+        head = self._head or self
+        head._fused.append(other)
+        other._head = head
+        os.close(self.out_fd)
+        os.close(self.in_fd)
+        self.out_fd = self.in_fd = -1
+        return other
+
     @overload
     def __or__(self, other: Union["Sh", str]) -> "Sh":
         ...
 
+    @overload
+    def __or__(
+        self,
+        other: Union[
+            "P",
+            Callable[[bytes], Union[str, bytes]],
+            Callable[[str], Union[str, bytes]],
+        ],
+    ) -> "P":
+        ...
+
     @overload
     def __or__(self, other: TextIO) -> None:
         ...
 
-    def __or__(self, other: Union["Sh", str, TextIO]) -> Optional["Sh"]:
+    def __or__(
+        self, other: Union["Sh", str, TextIO, "P", Callable[..., Any]]
+    ) -> Union["Sh", "P", None]:
         from .shell import Sh
+        from .fork import fork_stream
+
+        if isinstance(other, P) or (
+            callable(other)
+            and not isinstance(other, (Sh, fork_stream, io.IOBase, type))
+        ):
+            return self._pipe_to_stage(other)  # type: ignore
 
-        if not self.t:
+        # async stages are started by the downstream `Sh.arun`/`Sh.run`
+        if not self.started and not (
+            self.is_async and not isinstance(other, (io.IOBase, fork_stream))
+        ):
             self.run()
-        assert self.t
 
         if isinstance(other, str):
-            return Sh(
+            sh = Sh(
                 other,
                 stdin=self.out_fd,
                 cwd=global_vars.CWD,
                 env=global_vars.ENV,
+                chunk_size=self._chunk_size,
+                metrics=option_of(self.metrics),
             )
+            sh._prev = self
+            if not self.started:
+                sh._upstream = [self]
+            return sh
         if isinstance(other, io.IOBase):
-            stdout = os.fdopen(self.out_fd, "rb")
-            while True:
-                chunk = stdout.readline(self._chunk_size)
-                other.buffer.write(chunk)  # type: ignore
-                if not chunk:
-                    break
-            other.flush()
-            stdout.close()
+            copy_to_file(self.out_fd, other, chunk_size=self._chunk_size)
+            os.close(self.out_fd)
+        elif isinstance(other, fork_stream):
+            return other.start(self.out_fd, close=True)
         elif isinstance(other, Sh):  # type: ignore
             other = copy.copy(other)
             other.set_stdin(self.out_fd)
+            other._prev = self
+            if not self.started:
+                other._upstream = [*other._upstream, self]
             return other
         else:
             raise ValueError(
-                f"cannot pipe with type: {type(other)}, only accept (Sh, str)"
+                f"cannot pipe with type: {type(other)}, only accept (Sh, str, P, function)"
             )
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from shshsh import I, Sh
+
+
+def test_async_iter():
+    async def main():
+        res = I >> "seq 3"
+        return [line async for line in res], await res.await_code()
+
+    assert asyncio.run(main()) == (["1", "2", "3", ""], 0)
+
+
+def test_await_code():
+    async def main():
+        return await Sh("ls not_exist", stderr=-3).await_code()
+
+    assert asyncio.run(main()) != 0
+
+
+def stage_threads() -> int:
+    # asyncio may wait for children with "(asyncio-)waitpid-N" threads and
+    # `shshsh.reaper` with one thread for all, those are not stages
+    return sum(
+        "waitpid" not in thread.name and thread.name != "shshsh-reaper"
+        for thread in threading.enumerate()
+    )
+
+
+def test_async_stage_without_thread():
+    async def double(line: str) -> str:
+        await asyncio.sleep(0)
+        return line * 2
+
+    async def main():
+        threads = stage_threads()
+        res = I >> "seq 3" | double | "cat"
+        lines = [line async for line in res]
+        assert stage_threads() == threads
+        return lines, await res.await_code()
+
+    assert asyncio.run(main()) == (["11", "22", "33", "", ""], 0)
+
+
+def test_async_source():
+    async def source():
+        for i in range(3):
+            await asyncio.sleep(0)
+            yield f"test{i}"
+
+    async def main():
+        res = I >> source() | "grep 1"
+        return [line async for line in res], await res.await_code()
+
+    assert asyncio.run(main()) == (["test1", ""], 0)
+
+
+def test_async_stage_sync_use():
+    async def upper(line: str) -> str:
+        return line.upper()
+
+    res = I >> "echo abc" | upper | "cat"
+    assert res.stdout.read() == b"ABC\n\n"
@@ -0,0 +1,127 @@
+import os
+import subprocess
+import time
+import pytest
+from shshsh import Sh
+from shshsh import cache
+from shshsh.cache import CachePolicy
+
+
+@pytest.fixture
+def policy(tmp_path):
+    return CachePolicy(root=str(tmp_path / "cache"))
+
+
+def nanos(policy: CachePolicy, **kwargs) -> Sh:
+    return Sh("sh -c 'date +%N; date +%N >&2; exit 3'", cache=policy, **kwargs)
+
+
+def test_replay(policy: CachePolicy):
+    first = nanos(policy, stderr=subprocess.PIPE)
+    out, err = first.stdout.read(), first.stderr.read()
+    assert first.wait().code == 3
+    again = nanos(policy, stderr=subprocess.PIPE)
+    assert again.stdout.read() == out
+    assert again.stderr.read() == err
+    assert again.wait().code == 3
+    assert again._proc.pid is None
+    assert (policy.hits, policy.misses) == (1, 1)
+
+
+def test_replay_streams(policy: CachePolicy):
+    def double(line: str) -> str:
+        return line * 2
+
+    lines = [str(i) for i in range(10000)]
+    for _ in range(2):
+        assert list(Sh("seq 0 9999", cache=policy).iter())[:-1] == lines
+        res = Sh("seq 0 9999", cache=policy) | double | "tail -n 2"
+        assert list(res)[:-1] == ["99999999", ""]
+    assert (policy.hits, policy.misses) == (3, 1)
+
+
+def test_replay_to_file(policy: CachePolicy, tmp_path):
+    for i in range(2):
+        with open(tmp_path / f"out{i}", "wb") as out:
+            Sh("seq 3", cache=policy, stdout=out).wait()
+    assert (tmp_path / "out1").read_bytes() == (tmp_path / "out0").read_bytes()
+    assert (tmp_path / "out1").read_bytes() == b"1\n2\n3\n"
+    assert policy.hits == 1
+
+
+def test_key(policy: CachePolicy, tmp_path):
+    def run(cmd: str, **kwargs) -> bytes:
+        return Sh(cmd, cache=policy, cwd=str(tmp_path), **kwargs).stdout.read()
+
+    (tmp_path / "in").write_text("a\n")
+    policy.inputs = ["in"]
+    policy.env = ["NAME"]
+    assert run("cat in") == b"a\n"
+    (tmp_path / "in").write_text("bb\n")
+    assert run("cat in") == b"bb\n"
+    assert run("sh -c 'echo $NAME'", env={"NAME": "x"}) == b"x\n"
+    assert run("sh -c 'echo $NAME'", env={"NAME": "y"}) == b"y\n"
+    assert run("sh -c 'echo $NAME'", env={"NAME": "y", "OTHER": "z"}) == b"y\n"
+    assert policy.hits == 1
+
+
+def test_stdin_digest(policy: CachePolicy):
+    def upper(text: str) -> bytes:
+        return (Sh(f"echo {text}") | Sh("tr a-z A-Z", cache=policy)).stdout.read()
+
+    assert upper("a") == b"A\n"
+    assert upper("b") == b"B\n"
+    assert upper("a") == b"A\n"
+    assert (policy.hits, policy.misses) == (1, 2)
+    with pytest.raises(AssertionError):
+        Sh("cat", stdin=subprocess.PIPE, cache=policy).run()
+
+
+def test_partial_read_not_stored(policy: CachePolicy):
+    sh = Sh("seq 1000000", cache=policy)
+    sh.stdout.readline()
+    sh.stdout.close()
+    sh.wait()
+    assert not [name for name in os.listdir(policy.root) if name[0] != "."]
+
+
+def test_eviction(tmp_path):
+    policy = CachePolicy(root=str(tmp_path), max_size=300)
+    for i in range(3):
+        Sh(f"head -c {100 + i} /dev/zero", cache=policy).wait()
+        Sh(f"echo {i}", cache=policy).wait()
+        time.sleep(0.01)
+    entries = [name for name in os.listdir(policy.root) if name[0] != "."]
+    assert len(entries) < 6
+    # the newest is kept
+    Sh("echo 2", cache=policy).wait()
+    assert policy.hits == 1
+    policy.ttl = 0
+    policy.evict()
+    assert not os.listdir(policy.root)
+
+
+def test_broken_entry(policy: CachePolicy, monkeypatch):
+    nanos(policy, stderr=subprocess.PIPE).wait()
+    (entry,) = [name for name in os.listdir(policy.root) if name[0] != "."]
+    os.remove(os.path.join(policy.root, entry, "stderr"))
+    opened = []
+
+    def tracked_open(*args, **kwargs):
+        opened.append(open(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(cache, "open", tracked_open, raising=False)
+    assert policy._lookup(entry) is None
+    assert len(opened) == 2 and all(f.closed for f in opened)
+
+
+def test_ttl_from_meta(policy: CachePolicy):
+    Sh("echo a", cache=policy).wait()
+    (entry,) = [name for name in os.listdir(policy.root) if name[0] != "."]
+    # only the time stored in the entry counts, not those of its files
+    os.utime(os.path.join(policy.root, entry, "stdout"), (0, 0))
+    policy.ttl = 60
+    policy.evict()
+    assert Sh("echo a", cache=policy).stdout.read() == b"a\n"
+    assert policy.hits == 1
@@ -0,0 +1,30 @@
+import mmap
+import re
+from shshsh import I, Sh
+
+
+def test_capture_in_memory():
+    out = Sh("seq 100000").capture()
+    assert isinstance(out, memoryview)
+    assert bytes(out) == b"".join(f"{i}\n".encode() for i in range(1, 100001))
+
+
+def test_capture_empty():
+    assert bytes(Sh("true").capture()) == b""
+
+
+def test_capture_spill():
+    out = Sh("seq 100000").capture(memory_limit=4096)
+    assert isinstance(out, mmap.mmap)
+    assert len(out) == len(b"".join(f"{i}\n".encode() for i in range(1, 100001)))
+    assert re.search(rb"\n99999\n", out)
+    assert out[:4] == b"1\n2\n"
+    out.close()
+
+
+def test_capture_function_output():
+    def upper(line: str) -> str:
+        return line.upper()
+
+    out = (I >> "printf 'a\\nb\\n'" | upper).capture(memory_limit=1)
+    assert out[:] == b"A\nB\n\n"
@@ -0,0 +1,43 @@
+import pytest
+from shshsh import Sh, I, utils
+from shshsh.env import EnvDict
+
+
+def test_env_update():
+    res = Sh("sh -c #{}", env_update={"SHSH_TEST": "abc"}) % "echo $SHSH_TEST"
+    assert res.stdout.read() == b"abc\n"
+    res = Sh("sh -c #{}") % "echo $SHSH_TEST"
+    assert res.stdout.read() == b"\n"
+
+
+def test_exec_env_change():
+    assert (I >> "true")._env is (I >> "true")._env
+    utils.exec_env["SHSH_TEST"] = "def"
+    try:
+        res = (I >> "sh -c #{}") % "echo $SHSH_TEST"
+        assert res.stdout.read() == b"def\n"
+    finally:
+        del utils.exec_env["SHSH_TEST"]
+    res = (I >> "sh -c #{}") % "echo $SHSH_TEST"
+    assert res.stdout.read() == b"\n"
+
+
+def test_custom_env():
+    res = Sh("sh -c #{}", env={"A": "1"}, env_update={"B": "2"}) % "echo $A$B"
+    assert res.stdout.read() == b"12\n"
+
+
+def test_env_dict_mutations():
+    env = EnvDict(A="1")
+    first = env.snapshot()
+    with pytest.raises(TypeError):
+        env.setdefault("X")
+    assert "X" not in env and env.snapshot() is first
+    assert env.setdefault("A", "2") == "1" and env.snapshot() is first
+    assert env.setdefault("B", "2") == "2"
+    assert dict(env.snapshot()) == {"A": "1", "B": "2"}
+    for mutate in (lambda: env.pop("B"), env.popitem, env.clear):
+        before = env.snapshot()
+        mutate()
+        assert env.snapshot() is not before
+        assert dict(env.snapshot()) == dict(env)
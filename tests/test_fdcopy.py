@@ -0,0 +1,60 @@
+import errno
+import io
+import os
+import pytest
+from shshsh import I
+from shshsh.fdcopy import copy_fd
+
+
+def test_copy_pipe_to_file(tmp_path):
+    r, w = os.pipe()
+    os.write(w, b"abc" * 1000)
+    os.close(w)
+    with open(tmp_path / "out", "wb") as f:
+        assert copy_fd(r, f.fileno()) == 3000
+    os.close(r)
+    assert (tmp_path / "out").read_bytes() == b"abc" * 1000
+
+
+def test_copy_file_to_file(tmp_path):
+    (tmp_path / "in").write_bytes(b"x" * 100000)
+    with open(tmp_path / "in", "rb") as src, open(tmp_path / "out", "wb") as dst:
+        assert copy_fd(src.fileno(), dst.fileno()) == 100000
+    assert (tmp_path / "out").read_bytes() == b"x" * 100000
+
+
+def test_function_pipe_to_file(tmp_path):
+    def source():
+        for i in range(3):
+            yield f"test{i}"
+
+    with open(tmp_path / "out", "wb") as f:
+        (I >> source() | "grep 1" | f).wait()
+    with open(tmp_path / "out1", "w") as f:
+        I >> source() | f
+    assert (tmp_path / "out").read_bytes() == b"test1\n"
+    assert (tmp_path / "out1").read_bytes() == b"test0\ntest1\ntest2\n"
+
+
+def test_running_to_file():
+    res = I >> "echo 123"
+    res.run()
+    out = io.BytesIO()
+    res | out
+    assert out.getvalue() == b"123\n"
+
+
+def test_copy_to_append_file(tmp_path):
+    (tmp_path / "in").write_bytes(b"y" * 100000)
+    (tmp_path / "out").write_bytes(b"head\n")
+    with open(tmp_path / "in", "rb") as src, open(tmp_path / "out", "ab") as dst:
+        assert copy_fd(src.fileno(), dst.fileno()) == 100000
+    assert (tmp_path / "out").read_bytes() == b"head\n" + b"y" * 100000
+
+
+def test_copy_bad_fd(tmp_path):
+    with open(tmp_path / "in", "wb") as src, open(tmp_path / "out", "wb") as dst:
+        # a write-only source is an error, not a reason to try another copy
+        with pytest.raises(OSError) as e:
+            copy_fd(src.fileno(), dst.fileno())
+    assert e.value.errno == errno.EBADF
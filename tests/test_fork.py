@@ -0,0 +1,88 @@
+from shshsh import I, Sh, fork_stream
+
+
+def test_fork_to_commands_and_file(tmp_path):
+    with open(tmp_path / "out", "wb") as f:
+        fs = I >> "seq 100000" | fork_stream(f, "wc -l", Sh("tail -n 1"))
+        assert fs[1].stdout.read() == b"100000\n"
+        assert fs[2].stdout.read() == b"100000\n"
+        fs.wait()
+    assert (tmp_path / "out").read_bytes() == b"".join(
+        f"{i}\n".encode() for i in range(1, 100001)
+    )
+
+
+def test_fork_blocking_small_ring():
+    # the slow consumer holds the producer back, the outputs fit in a pipe
+    fs = I >> "seq 50000" | fork_stream(
+        "wc -l", "bash -c 'sleep 0.2; wc -l'", capacity=64
+    )
+    a, b = fs[0].stdout.read(), fs[1].stdout.read()
+    fs.wait()
+    assert a == b == b"50000\n"
+    assert fs.dropped == [0, 0]
+
+
+def test_fork_function_consumer():
+    def upper(line: str) -> str:
+        return line.upper()
+
+    fs = I >> "printf 'a\\nb\\n'" | fork_stream(upper, "cat")
+    res = fs[0] | "grep ."
+    assert res.stdout.read() == b"A\nB\n"
+    assert fs[1].stdout.read() == b"a\nb\n"
+    fs.wait()
+
+
+def test_fork_drop_resumes_on_line():
+    fs = I >> "seq 200000" | fork_stream(
+        "cat", ("bash -c 'sleep 0.5; cat'", "drop"), capacity=4096
+    )
+    fs[0].stdout.read()
+    lines = fs[1].stdout.read().splitlines()
+    fs.wait()
+    assert fs.dropped[1] > 0
+    # every delivered line is whole, and the order is kept
+    assert all(line.isdigit() for line in lines)
+    numbers = [int(line) for line in lines]
+    assert numbers == sorted(numbers)
+
+
+def test_fork_drop_pieces_not_on_line(tmp_path):
+    # reads of the producer and wraps of the ring cut lines, drops must not glue them
+    (tmp_path / "produce.py").write_text(
+        "import os\n"
+        "data = b''.join(b'L%08d\\n' % i for i in range(100000))\n"
+        "for i in range(0, len(data), 4093):\n"
+        "    os.write(1, data[i : i + 4093])\n"
+    )
+    (tmp_path / "consume.py").write_text(
+        "import os, time\n"
+        "while True:\n"
+        "    data = os.read(0, 4096)\n"
+        "    if not data:\n"
+        "        break\n"
+        "    os.write(1, data)\n"
+        "    time.sleep(0.001)\n"
+    )
+    fs = I >> f"python3 {tmp_path}/produce.py" | fork_stream(
+        (f"python3 {tmp_path}/consume.py", "drop"), capacity=8192
+    )
+    lines = fs[0].stdout.read().splitlines()
+    fs.wait()
+    assert fs.dropped[0] > 0
+    assert all(len(line) == 9 and line[:1] == b"L" for line in lines)
+    assert all(line[1:].isdigit() for line in lines)
+    numbers = [int(line[1:]) for line in lines]
+    assert numbers == sorted(set(numbers))
+
+
+def test_fork_spill_keeps_everything():
+    fs = I >> "seq 200000" | fork_stream(
+        "cat", ("bash -c 'sleep 0.5; cat'", "spill"), capacity=4096
+    )
+    a = fs[0].stdout.read()
+    b = fs[1].stdout.read()
+    fs.wait()
+    assert a == b
+    assert fs.dropped == [0, 0]
@@ -0,0 +1,131 @@
+import io
+import re
+import pytest
+from shshsh import Sh
+from shshsh.framing import (
+    Delimited,
+    FixedWidth,
+    Framing,
+    FramingError,
+    LengthPrefixed,
+    RegexDelimited,
+)
+from shshsh.streamer import LineTooLongError, P
+
+
+def records(framing, data: bytes, **kwargs):
+    return list(framing.splitter(io.BytesIO(data), chunk_size=3, **kwargs))
+
+
+def test_fixed_width():
+    assert records(FixedWidth(2), b"abcdefg") == [b"ab", b"cd", b"ef", b"g"]
+    assert records(FixedWidth(2), b"abcd", encoding="utf8") == ["ab", "cd"]
+    assert FixedWidth(3, pad=b" ").encode(b"a") == b"a  "
+    with pytest.raises(FramingError):
+        FixedWidth(3).encode(b"a")
+
+
+@pytest.mark.parametrize("prefix", ["u32", "u32le", "varint"])
+def test_length_prefixed_roundtrip(prefix: str):
+    framing = LengthPrefixed(prefix)  # type: ignore
+    frames = [b"", b"\n\x00", b"x" * 300, b"last"]
+    data = b"".join(map(framing.encode, frames))
+    assert records(framing, data) == frames
+
+
+def test_length_prefixed_errors():
+    framing = LengthPrefixed()
+    with pytest.raises(FramingError):
+        records(framing, framing.encode(b"abcdef")[:-1])
+    with pytest.raises(LineTooLongError):
+        records(framing, framing.encode(b"abcdef"), max_line_length=5)
+
+
+def test_delimiters():
+    assert records(Delimited(b"\r\n"), b"a\r\nb\rc\r\n") == [b"a", b"b\rc"]
+    assert records(Delimited(b"\r\n"), b"a\r\n\r\nb") == [b"a", b"", b"b"]
+    data = b"a\r\nb\nc\r\n\r\nd"
+    assert records(RegexDelimited(rb"\r?\n"), data) == [b"a", b"b", b"c", b"", b"d"]
+    assert records(RegexDelimited(rb"\s+"), b"a  b\t\t\tc  ") == [b"a", b"b", b"c"]
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [rb"\r?\n", rb"\s+", rb";;", rb"a|bcd", rb";{2,}", rb"x\s*y", rb"\n(?=z)"],
+)
+def test_regex_across_reads(pattern: bytes):
+    data = b"1\r\n2\n;;3;;;4 \t5xy6x  y7bcd8abc9\nz10;;;;" * 3
+    expected = re.split(pattern, data)
+    if not expected[-1]:
+        expected.pop()
+    for chunk_size in (1, 2, 3, 7):
+        splitter = RegexDelimited(pattern).splitter(
+            io.BytesIO(data), chunk_size=chunk_size
+        )
+        assert list(splitter) == expected
+
+
+def test_regex_resumes_search():
+    splitter = RegexDelimited(rb"\r\n").splitter(io.BytesIO())
+    for _ in range(1000):
+        assert not splitter.feed(b"abc\r")
+        # a long record is not searched again from its start on every read
+        assert splitter._scan == splitter._end - 1
+    assert splitter.feed(b"\nx") == [b"abc\r" * 999 + b"abc"]
+
+
+@pytest.mark.parametrize(
+    "framing",
+    [
+        Delimited(),
+        Delimited(b"--"),
+        FixedWidth(2),
+        LengthPrefixed(),
+        RegexDelimited(rb";+", sep=b";"),
+    ],
+    ids=type,
+)
+def test_no_empty_last_record(framing):
+    data = b"".join(map(framing.encode, [b"ab", b"cd"]))
+    assert records(framing, data) == [b"ab", b"cd"]
+    assert records(framing, b"") == []
+
+    def upper(record: bytes) -> bytes:
+        return record.upper()
+
+    stage = P(upper, framing=framing, output_framing=Delimited())
+    stage.set_source(io.BytesIO(data))
+    assert bytes(stage.capture()) == b"AB\nCD\n"
+
+
+def test_framing_is_abstract():
+    with pytest.raises(TypeError):
+        Framing()  # type: ignore
+
+
+def test_stage_framing():
+    def frames():
+        for i in range(1000):
+            yield b"\n" * (i % 7) + str(i).encode()
+
+    def strip(frame: bytes) -> bytes:
+        return frame.strip(b"\n")
+
+    source = P(frames, output_framing=LengthPrefixed("varint"))
+    stage = P(strip, framing=LengthPrefixed("varint"), output_framing=Delimited())
+    output = bytes((source | stage).capture())
+    assert output == b"".join(b"%d\n" % i for i in range(1000))
+
+
+def test_workers_framing():
+    def size(line: bytes) -> bytes:
+        return str(len(line)).encode()
+
+    stage = P(size, workers=2, executor="thread", output_framing=FixedWidth(4, b" "))
+    p = Sh("printf 'a\\nbb\\nccc'") | stage | "cat"
+    assert list(p.iter(bytes, framing=FixedWidth(4))) == [b"1   ", b"2   ", b"3   "]
+
+
+def test_sh_iter_framing():
+    sh = Sh("printf 'a1b22c333'")
+    assert list(sh.iter(framing=RegexDelimited(rb"[0-9]+"))) == ["a", "b", "c"]
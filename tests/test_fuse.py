@@ -0,0 +1,64 @@
+import threading
+from typing import List
+from shshsh import I
+from shshsh.streamer import P
+
+
+def upper(line: str) -> str:
+    return line.upper()
+
+
+def double(line: bytes) -> bytes:
+    return line + b"\n" + line
+
+
+def tag(line: str) -> str:
+    return f"<{line}>"
+
+
+def drop_b(line: str):
+    if line != "B":
+        return line
+
+
+def test_fused_same_as_pipe():
+    fused = I >> "printf 'a\nb\nc\n'" | upper | drop_b | double | tag
+    assert fused._head is not None
+    separate = (
+        I >> "printf 'a\nb\nc\n'"
+        | upper
+        | P(drop_b, fuse=False)
+        | P(double, fuse=False)
+        | P(tag, fuse=False)
+    )
+    assert separate._head is None
+    lines = list(fused | "cat")
+    assert lines == list(separate | "cat")
+    assert lines[:4] == ["<A>", "<A>", "<C>", "<C>"]
+
+
+def test_fused_one_thread():
+    before = threading.active_count()
+    res = I >> "seq 10000" | upper | tag | drop_b
+    assert threading.active_count() == before
+    res.run()
+    assert res.t is res._head.t
+    assert threading.active_count() <= before + 1
+    lines = bytes(res.capture()).split(b"\n")
+    assert lines[:2] == [b"<1>", b"<2>"]
+    assert len(lines) == 10000 + 4
+
+
+def test_fused_source():
+    res = I >> (f"{i}" for i in range(3)) | double | tag
+    assert res._head is not None
+    assert bytes(res.capture()) == b"<0>\n<0>\n<1>\n<1>\n<2>\n<2>\n<>\n<>\n<>\n"
+
+
+def test_not_fused():
+    def batch(lines: List[str]) -> List[str]:
+        return lines
+
+    res = I >> "seq 3" | upper | batch
+    assert res._head is None
+    assert list(res | "cat") == ["1", "2", "3", "", "", ""]
@@ -0,0 +1,73 @@
+import os
+from typing import Set
+import threading
+import pytest
+from shshsh import L, Sh
+from shshsh.lazy import Pipeline
+from shshsh.reaper import get_reaper
+
+
+def upper(line: str) -> str:
+    return line.upper()
+
+
+def tag(line: str) -> str:
+    return f"<{line}>"
+
+
+def test_nothing_starts():
+    before = threading.active_count()
+    pipeline = L >> "printf 'a\nb\n'" | upper | tag | "grep -v '^<>$'"
+    assert isinstance(pipeline, Pipeline)
+    assert not pipeline.started
+    assert threading.active_count() == before
+    assert list(pipeline) == ["<A>", "<B>", ""]
+
+
+def test_stages_fused():
+    pipeline = L >> "seq 3" | upper | tag
+    last = pipeline.run()
+    assert last._head is not None
+    assert bytes(last.capture()) == b"<1>\n<2>\n<3>\n<>\n<>\n"
+
+
+def test_capture_and_iter():
+    assert bytes((L >> "seq 3" | "tac").capture()) == b"3\n2\n1\n"
+    assert list(L >> (str(i) for i in range(2)) | tag) == ["<0>", "<1>", "<>", ""]
+    assert list((L >> "seq 2" | upper).iter(bytes)) == [b"1", b"2", b"", b""]
+
+
+def test_sink(tmp_path):
+    with open(tmp_path / "out", "wb") as f:
+        res = L >> "seq 3" | upper | "tac" | f
+        assert isinstance(res, Sh)
+        res.wait()
+    assert (tmp_path / "out").read_bytes() == b"\n3\n2\n1\n"
+
+
+def test_incomplete_args():
+    with pytest.raises(ValueError):
+        L >> "seq 3" | "echo #{}"
+
+
+def pipes() -> Set[str]:
+    found = set()
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            target = os.readlink(f"/proc/self/fd/{fd}")
+        except OSError:
+            continue
+        if target.startswith("pipe:"):
+            found.add(target)
+    return found
+
+
+def test_failed_start_cleans_up():
+    get_reaper()
+    before = pipes()
+    pipeline = L >> "sleep 10" | upper | "not-a-command-shshsh"
+    with pytest.raises(FileNotFoundError):
+        pipeline.run()
+    assert not pipeline.started
+    # pipes of earlier tests may be closed meanwhile
+    assert pipes() <= before
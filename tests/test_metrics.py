@@ -0,0 +1,57 @@
+from typing import Optional
+from shshsh import I, Sh, global_vars
+from shshsh.metrics import report, stages
+
+
+def test_metrics_disabled():
+    res = I >> "seq 10" | "cat"
+    assert res.metrics is None
+    assert res.stdout.read()
+
+
+def test_metrics_pipeline():
+    done = []
+
+    def double(line: str) -> str:
+        return line * 2
+
+    res = Sh("seq 1000", metrics=done.append) | double | "grep 0"
+    lines = list(res)
+    assert lines[0] == "1010"
+    res.wait()
+    p = res._prev
+    p.wait()
+    assert [stage.metrics.name for stage in stages(res)] == [
+        "seq 1000",
+        "double",
+        "grep 0",
+    ]
+    assert p.metrics.input.records == 1001
+    assert p.metrics.input.bytes == len("".join(f"{i}\n" for i in range(1, 1001)))
+    assert p.metrics.output.records == 1001
+    assert p.metrics.cpu_time > 0
+    assert res.metrics.output.records == len(lines)
+    assert res.metrics.spawn_time > 0
+    # commands are finished by the reaper as they exit, waited for or not
+    p._prev.wait()
+    assert {m.name for m in done} == {"seq 1000", "double", "grep 0"}
+    table = report(res).splitlines()
+    assert len(table) == 4
+    assert table[2].startswith("double")
+
+
+def test_metrics_global_hook():
+    done = []
+    global_vars.METRICS, global_vars.METRICS_HOOK = True, done.append
+    try:
+
+        def keep_odd(line: bytes) -> Optional[bytes]:
+            return line if line and int(line) % 2 else None
+
+        res = I >> "seq 10" | keep_odd | "cat"
+        assert res.capture()[:] == b"1\n3\n5\n7\n9\n"
+        res.wait()
+    finally:
+        global_vars.METRICS, global_vars.METRICS_HOOK = False, None
+    assert res.metrics.output.bytes == 10
+    assert [m.as_dict()["name"] for m in done][-1] == "cat"
@@ -0,0 +1,52 @@
+import os
+from shshsh import Pipe, Sh, mux
+from shshsh.mux import Mux
+
+BOTH = "sh -c 'seq 100000; seq 100000 >&2'"
+
+
+def test_both_streams_no_deadlock():
+    counts = {}
+    first, second = Sh(BOTH), Sh(BOTH)
+    for stream, line in mux(first, second):
+        key = (stream.source is first, stream.name)
+        counts[key] = counts.get(key, 0) + 1
+        assert line
+    assert counts == {
+        (True, "stdout"): 100000,
+        (True, "stderr"): 100000,
+        (False, "stdout"): 100000,
+        (False, "stderr"): 100000,
+    }
+    assert first.wait().code == 0 and second.wait().code == 0
+
+
+def test_callbacks():
+    out, err = [], []
+    m = Mux(result_type=bytes)
+    m.add(
+        Sh("sh -c 'echo o; echo e >&2'"), {"stdout": out.append, "stderr": err.append}
+    )
+    m.add(Sh("printf 'x\ny'"), out.append, streams=["stdout"])
+    assert len(m) == 3
+    m.run()
+    assert sorted(out) == [b"o", b"x", b"y"]
+    assert err == [b"e"]
+
+
+def test_pipe_and_fd():
+    pipe = Pipe()
+    read_fd, write_fd = os.pipe()
+    m = Mux()
+    m.add(pipe)
+    m.add(read_fd)
+    os.write(pipe.in_fd, b"from pipe\n")
+    pipe.close_in()
+    os.write(write_fd, b"a\0b")
+    os.close(write_fd)
+    assert sorted((stream.name, line) for stream, line in m) == [
+        ("fd", "a\0b"),
+        ("pipe", "from pipe"),
+    ]
+    m.close()
+    os.close(read_fd)
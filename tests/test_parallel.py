@@ -0,0 +1,23 @@
+import pytest
+from shshsh import pmap
+
+
+def test_pmap():
+    results = sorted(
+        pmap("sh -c #{}", [f"echo {i}; exit {i % 2}" for i in range(10)], jobs=3)
+    )
+    assert [r.index for r in results] == list(range(10))
+    assert [r.code for r in results] == [i % 2 for i in range(10)]
+    assert [r.stdout for r in results] == [f"{i}\n".encode() for i in range(10)]
+
+
+def test_pmap_args():
+    results = list(pmap("echo #{} #{}", [("a", "b"), ("c", "d")], jobs=1))
+    assert [r.stdout for r in results] == [b"a b\n", b"c d\n"]
+    results = list(pmap("echo #{name}", [{"name": "x; ls"}]))
+    assert results[0].stdout == b"x; ls\n"
+
+
+def test_pmap_missing_args():
+    with pytest.raises(ValueError):
+        list(pmap("echo #{} #{}", ["a"]))
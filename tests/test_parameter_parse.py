@@ -33,3 +33,16 @@ def test_miss_argument():
 def test_spec_filename():
     res = I >> "cat tests/case1/spec_[token]"
     assert res.stdout.read() == b"content"
+
+
+def test_template_reuse():
+    for i in range(3):
+        res = Sh("echo #{} #{name} #{}") % {"name": "n"} % str(i) % "x"
+        assert res.cmd == ["echo", str(i), "n", "x"]
+        assert res.param_complete
+    assert Sh._compile("echo #{} #{name} #{}", "#{*}") is res._template
+
+
+def test_fill_value_like_placeholder():
+    res = Sh("echo #{}#{}") % ("#{}", "x")
+    assert res.stdout.read() == b"#{}x\n"
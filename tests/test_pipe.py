@@ -1,4 +1,6 @@
+from typing import Iterable, List, Optional
 from shshsh import I, Sh, Pipe
+from shshsh.streamer import P
 
 
 def test_simple_pipe():
@@ -57,3 +59,68 @@ def test_bytes_source_pipe():
 
     res = I >> source() | "grep 1"
     assert res.stdout.read() == b"test1\n"
+
+
+def test_batch_function_pipe():
+    def upper(lines: List[str]) -> List[str]:
+        return [line.upper() for line in lines if line]
+
+    res = I >> "printf 'a\\nb\\nc\\n'" | upper | "cat"
+    assert res.stdout.read() == b"A\nB\nC\n"
+
+
+def test_batch_pipe():
+    def total(lines: List[bytes]) -> Iterable[bytes]:
+        yield str(len(lines)).encode("utf8")
+
+    res = I >> "seq 10" | P.batch(total, size=4) | "cat"
+    sizes = [int(size) for size in res.stdout.read().split()]
+    assert sum(sizes) == 11  # 10 lines and the empty tail
+    assert max(sizes) <= 4
+
+
+def test_drop_and_pass_through():
+    def keep_odd(line: str) -> Optional[str]:
+        if line and int(line) % 2:
+            return line
+        return None
+
+    res = I >> "seq 6" | keep_odd | "cat"
+    assert res.stdout.read() == b"1\n3\n5\n"
+
+
+def test_pass_through_non_ascii():
+    def same(line: str) -> str:
+        return line
+
+    res = I >> "printf 'hé\\n你好'" | same | "cat"
+    assert res.stdout.read() == "hé\n你好\n".encode("utf8")
+
+
+def square(line: str) -> Optional[str]:
+    return str(int(line) ** 2) if line else None
+
+
+def test_process_pool_pipe():
+    res = I >> "seq 1000" | P(square, workers=2, task_size=7) | "cat"
+    assert res.stdout.read() == "".join(f"{i * i}\n" for i in range(1, 1001)).encode()
+
+
+def test_unordered_pool_pipe():
+    res = (
+        I >> "seq 1000"
+        | P(square, workers=2, executor="thread", ordered=False, task_size=7)
+        | "sort -n"
+    )
+    assert res.stdout.read() == "".join(f"{i * i}\n" for i in range(1, 1001)).encode()
+
+
+def test_process_pool_after_source_stage():
+    # the workers must not keep the pipe of the source open, or wc never ends
+    def numbers():
+        for i in range(1, 1001):
+            yield str(i)
+
+    for _ in range(3):
+        res = I >> numbers() | P(square, workers=2, task_size=100) | "wc -l"
+        assert res.stdout.read() == b"1000\n"
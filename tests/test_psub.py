@@ -0,0 +1,54 @@
+import os
+import subprocess
+from typing import List
+from shshsh import I, Sh, psub
+
+
+def open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_read_substitutions():
+    res = Sh("diff #{} #{}")(psub("seq 3"), psub(Sh("seq 4")))
+    assert res.stdout.read() == b"3a4\n> 4\n"
+    assert res.wait().code == 1
+    res = Sh("comm -12 #{a} #{b}")(
+        a=psub(I >> "printf 'a\\nb\\nc\\n'" | "cat"), b=psub(iter(["b", "c", "d"]))
+    )
+    assert res.stdout.read() == b"b\nc\n"
+
+
+def test_write_substitutions():
+    got: List[str] = []
+
+    def collect(line: str):
+        got.append(line)
+
+    count = psub(Sh("wc -l", stdout=subprocess.PIPE), "w")
+    res = I >> "seq 3" | Sh("tee #{} #{}")(psub(collect, "w"), count)
+    assert res.stdout.read() == b"1\n2\n3\n"
+    assert count.stage.stdout.read().strip() == b"3"
+    res._substitutions[0].stage.wait()
+    assert got == ["1", "2", "3", ""]
+
+
+def test_producers_run_concurrently():
+    # each producer blocks until the consumer reads, a big output needs both
+    res = Sh("paste -d, #{} #{}")(psub("seq 100000"), psub("seq 100000"))
+    lines = res.stdout.read().split()
+    assert len(lines) == 100000
+    assert lines[-1] == b"100000,100000"
+
+
+def test_fds_closed():
+    Sh("paste #{} #{}")(psub("seq 3"), psub(iter("abc"))).wait()
+    before = open_fds()
+    for _ in range(50):
+        subs = [psub("seq 3"), psub(iter("abc"))]
+        res = Sh("paste #{} #{}")(*subs)
+        assert res.stdout.read() == b"1\ta\n2\tb\n3\tc\n"
+        res.wait()
+        res.stdout.close()
+        assert all(sub.in_closed and sub.out_closed for sub in subs)
+    # other tests may still be closing theirs, a leak would be one per run
+    assert open_fds() < before + 10
@@ -0,0 +1,89 @@
+import errno
+import os
+import signal
+import subprocess
+import threading
+import time
+from shshsh import Pipe, Sh
+from shshsh.reaper import Reaper
+
+
+def test_callback_does_not_block():
+    done = threading.Event()
+    started = time.monotonic()
+    res = Sh("sleep 0.3", callback=done.set)
+    res.run()
+    assert time.monotonic() - started < 0.2
+    assert done.wait(5)
+    assert res.code == 0
+    assert res.rusage is not None
+
+
+def test_many_callbacks_one_thread():
+    before = threading.active_count()
+    done = []
+    res = [Sh("sleep 0.2", callback=lambda: done.append(1)) for _ in range(50)]
+    for r in res:
+        r.run()
+    assert threading.active_count() <= before + 1
+    for r in res:
+        r.wait()
+    deadline = time.monotonic() + 5
+    while len(done) < 50 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(done) == 50
+
+
+def test_exit_code_and_wait():
+    res = Sh("sh -c 'exit 3'")
+    res.run()
+    assert res.wait().code == 3
+    killed = Sh("sleep 10")
+    killed.run()
+    killed._proc.kill()
+    assert killed.wait().code == -9
+
+
+def test_pipe_closed_on_exit():
+    pipe = Pipe()
+    res = Sh(f"sh -c 'echo 123 > {pipe.write_path}'") % pipe
+    res.run()
+    res.wait()
+    with os.fdopen(pipe.out_fd, "rb") as f:
+        assert f.read() == b"123\n"
+    assert pipe.in_closed
+
+
+def test_without_pidfd(monkeypatch):
+    monkeypatch.delattr(os, "pidfd_open", raising=False)
+    reaper = Reaper(poll_interval=0.01)
+    exited = threading.Event()
+    proc = subprocess.Popen(["sh", "-c", "exit 5"])
+    reaper.watch(proc, lambda proc, rusage: exited.set())
+    assert exited.wait(5)
+    assert proc.returncode == 5
+    # polled, the signal handlers of the host are not touched
+    assert signal.getsignal(signal.SIGCHLD) == signal.SIG_DFL
+
+
+def test_pidfd_denied(monkeypatch):
+    def denied(pid: int, flags: int = 0) -> int:
+        raise OSError(errno.ENOSYS, "pidfd_open")
+
+    monkeypatch.setattr(os, "pidfd_open", denied)
+    done = threading.Event()
+    res = Sh("sh -c 'echo hi; exit 2'", callback=done.set)
+    assert res.stdout.read() == b"hi\n"
+    assert done.wait(5)
+    assert res.code == 2
+
+
+def test_watch_only_with_exit_consumer(monkeypatch):
+    watched = []
+    monkeypatch.setattr(
+        Reaper, "watch", lambda self, proc, cb=None: watched.append(proc)
+    )
+    Sh("true").wait()
+    assert not watched
+    Sh("true", callback=lambda: None).run()
+    assert len(watched) == 1
@@ -0,0 +1,107 @@
+import os
+import subprocess
+import pytest
+from shshsh import I, Pipe, Sh, Session, SessionPool
+from shshsh.session import _Job
+
+
+@pytest.fixture
+def session():
+    with Session() as session:
+        yield session
+
+
+def test_session_run(session):
+    res = session.sh("echo #{}")("123")
+    assert res.stdout.read() == b"123\n"
+    assert isinstance(res._proc, _Job)
+    assert res.wait().code == 0
+
+
+def test_session_chain(session):
+    assert (session.sh("seq 3") | "grep 2").stdout.read() == b"2\n"
+    assert list(I >> "printf 'a\\nb\\n'" | session.sh("cat")) == ["a", "b", ""]
+    assert (session.sh("false") & "echo no").stdout.read() == b""
+    assert session.sh("false").or_("echo yes").stdout.read() == b"yes\n"
+
+
+def test_session_builtin(session):
+    assert session.sh("test -f README.md").wait().code == 0
+    assert session.sh("test -f not-exists").wait().code == 1
+    assert session.sh("pwd", cwd="tests").stdout.read().endswith(b"/tests\n")
+
+
+def test_session_cwd_env(session):
+    assert session.sh("ls", cwd="tests/case").stdout.read().count(b"\n") == 6
+    res = session.sh("printenv SHSH_X", env_update={"SHSH_X": "a 'b'"})
+    assert res.stdout.read() == b"a 'b'\n"
+
+
+def test_session_stdio(session):
+    res = session.sh("cat", stdin=subprocess.PIPE)
+    res.run()
+    res._proc.stdin.write(b"hi")
+    res._proc.stdin.close()
+    assert res.stdout.read() == b"hi"
+    res = session.sh("ls not-exists") >= subprocess.STDOUT
+    assert b"not-exists" in res.stdout.read()
+    assert res.wait().code == 2
+
+
+def test_session_pass_fds(session):
+    pipe = Pipe()
+    res = I >> "echo 123" | Sh(f"tee {pipe.write_path}", spawn=session) % pipe
+    assert res.stdout.read() == b"123\n"
+    assert (I >> pipe | "cat").stdout.read() == b"123\n"
+
+
+def test_session_not_found(session):
+    with pytest.raises(FileNotFoundError):
+        session.sh("not-exists-cmd").run()
+
+
+def test_session_kill(session):
+    res = session.sh("sleep 10")
+    res.run()
+    res._proc.kill()
+    assert res.wait().code == 128 + 9
+
+
+def test_session_pool():
+    with SessionPool(size=2) as pool:
+        res = [pool.sh("echo #{}")(str(i)) for i in range(6)]
+        assert [r.stdout.read() for r in res] == [f"{i}\n".encode() for i in range(6)]
+
+
+def test_session_env_names_and_bytes():
+    with Session(env={"PATH": os.environ["PATH"], "BAD-NAME": "a"}) as session:
+        # a changed value of a name bash cannot export is not shell code
+        res = session.sh("printenv BAD-NAME", env_update={"BAD-NAME": "$(echo x)"})
+        assert res.stdout.read() == b"$(echo x)\n"
+        assert not isinstance(res._proc, _Job)
+    with Session() as session:
+        res = session.sh("printenv SHSH_X", env_update={"SHSH_X": "a\udcff"})
+        assert res.stdout.read() == b"a\xff\n"
+        assert isinstance(res._proc, _Job)
+
+
+def test_session_regular_files(session, tmp_path):
+    path = tmp_path / "in"
+    path.write_bytes(b"skip\nrest\n")
+    with open(path, "rb") as f:
+        f.seek(5)
+        # read from the offset of the file, like with popen
+        res = session.sh("cat", stdin=f)
+        assert res.stdout.read() == b"rest\n"
+        assert not isinstance(res._proc, _Job)
+    with open(path, "r+b") as f:
+        f.write(b"SKIP")
+        f.flush()
+        # written at the offset of the file, like with popen
+        session.sh("echo new", stdout=f).wait()
+    assert path.read_bytes() == b"SKIPnew\nt\n"
+    with open(path, "ab") as f:
+        res = session.sh("echo end", stdout=f)
+        res.wait()
+        assert isinstance(res._proc, _Job)
+    assert path.read_bytes() == b"SKIPnew\nt\nend\n"
@@ -0,0 +1,90 @@
+from typing import List
+import io
+import pytest
+from shshsh import I, IZ
+from shshsh.framing import FixedWidth, LengthPrefixed
+from shshsh.shard import split_ranges
+from shshsh.streamer import P
+
+
+@pytest.fixture
+def log(tmp_path):
+    path = tmp_path / "log"
+    path.write_bytes(b"".join(b"%d\n" % i for i in range(20000)))
+    return str(path)
+
+
+def upper_odd(line: str):
+    if int(line) % 2:
+        return f"<{line}>"
+
+
+def total(lines: List[bytes]) -> List[bytes]:
+    return [str(sum(map(int, lines))).encode()]
+
+
+def test_split_ranges():
+    data = b"a\nbb\nccc\ndddd"
+    for parts in range(1, 8):
+        ranges = split_ranges(data, parts, b"\n")
+        assert len(ranges) <= parts
+        assert b"".join(data[start:end] for start, end in ranges) == data
+        assert all(data[end - 1 : end] == b"\n" for _, end in ranges[:-1])
+    assert split_ranges(b"abc", 4, b"\n") == [(0, 3)]
+
+
+def test_commands_ordered(log: str):
+    shards = I.shard(log, 4)
+    assert len(shards.ranges()) == 4
+    assert list(shards | "grep 7$" | "cat")[:-1] == [
+        str(i) for i in range(20000) if i % 10 == 7
+    ]
+    assert [sh.code for sh in shards.commands] == [0] * 4
+
+
+def test_commands_unordered(log: str):
+    lines = list(I.shard(log, 3, ordered=False) | "cat" | "cat")[:-1]
+    assert sorted(lines, key=int) == [str(i) for i in range(20000)]
+
+
+def test_command_placeholder(log: str):
+    shards = I.shard(log, 3)
+    with open(log, "rb") as f:
+        data = f.read()
+    firsts = [data[start:end].split(b"\n")[0] for start, end in shards.ranges()]
+    lines = list(shards | "sh -c 'head -n 1 | sed s/^/#{shard}:/'" | "cat")
+    assert lines[:-1] == [f"{i}:{int(first)}" for i, first in enumerate(firsts)]
+
+
+def test_function(log: str):
+    res = I.shard(log, 3) | P(upper_odd, executor="thread") | "cat"
+    assert list(res)[:-1] == [f"<{i}>" for i in range(1, 20000, 2)]
+    res = I.shard(log, 3, ordered=False) | P.batch(total, executor="thread")
+    assert sum(map(int, bytes(res.capture()).split())) == sum(range(20000))
+
+
+def test_function_processes(log: str):
+    assert len(list(I.shard(log, 2) | upper_odd | "cat")) == 10001
+
+
+def test_zero(tmp_path):
+    path = tmp_path / "zero"
+    path.write_bytes(b"a\nb\x00c\x00d")
+    res = IZ.shard(str(path), 2) | "cat" | "cat"
+    assert list(res.iter(bytes, sep=b"\x00")) == [b"a\nb", b"c", b"d", b""]
+
+
+def test_function_options(log: str):
+    def sizes(lines: List[str]) -> List[str]:
+        return [str(len(lines))]
+
+    res = I.shard(log, 2) | P.batch(sizes, 1000, executor="thread")
+    counts = list(map(int, bytes(res.capture()).split()))
+    assert max(counts) == 1000 and sum(counts) == 20000
+    res = I.shard(log, 2) | P(
+        upper_odd, executor="thread", output_framing=LengthPrefixed()
+    )
+    records = list(LengthPrefixed().splitter(io.BytesIO(bytes(res.capture()))))
+    assert records == [f"<{i}>".encode() for i in range(1, 20000, 2)]
+    with pytest.raises(AssertionError):
+        I.shard(log, 2) | P(upper_odd, framing=FixedWidth(4))
@@ -0,0 +1,27 @@
+import pytest
+from shshsh import Sh, I, Pipe
+from shshsh.spawn import _PosixSpawnPopen
+
+
+def test_posix_spawn():
+    res = Sh("echo 123", spawn="posix_spawn")
+    assert res.stdout.read() == b"123\n"
+    assert isinstance(res._proc, _PosixSpawnPopen)
+
+
+def test_posix_spawn_pass_fds():
+    pipe = Pipe()
+    res = I >> "echo 123" | Sh(f"tee {pipe.write_path}", spawn="posix_spawn") % pipe
+    assert res.stdout.read() == b"123\n"
+    assert (I >> pipe | "cat").stdout.read() == b"123\n"
+
+
+def test_posix_spawn_fallback_cwd():
+    res = Sh("ls", cwd="tests/case", spawn="posix_spawn")
+    assert res.stdout.read().count(b"\n") == 6
+    assert not isinstance(res._proc, _PosixSpawnPopen)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        Sh("true", spawn="fork")
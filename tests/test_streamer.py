@@ -0,0 +1,125 @@
+import asyncio
+import io
+import os
+import time
+import pytest
+from shshsh import I
+from shshsh.streamer import (
+    bytes_streamer,
+    str_streamer,
+    LineTooLongError,
+    ReadSizer,
+    BatchWriter,
+    P,
+)
+
+
+def test_split_across_chunks():
+    data = b"abc||defg||||h"
+    res = list(bytes_streamer(io.BytesIO(data), sep=b"||", chunk_size=3))
+    assert res == data.split(b"||")
+
+
+def test_no_sep():
+    data = b"x" * 100000
+    assert list(bytes_streamer(io.BytesIO(data), chunk_size=7)) == [data]
+
+
+def test_trailing_sep():
+    assert list(str_streamer(io.BytesIO("a\nb\n".encode("utf8")))) == ["a", "b", ""]
+
+
+def test_max_line_length():
+    data = b"short\n" + b"y" * 100 + b"\n"
+    with pytest.raises(LineTooLongError):
+        list(bytes_streamer(io.BytesIO(data), chunk_size=8, max_line_length=50))
+    assert list(bytes_streamer(io.BytesIO(data), max_line_length=100))[1] == b"y" * 100
+
+
+def test_read_sizer():
+    sizer = ReadSizer()
+    sizer.update(sizer.size)
+    assert sizer.size == ReadSizer.MIN_SIZE * 2
+    sizer.update(1)
+    assert sizer.size == ReadSizer.MIN_SIZE
+
+
+def test_auto_chunk_size():
+    lines = list(I(chunk_size="auto") >> "seq 100000")
+    assert lines[-2] == "100000"
+    assert len(lines) == 100001
+
+    def same(line: str) -> str:
+        return line
+
+    res = I >> "seq 100000" | P(same, chunk_size="auto")
+    assert (res | "wc -l").stdout.read() == b"100001\n"
+
+
+def test_batch_writer():
+    r, w = os.pipe()
+    writer = BatchWriter(w, b"\n", buffer_size=8, flush_interval=60)
+    writer.write(b"a")  # first record is written through
+    assert os.read(r, 10) == b"a\n"
+    writer.write(b"bb")
+    writer.write(b"cc")
+    writer.write(b"dd")
+    assert os.read(r, 10) == b"bb\ncc\ndd\n"
+    writer.write(b"e")
+    writer.close()
+    assert os.read(r, 10) == b"e\n"
+    os.close(r)
+
+
+def test_slow_producer_latency():
+    def source():
+        yield "first"
+        time.sleep(1)
+        yield "second"
+
+    p = I >> source()
+    p.run()
+    start = time.monotonic()
+    assert os.read(p.out_fd, 100) == b"first\n"
+    assert time.monotonic() - start < 0.5
+
+
+def test_bursty_source_latency():
+    def source():
+        for burst in range(2):
+            yield from (f"{burst}{i}" for i in range(3))
+            time.sleep(1)
+        yield "last"
+
+    def timed(res) -> list:
+        start = time.monotonic()
+        return [(line, time.monotonic() - start) for line in res]
+
+    arrived = timed(I >> source() | "cat")
+    assert [line for line, _ in arrived][:-1] == [
+        "00",
+        "01",
+        "02",
+        "10",
+        "11",
+        "12",
+        "last",
+    ]
+    # each burst comes out before the source sleeps
+    assert all(at < 0.5 for _, at in arrived[:3])
+    assert all(1 <= at < 1.5 for _, at in arrived[3:6])
+
+    async def asource():
+        for burst in range(2):
+            for i in range(3):
+                yield f"{burst}{i}"
+            await asyncio.sleep(1)
+
+    async def main():
+        start = time.monotonic()
+        res = I >> asource() | "cat"
+        return [(line, time.monotonic() - start) async for line in res]
+
+    arrived = asyncio.run(main())
+    assert all(at < 0.5 for _, at in arrived[:3])
+    assert all(1 <= at < 1.5 for _, at in arrived[3:6])